@@ -1,25 +1,45 @@
 #!/usr/bin/env python3
 
+import glob
+import gzip
+import hmac
+import os
 import threading
 import time
 from traceback import print_exc
-from typing import Any
+from typing import Any, Callable, Iterator
 
 import adafruit_ads1x15.ads1015 as ADS
 from adafruit_ads1x15.ads1x15 import Pin
 import board
 import busio
-from flask import Flask, jsonify, redirect, request
+from flask import Flask, Response, jsonify, redirect, request
+import numpy as np
 
+from .broadcaster import Broadcaster, format_event
 from .collector import Collector
-from .csv_database import CSVDatabase, Cursor, flatten_dict
+from .csv_database import FSYNC_BATCH, Schema
+from .database import Database, open_database
+from .downsample import AGGREGATES, BucketAggregator, lttb
+from .metrics import Metrics
 from .predictor import (
-    KerasPredictor,
+    LazyPredictor,
+    ModelPredictor,
     PassthroughPredictor,
     Predictor,
-    RandomForestPredictor,
+    load_autoencoder,
+    load_random_forest,
 )
+from .predictor_pool import PredictorPool
+from .profiling import MemoryTracker, SamplingProfiler, ThreadProfiler, collapsed, stats_text
+from .model_registry import ModelRegistry
+from .replay import Replay
+from .ring_buffer import RingBuffer
+from .rollup import ROLLUP_WIDTHS, RollupSet
+from .segmented_database import SegmentedDatabase
 from .sensor import FlowSensor, PressureSensor, RandomizedSensor, Sensor
+from .shared_ring import SharedArea, SharedRing, SharedState
+from .supervisor import CommandClient, serve_commands
 from .valve import GPIOValve, ManualValve, TestValve, Valve, ValveState
 
 MAX_REPLAY_DELAY = 3  # seconds
@@ -28,6 +48,56 @@ LOOP_DELAY = 0.2  # seconds
 COLLECTOR_DB_PATH = f"collect-%.csv"
 PREDICTOR_DB_PATH = f"predict-%.csv"
 REPLAY_PATH = "replay/replay.csv"
+REPLAY_SOURCES = [REPLAY_PATH, "collect-*.csv", "collect-*.bin"]  # globs for /api/replay?file=
+REPLAY_BLOCK_ROWS = 256  # rows per read of the replay reader
+REPLAY_PREFETCH = 4  # blocks read ahead
+REPLAY_STATE_INTERVAL = 0.5  # seconds between replay events on the stream
+DB_COMMIT_ROWS = 50  # rows
+DB_COMMIT_INTERVAL = 1.0  # seconds
+PREDICTOR_DB_ROLL = None  # "hour" or "day" splits predict-*.csv into segments, None keeps one file
+PREDICTOR_DB_RETENTION = None  # seconds, only with PREDICTOR_DB_ROLL; None keeps everything
+PREDICTOR_DB_ARCHIVE = None  # directory for expired segments, None deletes them
+LIVE_WINDOW = 5 * 60  # seconds of predictions kept in memory
+STREAM_QUEUE_SIZE = 256  # events per client before dropping the oldest
+STREAM_KEEPALIVE = 15  # seconds
+GZIP_MIN_SIZE = 1024  # bytes
+GZIP_LEVEL = 5
+READ_BLOCK_ROWS = 4096  # rows per block when streaming long ranges
+PREDICTOR_ROLLUPS = ROLLUP_WIDTHS  # label -> bucket width in seconds
+PREDICTOR_QUEUE_SIZE = 25  # rows per predictor before dropping the oldest
+ENABLED_PREDICTORS = ["none", "ae", "rf"]  # see predictor_factories
+PREDICTOR_WARMUP = False  # load and warm up models at startup instead of on first use
+PREDICTION_CACHE_SIZE = 0  # predictions kept per model, 0 disables the cache
+PREDICTION_CACHE_STEP = 0.01  # rounding of the inputs for the cache key
+PREDICTION_CACHE_STEPS: dict[str, float] = {  # feature -> own step
+    "valves.change_time": 10.0,  # loopt elke rij op, met de standaardstap zou elke sleutel uniek zijn
+}
+MODEL_DIR = "dashboard/model"  # unversioned models, version 0
+MODEL_REGISTRY = "dashboard/model/registry"  # <name>/<version>/<name>.*
+MODEL_WATCH_INTERVAL = None  # seconds between registry checks, None only reloads on request
+METRICS_ENABLED = False  # time the stages of the sampling loop and the predictors, see /api/metrics
+METRICS_CSV_PATH = None  # e.g. "metrics.csv": one row of stage timings per loop iteration
+ADMIN_TOKEN: str | None = None  # X-Admin-Token for /api/admin/*, None disables them
+PROFILE_DIR = "profiles"  # profiles from /api/admin/profile are kept here
+PROFILE_MAX_SECONDS = 120
+PROFILE_TARGETS = ["acquisition", "api"]  # processes /api/admin/profile?target= can profile in the API role
+SAMPLING_INTERVAL = 0.005  # seconds between stack samples
+TRACEMALLOC_FRAMES = 1  # frames per allocation, more shows callers but costs more
+PROCESS_ROLE = os.environ.get("DASHBOARD_ROLE", "all")  # "acquisition" or "api" under dashboard.supervisor
+SHARED_MEMORY = os.environ.get("DASHBOARD_SHM")  # shared memory segment of the supervisor
+SHARED_RING_COLUMNS = 64  # columns per row in the shared live window
+SHARED_STATE_SIZE = 64 * 1024  # bytes for the valve, collector and replay state
+SHARED_WAIT = 30  # seconds the API waits for the acquisition to set up the shared memory
+SHARED_POLL_INTERVAL = 0.05  # seconds between reads of the shared rings for the stream
+HISTORY_REFRESH_INTERVAL = 1.0  # seconds between rereads of the databases by the API
+COMMAND_TIMEOUT = 10  # seconds the API waits for the acquisition to answer a request
+
+startup_begin = time.perf_counter()
+startup_times: dict[str, float] = {}
+metrics = Metrics(METRICS_ENABLED)
+thread_profiler = ThreadProfiler()
+memory_tracker = MemoryTracker()
+profile_lock = threading.Lock()
 
 valves: dict[str, Valve] = {
     'bigvalve0': ManualValve(),
@@ -58,12 +128,32 @@ sensors: dict[str, Sensor] = {
     'pressure5': RandomizedSensor("bar", 0, 5),
 }
 
-predictors: dict[str, Predictor] = {
-    "none": PassthroughPredictor(),
-    "ae": KerasPredictor("dashboard/model/ae", ["timestamp"]),
-    "rf": RandomForestPredictor("dashboard/model/rf", ["timestamp"]),
+
+def cached(predictor: ModelPredictor) -> ModelPredictor:
+    if PREDICTION_CACHE_SIZE > 0:
+        predictor.enable_cache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_STEP, PREDICTION_CACHE_STEPS)
+    return predictor
+
+
+# factory(pad-prefix van de modelversie) per predictor. Een model dat de GIL
+# vasthoudt kan in een eigen proces draaien:
+# "ae": lambda path: ProcessPredictor(lambda: load_autoencoder(path, ["timestamp"]))
+predictor_factories: dict[str, Callable[[str], Predictor]] = {
+    "none": lambda path: PassthroughPredictor(),
+    "ae": lambda path: cached(load_autoencoder(path, ["timestamp"])),
+    "rf": lambda path: cached(load_random_forest(path, ["timestamp"])),
 }
 
+# modellen worden pas bij het eerste gebruik geladen, in de laatste versie
+model_registry = ModelRegistry(MODEL_REGISTRY, MODEL_DIR)
+predictors: dict[str, LazyPredictor] = {}
+for name in ENABLED_PREDICTORS:
+    version = model_registry.latest(name)
+    predictors[name] = LazyPredictor(name, predictor_factories[name],
+                                     model_registry.path(name, version), version)
+model_loading: dict[str, int] = {}  # naam -> versie die op de achtergrond laadt
+model_loading_lock = threading.Lock()
+
 
 def sensor_init():
     try:
@@ -112,46 +202,234 @@ def valves_init():
 
 
 app = Flask(__name__, static_url_path='', static_folder='./static')
-predict_db = {
-    name: CSVDatabase(PREDICTOR_DB_PATH.replace("%", name)) for name in predictors.keys()
+startup_times["config"] = time.perf_counter() - startup_begin
+
+
+def open_prediction_db(name: str) -> Database:
+    return open_database(PREDICTOR_DB_PATH.replace("%", name),
+                         roll=PREDICTOR_DB_ROLL,
+                         retention=PREDICTOR_DB_RETENTION,
+                         archive_dir=PREDICTOR_DB_ARCHIVE,
+                         commit_rows=DB_COMMIT_ROWS,
+                         commit_interval=DB_COMMIT_INTERVAL,
+                         readonly=PROCESS_ROLE == "api")
+
+
+predict_db = {name: open_prediction_db(name) for name in predictors.keys()}
+predict_rollups = {
+    name: RollupSet(db, PREDICTOR_DB_PATH.replace("%", name), PREDICTOR_ROLLUPS,
+                    roll=PREDICTOR_DB_ROLL,
+                    retention=PREDICTOR_DB_RETENTION,
+                    archive_dir=PREDICTOR_DB_ARCHIVE,
+                    commit_rows=DB_COMMIT_ROWS,
+                    commit_interval=DB_COMMIT_INTERVAL,
+                    readonly=PROCESS_ROLE == "api")
+    for name, db in predict_db.items()
 }
-collector = Collector(COLLECTOR_INTERVAL, COLLECTOR_DB_PATH, valve_groups)
+startup_times["databases"] = time.perf_counter() - startup_begin - startup_times["config"]
+
 
-replay_cursor: Cursor | None = None
-replay_timestamp = 0.0
+def open_shared(area: SharedArea) -> tuple[dict[str, SharedRing], SharedState]:
+    """
+    The live windows and the state in shared memory. The acquisition
+    process allocates them (or finds them back after a restart), the API
+    waits until it has.
+    """
+    create = PROCESS_ROLE == "acquisition"
+    capacity = int(LIVE_WINDOW / LOOP_DELAY)
+    deadline = time.time() + SHARED_WAIT
+    while True:
+        rings = {name: area.ring(name, capacity, SHARED_RING_COLUMNS, create) for name in predictors}
+        state = area.state("states", SHARED_STATE_SIZE, create)
+        if state is not None and all(ring is not None for ring in rings.values()):
+            return rings, state  # type: ignore[return-value]
+        if time.time() > deadline:
+            raise TimeoutError("shared memory not set up by the acquisition process")
+        time.sleep(0.1)
 
 
-def push_sensor_data():
-    global replay_cursor, replay_timestamp
+shared_area: SharedArea | None = None
+shared_state: SharedState | None = None
+predict_live: dict[str, RingBuffer | SharedRing]
+if PROCESS_ROLE == "all":
+    predict_live = {
+        name: RingBuffer(int(LIVE_WINDOW / LOOP_DELAY)) for name in predictors.keys()
+    }
+else:
+    shared_area = SharedArea(SHARED_MEMORY)
+    rings, shared_state = open_shared(shared_area)
+    if PROCESS_ROLE == "acquisition":
+        # na een herstart gaat de database verder na de laatst gecommitte rij
+        for name, live in rings.items():
+            live.reset(predict_db[name].columns, predict_db[name].next_index == 0)
+    predict_live = dict(rings)
+broadcaster = Broadcaster(STREAM_QUEUE_SIZE)
+collector = Collector(COLLECTOR_INTERVAL, COLLECTOR_DB_PATH, valve_groups,
+                      commit_rows=DB_COMMIT_ROWS,
+                      commit_interval=DB_COMMIT_INTERVAL,
+                      fsync=FSYNC_BATCH,
+                      readonly=False)
+
+replay: Replay | None = None
+published_state: dict[str, Any] = {}
+command_client: CommandClient | None = None
+history_refreshed = 0.0
+refresh_lock = threading.Lock()
+
+
+def rotate_prediction_db(name: str) -> Database:
+    """
+    Move a predictor database that is one file aside as
+    `predict-<name>.<time>.csv` and continue in a new file, because its
+    header lacks columns of the new rows (e.g. VERSION_COLUMN after an
+    update). A segmented database starts a new segment by itself.
+    """
+    old = predict_db[name]
+    base, ext = os.path.splitext(old.filename)
+    target = f"{base}.{time.strftime('%Y%m%d-%H%M%S')}{ext}"
+    print(f"[predict] {old.filename} has no columns for the new rows, moving it to {target}")
+    old.flush()
+    os.replace(old.filename, target)
+    if os.path.exists(old.filename + ".idx"):
+        os.replace(old.filename + ".idx", target + ".idx")
+
+    db = open_prediction_db(name)
+    db.next_index = old.next_index  # ids lopen door, zoals over segmenten
+    predict_db[name] = predict_rollups[name].source = db
+    old.close()
+    return db
+
+
+def store_prediction(name: str, row: dict[str, float], timestamp: float):
+    db = predict_db[name]
+    if not isinstance(db, SegmentedDatabase) and db.columns and db.schema.unknown(row):
+        db = rotate_prediction_db(name)
+    with metrics.stage(f"insert.{name}"):
+        values = db.insert(row, timestamp)
+    with metrics.stage(f"rollup.{name}"):
+        predict_rollups[name].add(values)
+
+    live = predict_live[name]
+    if live.columns != db.columns:
+        # nieuwe kolommen: alleen compleet als dit de eerste rij is
+        live.reset(db.columns, values[db.schema.positions[db.index_col]] == 0)
+    live.append(values)
+
+    if broadcaster.active:
+        with metrics.stage(f"broadcast.{name}"):
+            index = int(values[db.schema.positions[db.index_col]])
+            broadcaster.publish("sensor_data", dict(predictor=name, row=db.schema.unflatten(values)),
+                                id=index, key=name)
 
+
+predictor_pool = PredictorPool(predictors, store_prediction, PREDICTOR_QUEUE_SIZE,
+                               warmup=PREDICTOR_WARMUP, observe=metrics.observe,
+                               profile=thread_profiler.call)
+
+
+def valve_states() -> dict[str, dict[str, str]]:
+    return {
+        name: dict(state=v.state.name.lower(), wants=v.wants.name.lower()) for name, v in valves.items()
+    }
+
+
+def collector_state() -> dict[str, Any]:
+    dbname = "???"
+    if collector.db is not None:
+        dbname = collector.db.filename
+    return dict(active=collector.active, dbname=dbname, progress=collector.progress, time=collector.timeleft)
+
+
+def replay_state() -> dict[str, Any] | None:
+    current = replay
+    if current is None:
+        return None
+    return current.state()
+
+
+def current_states() -> dict[str, Any]:
+    """Valve, collector and replay state; in the API role as the acquisition published it."""
+    if shared_state is not None and PROCESS_ROLE == "api":
+        states = shared_state.read()
+        if states is not None:
+            return states
+    return dict(valves=valve_states(), collector=collector_state(), replay=replay_state())
+
+
+def publish_state():
+    if not broadcaster.active and shared_state is None:
+        published_state.clear()
+        return
+
+    states = dict(valves=valve_states(), collector=collector_state(), replay=replay_state())
+    now = time.time()
+    changed = False
+    for name, state in states.items():
+        previous = published_state.get(name)
+        if name == "collector" and previous is not None and \
+                not state["active"] and not previous["active"]:
+            continue  # timeleft loopt door terwijl de collector uit staat
+        if name == "replay" and previous is not None and state is not None and \
+                now - published_state.get("replay_time", 0.0) < REPLAY_STATE_INTERVAL:
+            continue  # een snelle replay verandert elke rij
+        if state != previous:
+            published_state[name] = state
+            changed = True
+            if name == "replay":
+                published_state["replay_time"] = now
+            if broadcaster.active:
+                broadcaster.publish(name, state)
+
+    if changed and shared_state is not None:
+        shared_state.write({name: published_state.get(name) for name in states})
+
+
+def sampler() -> Callable[[], float]:
+    """
+    One iteration of the sampling loop per call of the returned function:
+    take a row from the sensors or the replay, hand it to the predictors
+    and the collector, and return the seconds until the next iteration.
+    """
     prev_valve_time = time.time()
     prev_valve_state = [v.state for v in valves.values()]
-    while True:
-        start_time = time.time()
+    sensor_keys = {name: f"sensors.{name}.value" for name in sensors}
+    sensor_stages = {name: f"sensor.{name}" for name in sensors}
+    valve_keys = {name: f"valves.{name}.value" for name in valves}
+
+    def step() -> float:
+        global replay
+        nonlocal prev_valve_time, prev_valve_state
+
         delay = LOOP_DELAY
         row: dict[str, Any] | None = None
-        if replay_cursor is not None:
-            row = replay_cursor.read()
-            if row is None:
-                replay_cursor.close()
-                replay_cursor = None
+        current = replay
+        if current is not None and current.paused:
+            publish_state()
+            return LOOP_DELAY
+        if current is not None:
+            item = metrics.call("replay", current.next)
+            if item is None:
+                current.close()
+                if replay is current:
+                    replay = None
             else:
-                delay = min(row["timestamp"] -
-                            replay_timestamp, MAX_REPLAY_DELAY)
-                replay_timestamp = row["timestamp"]
-                for name, state in row["valves"].items():
-                    if name == "change_time":
-                        continue
-                    valves[name].set_wants(ValveState(state["value"]))
+                row, due = item
+                # de replay bepaalt het tempo, niet LOOP_DELAY
+                delay = 0
+                d = due - time.time()
+                if d > 0:
+                    time.sleep(d)
+                for name, key in valve_keys.items():
+                    if key in row:
+                        valves[name].set_wants(ValveState(int(row[key])))
 
         if row is None:
-            row = {}
-            row["sensors"] = {
-                name: dict(value=sensor.read()) for name, sensor in sensors.items()
-            }
-            row["valves"] = {
-                name: dict(value=valve.state.value) for name, valve in valves.items()
+            row = {
+                sensor_keys[name]: metrics.call(sensor_stages[name], sensor.read)
+                for name, sensor in sensors.items()
             }
+            for name, valve in valves.items():
+                row[valve_keys[name]] = valve.state.value
 
             new_valve_state = [v.state for v in valves.values()]
             curtime = time.time()
@@ -161,27 +439,84 @@ def push_sensor_data():
 
             row["valves.change_time"] = curtime - prev_valve_time
 
-        row = flatten_dict(row)
-        for name, model in predictors.items():
-            prow = model.predict(row)
-            predict_db[name].insert(prow)
+        # een replay wacht op de predictors in plaats van rijen te laten vallen
+        with metrics.stage("submit"):
+            predictor_pool.submit(row, time.time(), block=current is not None)
+
+        with metrics.stage("collector"):
+            if collector.active:
+                do_pause = any(v.wants != v.state for v in valves.values())
+                collector.pause(do_pause)
+
+                todo = collector.pop()
+                for name, state in todo.items():
+                    valves[name].set_wants(state)
 
-        if collector.active:
-            do_pause = any(v.wants != v.state for v in valves.values())
-            collector.pause(do_pause)
+                if collector.db is not None:
+                    collector.db.insert(row)
 
-            todo = collector.pop()
-            for name, state in todo.items():
-                valves[name].set_wants(state)
+        with metrics.stage("publish"):
+            publish_state()
 
-            if collector.db is not None:
-                collector.db.insert(row)
+        # insert commit pas bij de volgende rij; een stille writer niet vergeten
+        with metrics.stage("commit"):
+            for db in predict_db.values():
+                db.commit_due()
+            collect_db = collector.db
+            if collect_db is not None:
+                collect_db.commit_due()
+        return delay
+
+    return step
+
+
+def push_sensor_data():
+    step = sampler()
+    while True:
+        start_time = time.time()
+        delay = thread_profiler.call(step)
+        metrics.loop(start_time, time.time() - start_time, delay)
 
         d = delay - time.time() + start_time
         if d > 0:
             time.sleep(d)
 
 
+def follow_shared():
+    """
+    API role: publish the rows the acquisition process appends to the
+    shared rings, and its state changes, on the stream.
+    """
+    heads = {name: live.head for name, live in predict_live.items() if isinstance(live, SharedRing)}
+    schemas: dict[str, Schema] = {}
+    while True:
+        time.sleep(SHARED_POLL_INTERVAL)
+        if not broadcaster.active:
+            heads = {name: predict_live[name].head for name in heads}  # type: ignore[union-attr]
+            published_state.clear()
+            continue
+
+        for name, head in heads.items():
+            live = predict_live[name]
+            assert isinstance(live, SharedRing)
+            rows, heads[name] = live.rows_after(head)
+            if not len(rows):
+                continue
+            schema = schemas.get(name)
+            if schema is None or schema.columns != live.columns:
+                schema = schemas[name] = Schema(live.columns)
+            position = schema.positions[predict_db[name].index_col]
+            for values in rows.tolist():
+                broadcaster.publish("sensor_data", dict(predictor=name, row=schema.unflatten(values)),
+                                    id=int(values[position]), key=name)
+
+        assert shared_state is not None
+        for name, state in (shared_state.read() or {}).items():
+            if published_state.get(name, {}) != state:
+                published_state[name] = state
+                broadcaster.publish(name, state)
+
+
 @app.route("/")
 def index():
     return redirect("index.html")
@@ -194,18 +529,413 @@ def get_sensors():
     return jsonify(sensors=result, predictors=list(predictors.keys()))
 
 
+def predictor_blocks(name: str, since: float) -> Iterator[np.ndarray]:
+    """
+    Rows of predictor `name` from `since` on, in blocks, in the column order
+    of its database.
+    """
+    preddb = predict_db[name]
+    live = predict_live[name]
+    # in de API-rol kan de database andere kolommen hebben dan de ring
+    current = live.columns == preddb.columns
+    rows = live.since(since) if current else None
+    if rows is not None:
+        yield np.array(rows, dtype=float).reshape(-1, len(preddb.columns))
+        return
+
+    last = None
+    with preddb.cursor_since(since) as cur:
+        while len(block := cur.read_array(READ_BLOCK_ROWS)):
+            yield block
+            last = block[-1, preddb.schema.positions[preddb.timestamp_col]]
+
+    if PROCESS_ROLE == "api" and current and last is not None:
+        # wat de acquisitie nog niet gecommit heeft staat alleen in de ring
+        rows = live.since(last)
+        if rows is not None:
+            ts_col = preddb.schema.positions[preddb.timestamp_col]
+            yield rows[rows[:, ts_col] > last]
+
+
+def refresh_databases():
+    """
+    API role: pick up the rows and rollups the acquisition process
+    committed, at most every HISTORY_REFRESH_INTERVAL.
+    """
+    global history_refreshed
+    if PROCESS_ROLE != "api" or time.time() - history_refreshed < HISTORY_REFRESH_INTERVAL:
+        return
+    with refresh_lock:
+        if time.time() - history_refreshed < HISTORY_REFRESH_INTERVAL:
+            return
+        for name, db in predict_db.items():
+            db.refresh()
+            predict_rollups[name].refresh()
+        history_refreshed = time.time()
+
+
+def aggregate_predictor(name: str, since: float, width: float, agg: str) -> np.ndarray:
+    """
+    Bucket aggregates of predictor `name` from `since` on. Whole buckets
+    come from the coarsest rollup that fits `width`, the rest from the raw
+    rows.
+    """
+    preddb = predict_db[name]
+    ts_col = preddb.schema.positions.get(preddb.timestamp_col, 0)
+    aggregator = BucketAggregator(ts_col, width)
+
+    rollup = predict_rollups[name].pick(width)
+    raw_since = since
+    if rollup is not None:
+        raw_since = rollup.feed(aggregator, since, preddb.columns)
+    for block in predictor_blocks(name, raw_since):
+        if raw_since != since:
+            block = block[block[:, ts_col] >= raw_since]
+        aggregator.add(block)
+    return aggregator.result(agg, len(preddb.columns))
+
+
+def round_values(name: str, data: np.ndarray, precision: int | None) -> np.ndarray:
+    """Round values, but not ids and timestamps, to `precision` decimals."""
+    if precision is None or len(data) == 0:
+        return data
+    preddb = predict_db[name]
+    keep = {preddb.index_col, preddb.timestamp_col}
+    cols = [i for i, c in enumerate(preddb.columns) if c not in keep]
+    data[:, cols] = np.round(data[:, cols], precision)
+    return data
+
+
+def sample_width(since: float, resolution: float | None, max_points: int | None) -> float:
+    """Bucket width in seconds for downsampling from `since` until now."""
+    if resolution is not None:
+        return resolution
+    assert max_points is not None
+
+    starts = []
+    for preddb in predict_db.values():
+        with preddb.cursor_since(since) as cur:
+            first = cur.read_array(1, [preddb.timestamp_col]) if preddb.columns else []
+        if len(first):
+            starts.append(first[0, 0])
+    start = max(min(starts, default=since), since)
+    return max((time.time() - start) / max_points, LOOP_DELAY)
+
+
 @app.route('/api/sensor_data')
 def get_real_sensor_data():
+    """
+    Rows of all predictors since `since`. With `format=columnar` every
+    predictor is sent as its column names plus the values, either one list
+    per column (`layout=columns`, default) or one list per row
+    (`layout=rows`). `precision` rounds the values to that many decimals.
+
+    `resolution` (seconds per bucket) or `max_points` downsample the range:
+    `method=buckets` (default) sends one row per time bucket with the
+    `agg` (mean, min or max) of every column, `method=lttb` sends per column
+    the points picked by largest-triangle-three-buckets as
+    `{"columns", "times", "values"}`, one list per column. Bucket
+    aggregates are read from the rollups where possible.
+    """
     since = request.args.get('since', default=0, type=float)
+    fmt = request.args.get('format', default="nested")
+    layout = request.args.get('layout', default="columns")
+    precision = request.args.get('precision', type=int)
+    resolution = request.args.get('resolution', type=float)
+    max_points = request.args.get('max_points', type=int)
+    method = request.args.get('method', default="buckets")
+    agg = request.args.get('agg', default="mean")
+    if fmt not in ["nested", "columnar"]:
+        return jsonify({"error": "unknown format"})
+    if layout not in ["columns", "rows"]:
+        return jsonify({"error": "unknown layout"})
+    if method not in ["buckets", "lttb"]:
+        return jsonify({"error": "unknown method"})
+    if agg not in AGGREGATES:
+        return jsonify({"error": "unknown aggregate"})
+    if (resolution is not None and resolution <= 0) or (max_points is not None and max_points <= 0):
+        return jsonify({"error": "invalid resolution"})
+
+    refresh_databases()
+    downsample = resolution is not None or max_points is not None
+    width = sample_width(since, resolution, max_points) if downsample else 0.0
+
     preds = {}
     for name, preddb in predict_db.items():
-        with preddb.cursor_since(since) as cur:
-            preds[name] = list(cur)
-    replay_data = None
-    if replay_cursor is not None:
-        replay_data = dict(timestamp=replay_timestamp,
-                           progress=replay_cursor.offset/(replay_cursor.offset+replay_cursor.size))
-    return jsonify(values=preds, replay=replay_data)
+        ts_col = preddb.schema.positions.get(preddb.timestamp_col, 0)
+        if downsample and method == "lttb":
+            times, values = lttb(predictor_blocks(name, since), ts_col, width)
+            values = round_values(name, values, precision)
+            preds[name] = dict(columns=preddb.columns, times=times.T.tolist(), values=values.T.tolist())
+            continue
+
+        if downsample:
+            data = aggregate_predictor(name, since, width, agg)
+        else:
+            blocks = list(predictor_blocks(name, since))
+            data = np.concatenate(blocks) if blocks else np.empty((0, len(preddb.columns)))
+        data = round_values(name, data, precision)
+
+        if fmt == "columnar":
+            values = data.T if layout == "columns" else data
+            preds[name] = dict(columns=preddb.columns, layout=layout, data=values.tolist())
+        else:
+            unflatten = preddb.schema.unflatten
+            preds[name] = [unflatten(values) for values in data.tolist()]
+    return jsonify(values=preds, replay=current_states()["replay"])
+
+
+# in de API-rol bedient de acquisitie alles behalve de data
+LOCAL_ENDPOINTS = {"static", "index", "get_real_sensor_data", "stream_sensor_data"}
+
+
+@app.before_request
+def forward_request():
+    """API role: run the request in the acquisition process, which owns the hardware and state."""
+    if command_client is None or request.endpoint is None or request.endpoint in LOCAL_ENDPOINTS:
+        return None
+    timeout = COMMAND_TIMEOUT
+    if request.endpoint == "admin_profile":
+        if request.args.get('target') == "api":
+            return None  # het API-proces zelf profileren
+        timeout += PROFILE_MAX_SECONDS
+    headers = [(k, v) for k, v in request.headers.items() if k not in ("Host", "Content-Length")]
+    reply = command_client.call(request.path, request.method, request.query_string.decode(),
+                                request.get_data(), headers, timeout)
+    if reply is None:
+        return jsonify({"error": "acquisition unavailable"}), 503
+    status, headers, data = reply
+    return Response(data, status=status, headers=headers)
+
+
+# de profiel-aanvraag zelf, en de stream die tot het einde van de verbinding loopt
+UNPROFILED_ENDPOINTS = {"admin_profile", "stream_sensor_data"}
+
+
+@app.before_request
+def profile_request():
+    if thread_profiler.active and request.endpoint not in UNPROFILED_ENDPOINTS:
+        thread_profiler.enter()
+
+
+@app.teardown_request
+def profile_request_end(exc: BaseException | None):
+    thread_profiler.exit()
+
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    if response.mimetype != "application/json" or response.direct_passthrough or \
+            response.status_code != 200 or "Content-Encoding" in response.headers:
+        return response
+    if "gzip" not in request.headers.get("Accept-Encoding", ""):
+        return response
+
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+
+    response.set_data(gzip.compress(data, GZIP_LEVEL))
+    response.headers["Content-Encoding"] = "gzip"
+    response.headers.add("Vary", "Accept-Encoding")
+    return response
+
+
+def format_stream_id(ids: dict[str, int]) -> str:
+    """Event id of the stream: the last row id sent per predictor, as `name:id,...`."""
+    return ",".join(f"{name}:{index}" for name, index in ids.items())
+
+
+def parse_stream_id(text: str | None) -> dict[str, int]:
+    """Last row id per predictor from a `format_stream_id` id, unknown parts are ignored."""
+    ids = {}
+    for part in (text or "").split(","):
+        name, _, index = part.rpartition(":")
+        if name in predict_db:
+            try:
+                ids[name] = int(index)
+            except ValueError:
+                pass
+    return ids
+
+
+@app.route('/api/stream')
+def stream_sensor_data():
+    """
+    Server-sent events: `sensor_data` for every new row of every predictor
+    and `valves`, `collector` and `replay` on state changes. The event id
+    holds the last row id sent of every predictor, so a `Last-Event-ID`
+    header (or `last_id` argument) first replays the rows each predictor
+    wrote since.
+    """
+    last_ids = parse_stream_id(request.headers.get("Last-Event-ID") or request.args.get("last_id"))
+
+    def generate():
+        # pas abonneren als de generator loopt: een verbinding die eerder
+        # wegvalt, of een fout hieronder, laat zo geen abonnement achter
+        sub = broadcaster.subscribe()
+        try:
+            refresh_databases()
+            # laatst verstuurde id per predictor, om dubbelen te voorkomen
+            sent: dict[str, int] = dict(last_ids)
+            for name, last in last_ids.items():
+                preddb = predict_db[name]
+                if not preddb.columns:
+                    continue
+                with preddb.cursor_index(last) as cur:
+                    first = cur.read_array(1, [preddb.timestamp_col])
+                since = first[0, 0] if len(first) else float("-inf")
+                unflatten = preddb.schema.unflatten
+                position = preddb.schema.positions[preddb.index_col]
+                # ook de rijen die alleen nog in het live-geheugen staan
+                for block in predictor_blocks(name, since):
+                    for values in block[block[:, position] > sent[name]].tolist():
+                        sent[name] = int(values[position])
+                        yield format_event("sensor_data", dict(predictor=name, row=unflatten(values)),
+                                           format_stream_id(sent))
+
+            for name, state in current_states().items():
+                yield format_event(name, state)
+
+            while True:
+                events = sub.get(STREAM_KEEPALIVE)
+                if not events:
+                    yield ": keepalive\n\n"
+                for event in events:
+                    if event.key is None or event.id is None:
+                        yield event.text
+                        continue
+                    if event.key in sent and event.id <= sent[event.key]:
+                        continue
+                    sent[event.key] = event.id
+                    yield f"id: {format_stream_id(sent)}\n" + event.text
+        finally:
+            broadcaster.unsubscribe(sub)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/api/stats')
+def get_stats():
+    return jsonify(live_buffer={name: live.stats() for name, live in predict_live.items()},
+                   stream=broadcaster.stats(),
+                   predictors=predictor_pool.stats(),
+                   models={name: p.stats() for name, p in predictors.items()},
+                   startup=startup_times)
+
+
+@app.route('/api/metrics')
+def get_metrics():
+    """Stage timings and loop counters in the Prometheus text format."""
+    stats = predictor_pool.stats()
+    gauges = {
+        "dashboard_predictor_queue": {name: s["queue"] for name, s in stats.items()},
+        "dashboard_predictor_dropped_total": {name: s["dropped"] for name, s in stats.items()},
+        "dashboard_predictor_errors_total": {name: s["errors"] for name, s in stats.items()},
+        "dashboard_predictor_lag_seconds": {name: s["lag"] for name, s in stats.items()},
+    }
+    return Response(metrics.prometheus(gauges), mimetype="text/plain; version=0.0.4")
+
+
+def admin_error() -> Response | None:
+    if ADMIN_TOKEN is None:
+        return jsonify({"error": "admin disabled"})
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+        return jsonify({"error": "invalid token"})
+    return None
+
+
+@app.route('/api/admin/profile', methods=['POST'])
+def admin_profile():
+    """
+    Profile for `seconds` and return the result, also kept in PROFILE_DIR.
+    `mode=sampling` (default) samples the stacks of all threads and returns
+    collapsed stacks; `mode=cprofile` profiles the sampling loop, the
+    predictor threads and the request threads deterministically and returns
+    a pstats file, or the top functions with `format=text`. In the API role
+    `target=acquisition` (default) profiles the acquisition process and
+    `target=api` this one.
+    """
+    if (error := admin_error()) is not None:
+        return error
+    seconds = request.args.get('seconds', default=10.0, type=float)
+    mode = request.args.get('mode', default="sampling")
+    fmt = request.args.get('format', default="pstats")
+    target = request.args.get('target', default="acquisition")
+    if target not in PROFILE_TARGETS:
+        return jsonify({"error": "unknown target"})
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return jsonify({"error": "invalid duration"})
+    if mode not in ["sampling", "cprofile"] or fmt not in ["pstats", "text"]:
+        return jsonify({"error": "unknown mode"})
+    if not profile_lock.acquire(blocking=False):
+        return jsonify({"error": "profiler busy"})
+
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        now = time.time()
+        # milliseconden en pid: twee profielen in dezelfde seconde overschrijven elkaar niet
+        path = os.path.join(PROFILE_DIR, time.strftime("profile-%Y%m%d-%H%M%S", time.localtime(now)) +
+                            f"-{int(now * 1000) % 1000:03d}-{os.getpid()}")
+        if mode == "sampling":
+            text = collapsed(SamplingProfiler(SAMPLING_INTERVAL).run(seconds))
+            with open(path + ".collapsed", "w") as f:
+                f.write(text)
+            return Response(text, mimetype="text/plain")
+
+        thread_profiler.start()
+        try:
+            time.sleep(seconds)
+        finally:
+            stats = thread_profiler.stop()
+        if stats is None:
+            return jsonify({"error": "nothing ran"})
+        stats.dump_stats(path + ".pstats")
+        if fmt == "text":
+            return Response(stats_text(stats), mimetype="text/plain")
+        with open(path + ".pstats", "rb") as f:
+            data = f.read()
+        return Response(data, mimetype="application/octet-stream", headers={
+            "Content-Disposition": f"attachment; filename={os.path.basename(path)}.pstats"})
+    finally:
+        profile_lock.release()
+
+
+@app.route('/api/admin/start_tracemalloc', methods=['POST'])
+def admin_start_tracemalloc():
+    if (error := admin_error()) is not None:
+        return error
+    frames = request.args.get('frames', default=TRACEMALLOC_FRAMES, type=int)
+    memory_tracker.start(frames)
+    return jsonify()
+
+
+@app.route('/api/admin/tracemalloc')
+def admin_tracemalloc():
+    """
+    Top allocation sites by growth since the previous call (`since=last`)
+    or since tracing started (`since=start`).
+    """
+    if (error := admin_error()) is not None:
+        return error
+    top = request.args.get('top', default=20, type=int)
+    since = request.args.get('since', default="last")
+    key = request.args.get('key', default="lineno")
+    if since not in ["last", "start"] or key not in ["lineno", "filename", "traceback"]:
+        return jsonify({"error": "invalid request"})
+    try:
+        return jsonify(memory_tracker.diff(top, since, key))
+    except RuntimeError:
+        return jsonify({"error": "tracemalloc inactive"})
+
+
+@app.route('/api/admin/stop_tracemalloc', methods=['POST'])
+def admin_stop_tracemalloc():
+    if (error := admin_error()) is not None:
+        return error
+    memory_tracker.stop()
+    return jsonify()
 
 
 @app.route('/api/set_valves', methods=['POST'])
@@ -223,7 +953,7 @@ def set_valve_state():
 
     if collector.active and v.wants == v.state:
         return jsonify({"error": "collector active"})
-    if replay_cursor is not None:
+    if replay is not None:
         return jsonify({"error": "replay active"})
 
     state = ValveState.OPEN if data['state'] == 'open' else ValveState.CLOSED
@@ -234,10 +964,7 @@ def set_valve_state():
 
 @app.route('/api/get_valves', methods=['GET'])
 def get_valve_states():
-    valve_states = {
-        name: dict(state=v.state.name.lower(), wants=v.wants.name.lower()) for name, v in valves.items()
-    }
-    return jsonify(valve_states)
+    return jsonify(valve_states())
 
 
 @app.route('/api/start_collector', methods=['POST'])
@@ -261,35 +988,205 @@ def cancel_collector():
 
 @app.route('/api/get_collector', methods=['GET'])
 def get_collector_state():
-    dbname = "???"
-    if collector.db is not None:
-        dbname = collector.db.filename
-    return jsonify(active=collector.active, dbname=dbname, progress=collector.progress, time=collector.timeleft)
+    return jsonify(collector_state())
+
+
+def start_reload(name: str, version: int) -> bool:
+    """Load `version` of predictor `name` in the background and swap it in."""
+    with model_loading_lock:
+        if name in model_loading:
+            return False
+        model_loading[name] = version
+
+    def run():
+        try:
+            predictors[name].reload(model_registry.path(name, version), version)
+        except Exception:
+            print(f"[predict] unable to load {name} version {version}")
+            print_exc()
+        finally:
+            with model_loading_lock:
+                model_loading.pop(name, None)
+
+    threading.Thread(target=run, name=f"reload-{name}", daemon=True).start()
+    return True
+
+
+@app.route('/api/get_models', methods=['GET'])
+def get_models():
+    with model_loading_lock:
+        loading = dict(model_loading)
+    return jsonify({
+        name: dict(predictor.stats(), versions=model_registry.versions(name),
+                   loading=loading.get(name))
+        for name, predictor in predictors.items()
+    })
+
+
+@app.route('/api/reload_model', methods=['POST'])
+def reload_model():
+    data: dict[str, Any] | None = request.json
+    if type(data) is not dict:
+        return jsonify({"error": "invalid request"})
+    if data.get('model') not in predictors:
+        return jsonify({"error": "unknown model"})
+    name = data['model']
+    version = data.get('version', model_registry.latest(name))
+    if type(version) is not int or version not in model_registry.versions(name):
+        return jsonify({"error": "unknown version"})
+    if not start_reload(name, version):
+        return jsonify({"error": "model loading"})
+    return jsonify(error=None, loading=version)
+
+
+@app.route('/api/rollback_model', methods=['POST'])
+def rollback_model():
+    data: dict[str, Any] | None = request.json
+    if type(data) is not dict:
+        return jsonify({"error": "invalid request"})
+    if data.get('model') not in predictors:
+        return jsonify({"error": "unknown model"})
+    try:
+        predictors[data['model']].rollback()
+    except ValueError:
+        return jsonify({"error": "no previous version"})
+    return jsonify(error=None, version=predictors[data['model']].version)
+
+
+def replay_files() -> list[str]:
+    return sorted({path for pattern in REPLAY_SOURCES for path in glob.glob(pattern)})
+
+
+@app.route('/api/replay_files', methods=['GET'])
+def get_replay_files():
+    return jsonify(files=replay_files())
 
 
 @app.route('/api/replay', methods=['POST'])
 def do_replay():
-    global replay_cursor
-    if replay_cursor is not None:
+    global replay
+    if replay is not None:
         return jsonify({"error": "replay active"})
     since = request.args.get('since', default=0, type=float)
-    replay_cursor = predict_db["none"].cursor_since(since)
+    speed = request.args.get('speed', default=1.0, type=float)
+    if speed < 0:
+        return jsonify({"error": "invalid speed"})
+
+    filename = request.args.get('file')
+    if filename is None:
+        db = predict_db["none"]
+    elif filename not in replay_files():  # een glob-match laat ook ../ door
+        return jsonify({"error": "unknown file"})
+    else:
+        try:
+            db = open_database(filename, readonly=True)
+        except (OSError, ValueError):
+            return jsonify({"error": "unable to open file"})
+
+    replay = Replay(db, since, speed, MAX_REPLAY_DELAY,
+                    REPLAY_BLOCK_ROWS, REPLAY_PREFETCH, name=filename, own_db=filename is not None)
+    return jsonify()
+
+
+@app.route('/api/seek_replay', methods=['POST'])
+def seek_replay():
+    current = replay
+    if current is None:
+        return jsonify({"error": "replay inactive"})
+    timestamp = request.args.get('timestamp', type=float)
+    if timestamp is None:
+        return jsonify({"error": "missing parameters"})
+    current.seek(timestamp)
+    return jsonify()
+
+
+@app.route('/api/pause_replay', methods=['POST'])
+def pause_replay():
+    current = replay
+    if current is None:
+        return jsonify({"error": "replay inactive"})
+    current.pause()
+    return jsonify()
+
+
+@app.route('/api/resume_replay', methods=['POST'])
+def resume_replay():
+    current = replay
+    if current is None:
+        return jsonify({"error": "replay inactive"})
+    current.resume()
+    return jsonify()
+
+
+@app.route('/api/replay_speed', methods=['POST'])
+def set_replay_speed():
+    current = replay
+    if current is None:
+        return jsonify({"error": "replay inactive"})
+    speed = request.args.get('speed', type=float)
+    if speed is None or speed < 0:
+        return jsonify({"error": "invalid speed"})
+    current.set_speed(speed)
     return jsonify()
 
 
 @app.route('/api/cancel_replay', methods=['POST'])
 def cancel_replay():
-    global replay_cursor
-    if replay_cursor is None:
+    global replay
+    current = replay
+    if current is None:
         return jsonify({"error": "replay inactive"})
-    replay_cursor = None
+    replay = None
+    current.close()
     return jsonify()
 
 
-def main():
+def main(channel: tuple[str, bytes] | None = None):
+    """
+    Run the dashboard. Under dashboard.supervisor, `channel` holds the
+    socket address and key of the commands from the API to the acquisition
+    process.
+    """
+    global command_client
+    if PROCESS_ROLE == "api":
+        assert channel is not None
+        command_client = CommandClient(*channel)
+        threading.Thread(target=follow_shared, name="follow-shared", daemon=True).start()
+        startup_times["total"] = time.perf_counter() - startup_begin
+        print("[startup] api " + ", ".join(f"{name} {t:.2f}s" for name, t in startup_times.items()))
+        app.run(host='0.0.0.0', port=5000)
+        return
+
+    start = time.perf_counter()
     sensor_init()
     valves_init()
+    startup_times["hardware"] = time.perf_counter() - start
+
+    if METRICS_CSV_PATH is not None:
+        stages = [f"sensor.{name}" for name in sensors] + ["replay", "submit", "collector", "publish", "commit"]
+        metrics.log_csv(METRICS_CSV_PATH, stages, commit_rows=DB_COMMIT_ROWS,
+                        commit_interval=DB_COMMIT_INTERVAL, readonly=False)
 
-    threading.Thread(target=push_sensor_data).start()
+    predictor_pool.start()
+    threading.Thread(target=push_sensor_data, daemon=True).start()
+    if MODEL_WATCH_INTERVAL is not None:
+        model_registry.watch(list(predictors), MODEL_WATCH_INTERVAL, start_reload)
 
-    app.run(host='0.0.0.0', port=5000)
+    startup_times["total"] = time.perf_counter() - startup_begin
+    print("[startup] " + ", ".join(f"{name} {t:.2f}s" for name, t in startup_times.items()))
+
+    try:
+        if PROCESS_ROLE == "acquisition":
+            assert channel is not None
+            serve_commands(app, *channel)
+        else:
+            app.run(host='0.0.0.0', port=5000)
+    finally:
+        predictor_pool.stop()
+        for db in predict_db.values():
+            db.flush()
+        for rollups in predict_rollups.values():
+            rollups.flush()
+        if collector.db is not None:
+            collector.db.flush()
+        metrics.close()
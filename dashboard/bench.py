@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable
+
+import numpy as np
+
+from .csv_database import CSVDatabase
+from .export_common import sample_rows
+from .predictor import (
+    CompiledForestPredictor,
+    KerasPredictor,
+    ModelPredictor,
+    NumpyAutoencoderPredictor,
+    RandomForestPredictor,
+)
+
+BENCHMARKS = ["insert", "cursor_since", "iterate", "predict", "push", "api"]
+COLUMNS = [f"sensors.flow{i}.value" for i in range(5)] + \
+    [f"sensors.pressure{i}.value" for i in range(6)] + \
+    [f"valves.valve{i}.value" for i in range(5)] + ["valves.change_time"]
+SAMPLE_INTERVAL = 0.2  # seconden tussen synthetische rijen, zoals LOOP_DELAY
+
+
+def summary(times: list[float]) -> dict[str, float]:
+    """Latency statistics in microseconds."""
+    us = np.array(times) * 1e6
+    return dict(count=len(us), mean=float(us.mean()), median=float(np.median(us)),
+                p90=float(np.percentile(us, 90)), p99=float(np.percentile(us, 99)),
+                max=float(us.max()))
+
+
+def timed(fn: Callable[[], Any], repeat: int) -> list[float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def synthetic_row(rng: random.Random) -> dict[str, float]:
+    return {name: rng.uniform(0, 5) for name in COLUMNS}
+
+
+def write_synthetic(path: str, size: int, start: float = 1.7e9) -> int:
+    """
+    Write a CSV database of about `size` bytes directly, much faster than
+    `insert`, and return the number of rows.
+    """
+    rng = np.random.default_rng(0)
+    rows = 0
+    written = 0
+    with open(path, "w", newline="") as f:
+        written += f.write(",".join(["id", "timestamp"] + COLUMNS) + "\n")
+        while written < size:
+            block = rng.uniform(0, 5, (4096, len(COLUMNS))).round(6)
+            ids = np.arange(rows, rows + len(block))
+            data = "".join(
+                f"{i},{start + i * SAMPLE_INTERVAL}," + ",".join(map(str, values)) + "\n"
+                for i, values in zip(ids.tolist(), block.tolist()))
+            written += f.write(data)
+            rows += len(block)
+    return rows
+
+
+def bench_insert(workdir: str, rows: int) -> dict[str, Any]:
+    """Insert throughput per commit batch size (as DB_COMMIT_ROWS)."""
+    rng = random.Random(0)
+    data = [synthetic_row(rng) for _ in range(rows)]
+    result = {}
+    for commit_rows in [1, 50]:
+        path = os.path.join(workdir, f"insert-{commit_rows}.csv")
+        db = CSVDatabase(path, commit_rows=commit_rows, commit_interval=1.0, readonly=False)
+        start = time.perf_counter()
+        for i, row in enumerate(data):
+            db.insert(row, 1.7e9 + i * SAMPLE_INTERVAL)
+        db.flush()
+        elapsed = time.perf_counter() - start
+        db.close()
+        result[f"commit_rows={commit_rows}"] = dict(rows=rows, seconds=elapsed,
+                                                     rows_per_second=rows / elapsed)
+    return result
+
+
+def bench_cursor_since(workdir: str, sizes: list[float], lookups: int) -> dict[str, Any]:
+    """`cursor_since` latency at random timestamps, with the sidecar index and by bisecting."""
+    rng = random.Random(0)
+    result = {}
+    for mb in sizes:
+        path = os.path.join(workdir, f"since-{mb:g}MB.csv")
+        rows = write_synthetic(path, int(mb * 2**20))
+        targets = [1.7e9 + rng.uniform(0, rows) * SAMPLE_INTERVAL for _ in range(lookups)]
+
+        entry: dict[str, Any] = dict(rows=rows, bytes=os.path.getsize(path))
+        for label, index_every in [("index", 64), ("bisect", None)]:
+            start = time.perf_counter()
+            # de eerste keer openen bouwt de index op
+            db = CSVDatabase(path, index_every=index_every, readonly=False)
+            entry[f"{label}_open_seconds"] = time.perf_counter() - start
+
+            it = iter(targets)
+
+            def lookup():
+                with db.cursor_since(next(it)) as cur:
+                    cur.read_array(1)
+            entry[label] = summary(timed(lookup, lookups))
+            db.close()
+
+        result[f"{mb:g}MB"] = entry
+        os.remove(path)
+        if os.path.exists(path + ".idx"):
+            os.remove(path + ".idx")
+    return result
+
+
+def bench_iterate(workdir: str, mb: float) -> dict[str, Any]:
+    """Rows per second reading a whole database, row by row and in blocks."""
+    path = os.path.join(workdir, "iterate.csv")
+    rows = write_synthetic(path, int(mb * 2**20))
+    db = CSVDatabase(path, readonly=True)
+    result: dict[str, Any] = dict(rows=rows)
+
+    start = time.perf_counter()
+    with db.cursor_begin() as cur:
+        count = sum(1 for _ in cur)
+    elapsed = time.perf_counter() - start
+    result["rows_iter"] = dict(seconds=elapsed, rows_per_second=count / elapsed)
+
+    start = time.perf_counter()
+    count = 0
+    with db.cursor_begin() as cur:
+        while len(block := cur.read_array(4096)):
+            count += len(block)
+    elapsed = time.perf_counter() - start
+    result["read_array"] = dict(seconds=elapsed, rows_per_second=count / elapsed)
+
+    db.close()
+    os.remove(path)
+    return result
+
+
+def bench_predict(model_dir: str, repeat: int, batch_sizes: list[int]) -> dict[str, Any]:
+    """
+    Single-row and batched latency per predictor. Predictors whose model
+    files or libraries are missing are reported as skipped.
+    """
+    loaders: dict[str, Callable[[], ModelPredictor]] = {
+        "keras": lambda: KerasPredictor(os.path.join(model_dir, "ae"), ["timestamp"]),
+        "numpy_ae": lambda: NumpyAutoencoderPredictor(os.path.join(model_dir, "ae"), ["timestamp"]),
+        "random_forest": lambda: RandomForestPredictor(os.path.join(model_dir, "rf"), ["timestamp"]),
+        "compiled_forest": lambda: CompiledForestPredictor(os.path.join(model_dir, "rf"), ["timestamp"]),
+    }
+    result: dict[str, Any] = {}
+    for name, load in loaders.items():
+        try:
+            start = time.perf_counter()
+            predictor = load()
+            load_time = time.perf_counter() - start
+        except (ImportError, OSError) as exc:
+            result[name] = dict(skipped=str(exc))
+            continue
+
+        rows = sample_rows(predictor, None, max(batch_sizes + [repeat]))
+        for row in rows[:10]:
+            predictor.predict(row)  # opwarmen
+
+        it = iter(rows)
+        entry: dict[str, Any] = dict(load_seconds=load_time,
+                                     single=summary(timed(lambda: predictor.predict(next(it)), repeat)))
+        for size in batch_sizes:
+            batch = rows[:size]
+            times = timed(lambda: predictor.predict_batch(batch), max(repeat // size, 5))
+            entry[f"batch={size}"] = summary([t / size for t in times])  # per rij
+        result[name] = entry
+    return result
+
+
+def _api_server(workdir: str, model_dir: str):
+    # api_server opent zijn databases bij het importeren, in de werkmap; de
+    # modellen laden pas bij het eerste gebruik, dus die wijzen we daarna
+    # naar het absolute pad
+    os.chdir(workdir)
+    from . import api_server
+    registry = api_server.model_registry
+    registry.legacy_dir = api_server.MODEL_DIR = model_dir
+    registry.root = api_server.MODEL_REGISTRY = os.path.join(model_dir, "registry")
+    for name, predictor in api_server.predictors.items():
+        predictor.version = registry.latest(name)
+        predictor.path = registry.path(name, predictor.version)
+    return api_server
+
+
+def bench_push(workdir: str, model_dir: str, iterations: int) -> dict[str, Any]:
+    """
+    One iteration of the sampling loop with randomized sensors, without the
+    sleep, while the predictor threads run as in the server.
+    """
+    api = _api_server(workdir, model_dir)
+    api.predictor_pool.start()
+    step = api.sampler()
+    for _ in range(10):
+        step()
+    return dict(step=summary(timed(step, iterations)))
+
+
+def bench_api(workdir: str, model_dir: str, rows: int, pollers: list[int],
+              requests: int) -> dict[str, Any]:
+    """
+    `/api/sensor_data` latency with N threads polling through the Flask
+    test client, for an incremental poll (as the frontend does) and for
+    the whole range. The whole range is much slower and gets a twentieth
+    of the requests.
+    """
+    api = _api_server(workdir, model_dir)
+    rng = random.Random(0)
+    start = time.time() - rows * SAMPLE_INTERVAL
+    for i in range(rows):
+        row = synthetic_row(rng)
+        for name in api.predict_db:
+            api.store_prediction(name, row, start + i * SAMPLE_INTERVAL)
+    for db in api.predict_db.values():
+        db.flush()
+    last = start + (rows - 1) * SAMPLE_INTERVAL
+
+    result: dict[str, Any] = dict(rows=rows)
+    for label, since, total in [("incremental", last - 1.0, requests),
+                                ("full", 0.0, max(requests // 20, 1))]:
+        url = f"/api/sensor_data?since={since}"
+        for count in pollers:
+            times: list[float] = []
+            lock = threading.Lock()
+
+            def poll():
+                client = api.app.test_client()
+                own = timed(lambda: client.get(url).close(), max(total // count, 1))
+                with lock:
+                    times.extend(own)
+
+            threads = [threading.Thread(target=poll) for _ in range(count)]
+            wall = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wall = time.perf_counter() - wall
+            result[f"{label}/pollers={count}"] = dict(
+                summary(times), requests_per_second=len(times) / wall)
+    return result
+
+
+def environment() -> dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(commit=commit, time=time.time(), python=sys.version.split()[0],
+                platform=platform.platform(), processor=platform.processor(),
+                cpus=os.cpu_count(), numpy=np.__version__)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Meet de opslag, inferentie en API; resultaten als JSON.")
+    parser.add_argument("--only", action="append", choices=BENCHMARKS,
+                        help="alleen deze benchmark (herhaalbaar, standaard: alle)")
+    parser.add_argument("--output", default=None,
+                        help="JSON-bestand voor de resultaten (standaard: bench-<commit>.json)")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 10, 100, 1024],
+                        help="bestandsgroottes in MB voor cursor_since")
+    parser.add_argument("--rows", type=int, default=20000,
+                        help="rijen voor insert")
+    parser.add_argument("--api-rows", type=int, default=6000,
+                        help="rijen per predictor in de database voor de API (standaard: 4x LIVE_WINDOW, "
+                             "zodat een volledige poll ook uit de database leest)")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests per meting van de API")
+    parser.add_argument("--repeat", type=int, default=1000,
+                        help="herhalingen per latency-meting")
+    parser.add_argument("--batch", type=int, nargs="+", default=[16, 256],
+                        help="batchgroottes voor predict_batch")
+    parser.add_argument("--pollers", type=int, nargs="+", default=[1, 4, 16],
+                        help="aantallen gelijktijdige pollers voor de API")
+    parser.add_argument("--models", default="dashboard/model",
+                        help="map met de modellen")
+    parser.add_argument("--workdir", default=None,
+                        help="map voor de tijdelijke databases (standaard: een tempdir)")
+    args = parser.parse_args()
+
+    selected = args.only or BENCHMARKS
+    report: dict[str, Any] = dict(environment=environment(), results={})
+    output = args.output or f"bench-{(report['environment']['commit'] or 'local')[:12]}.json"
+    output = os.path.abspath(output)
+    models = os.path.abspath(args.models)
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        runs: dict[str, Callable[[], dict[str, Any]]] = {
+            "insert": lambda: bench_insert(workdir, args.rows),
+            "cursor_since": lambda: bench_cursor_since(workdir, args.sizes, args.repeat),
+            "iterate": lambda: bench_iterate(workdir, min(args.sizes[-1], 100)),
+            "predict": lambda: bench_predict(models, args.repeat, args.batch),
+            "push": lambda: bench_push(workdir, models, args.repeat),
+            "api": lambda: bench_api(workdir, models, args.api_rows, args.pollers, args.requests),
+        }
+        cwd = os.getcwd()
+        try:
+            for name in BENCHMARKS:
+                if name not in selected:
+                    continue
+                print(f"[bench] {name}")
+                start = time.perf_counter()
+                report["results"][name] = runs[name]()
+                print(f"[bench] {name} done in {time.perf_counter() - start:.1f}s")
+        finally:
+            os.chdir(cwd)
+
+    with open(output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"[bench] results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+
+import argparse
+import bisect
+import io
+import os
+import struct
+import threading
+import time
+from typing import Any, Iterator
+
+import numpy as np
+
+from .csv_database import FSYNC_BATCH, FSYNC_NEVER, CSVDatabase, Schema, flatten_dict
+
+MAGIC = b"VWDB0001"
+# magic, header-grootte, aantal kolommen
+HEADER = struct.Struct("<8sII")
+DTYPE = np.dtype("<f8")
+
+
+class BinaryCursor:
+    """
+    Cursor over the rows [begin, end) of a BinaryDatabase. `offset` and `size`
+    are in bytes, like the CSV cursor.
+    """
+
+    def __init__(self, db: "BinaryDatabase", data: np.ndarray | None, begin: int, end: int):
+        self.db = db
+        self.data = data
+        self.row = begin
+        self.end = end
+        self.offset = begin * db.row_size
+        self.size = (end - begin) * db.row_size
+        self._closed = False
+
+    def __enter__(self) -> "BinaryCursor":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if not self._closed:
+            self.data = None
+            self._closed = True
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def read(self) -> dict[str, Any] | None:
+        if self.data is None or self.row >= self.end:
+            return None
+        values = self.data[self.row].tolist()
+        self.row += 1
+        self.offset += self.db.row_size
+        self.size -= self.db.row_size
+        return self.db.schema.unflatten(values)
+
+    def read_array(self, max_rows: int | None = None, columns: list[str] | None = None) -> np.ndarray:
+        """
+        Read up to `max_rows` rows (all by default) as a 2-D float array, with
+        only the given `columns` (all by default) in the given order.
+        """
+        width = len(self.db.columns) if columns is None else len(columns)
+        if self.data is None or self.row >= self.end:
+            return np.empty((0, width))
+
+        end = self.end if max_rows is None else min(self.end, self.row + max_rows)
+        block = self.data[self.row:end]
+        if columns is None:
+            result = np.array(block)
+        else:
+            result = block[:, [self.db.columns.index(c) for c in columns]]
+
+        count = end - self.row
+        self.row = end
+        self.offset += count * self.db.row_size
+        self.size -= count * self.db.row_size
+        return result
+
+    def read_columns(self, max_rows: int | None = None, columns: list[str] | None = None) -> dict[str, np.ndarray]:
+        """Like `read_array`, but returns one array per column."""
+        if columns is None:
+            columns = self.db.columns
+        data = self.read_array(max_rows, columns)
+        return {name: data[:, i] for i, name in enumerate(columns)}
+
+    def read_many(self, count=-1) -> Iterator[dict[str, Any]]:
+        """Up to `count` rows, or all remaining rows when `count` is negative."""
+        done = 0
+        while count < 0 or done < count:
+            row = self.read()
+            if row is None:
+                break
+            done += 1
+            yield row
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        while True:
+            row = self.read()
+            if row is None:
+                break
+            yield row
+
+
+class BinaryDatabase:
+    """
+    Append-only database of fixed-width float64 records.
+
+    The file starts with a small header (magic, header size, column count and
+    the newline-separated column names), followed by one record of
+    `len(columns)` little-endian doubles per row. Reads go through a numpy
+    memmap. Writing follows the same commit/fsync policy as CSVDatabase.
+    `readonly` is as for CSVDatabase.
+    """
+
+    def __init__(self, filename: str, *, index_col="id", timestamp_col="timestamp",
+                 commit_rows: int = 1, commit_interval: float = 0.0,
+                 fsync: str | float = FSYNC_NEVER, readonly: bool = False):
+        self.filename = filename
+        self.readonly = readonly
+        self.index_col = index_col
+        self.timestamp_col = timestamp_col
+        self.commit_rows = commit_rows
+        self.commit_interval = commit_interval
+        self.fsync = fsync
+
+        self.columns: list[str] = []
+        self.schema = Schema([])
+        self.begin_pos = 0
+        self.row_size = 0
+        self.rows = 0  # gecommitte rijen
+        self.next_index = 0
+
+        self._record: struct.Struct | None = None
+        self._output = None
+        self._pending: list[bytes] = []
+        self._pending_since = 0.0
+        self._last_sync = time.time()
+        self._lock = threading.Lock()
+        self._warned: set[str] = set()  # kolommen waarvoor al gewaarschuwd is
+
+        try:
+            self._read_header()
+        except FileNotFoundError:
+            # that's ok, we'll initalize later
+            pass
+
+    def __enter__(self) -> "BinaryDatabase":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _read_header(self):
+        with open(self.filename, "rb") as f:
+            raw = f.read(HEADER.size)
+            if not raw:
+                return  # leeg bestand
+            if len(raw) < HEADER.size:
+                self._partial_header()
+                return
+
+            magic, header_size, ncols = HEADER.unpack(raw)
+            if magic != MAGIC:
+                raise ValueError(f"{self.filename} is not a binary database")
+            if os.fstat(f.fileno()).st_size < header_size:
+                self._partial_header()
+                return
+            names = f.read(header_size - HEADER.size).rstrip(b"\0")
+            self._set_columns(names.decode().split("\n"))
+            self.begin_pos = header_size
+
+            size = os.fstat(f.fileno()).st_size
+            self.rows = max(size - header_size, 0) // self.row_size
+            if self.rows > 0:
+                f.seek(header_size + (self.rows - 1) * self.row_size)
+                last = self._record.unpack(f.read(self.row_size))
+                self.next_index = int(last[self.columns.index(self.index_col)]) + 1
+
+            if header_size + self.rows * self.row_size != size and not self.readonly:
+                # afgebroken record na een crash
+                print(f"[warn] truncating partial record in {self.filename}")
+                os.truncate(self.filename, header_size + self.rows * self.row_size)
+
+    def _partial_header(self):
+        if self.readonly:
+            return  # de schrijver is nog met de header bezig
+        # crash tijdens het schrijven van de header
+        print(f"[warn] truncating partial header in {self.filename}")
+        os.truncate(self.filename, 0)
+
+    def refresh(self):
+        """Pick up the rows another process committed since opening (readonly)."""
+        with self._lock:
+            try:
+                self._read_header()
+            except FileNotFoundError:
+                pass
+
+    def _set_columns(self, columns: list[str]):
+        if self.index_col not in columns:
+            raise KeyError(
+                f"database does not contain index column `{self.index_col}`")
+        if self.timestamp_col not in columns:
+            raise KeyError(
+                f"database does not contain timestamp column `{self.timestamp_col}`")
+        self.columns = columns
+        self.schema = Schema(columns)
+        self.row_size = len(columns) * DTYPE.itemsize
+        self._record = struct.Struct(f"<{len(columns)}d")
+
+    @staticmethod
+    def header(columns: list[str]) -> bytes:
+        names = "\n".join(columns).encode()
+        header_size = HEADER.size + len(names)
+        header_size += -header_size % DTYPE.itemsize
+        return (HEADER.pack(MAGIC, header_size, len(columns)) + names).ljust(header_size, b"\0")
+
+    def _map(self) -> np.ndarray | None:
+        rows = self.rows
+        if rows == 0:
+            return None
+        return np.memmap(self.filename, dtype=DTYPE, mode="r", offset=self.begin_pos,
+                         shape=(rows, len(self.columns)))
+
+    def _make_cursor(self, col_index: int, target: float) -> BinaryCursor:
+        data = self._map()
+        if data is None:
+            return BinaryCursor(self, None, 0, 0)
+
+        # laatste rij met waarde <= target
+        begin = bisect.bisect_right(data[:, col_index], target) - 1
+        return BinaryCursor(self, data, max(begin, 0), len(data))
+
+    def cursor_begin(self) -> BinaryCursor:
+        data = self._map()
+        return BinaryCursor(self, data, 0, 0 if data is None else len(data))
+
+    def cursor_since(self, timestamp: float) -> BinaryCursor:
+        return self._make_cursor(self.columns.index(self.timestamp_col), timestamp)
+
+    def cursor_index(self, index: float) -> BinaryCursor:
+        return self._make_cursor(self.columns.index(self.index_col), index)
+
+    def insert(self, sensor_values: dict[str, Any], timestamp: float | None = None) -> list[float]:
+        """
+        Append a row and return it as written, in column order. The timestamp
+        is the current time unless given.
+        """
+        if self.readonly:
+            raise io.UnsupportedOperation(f"{self.filename} is opened read-only")
+        if any(type(v) is dict for v in sensor_values.values()):
+            sensor_values = flatten_dict(sensor_values)
+        with self._lock:
+            index = self.next_index
+            self.next_index += 1
+
+            # no header?
+            if self.begin_pos == 0:
+                columns = [self.index_col, self.timestamp_col]
+                for key in sensor_values.keys():
+                    if key not in [self.index_col, self.timestamp_col]:
+                        columns.append(key)
+                self._set_columns(columns)
+
+                header = self.header(columns)
+                self._append(header)
+                self.begin_pos = len(header)
+
+            assert self._record is not None
+            values = self.schema.values(sensor_values)
+            values[self.schema.positions[self.index_col]] = index
+            values[self.schema.positions[self.timestamp_col]] = \
+                time.time() if timestamp is None else timestamp
+            self._append(self._record.pack(*values))
+
+            if len(self._pending) >= self.commit_rows or \
+                    time.time() - self._pending_since >= self.commit_interval:
+                self._commit()
+
+        notwrite = self.schema.unknown(sensor_values)
+        if len(notwrite) and not self._warned.issuperset(notwrite):
+            # het bestand houdt zijn kolommen, dus één keer melden is genoeg
+            self._warned.update(notwrite)
+            print("[warn] not writing values: " + ", ".join(notwrite))
+        return values
+
+    def _append(self, data: bytes):
+        if not self._pending:
+            self._pending_since = time.time()
+        self._pending.append(data)
+
+    def _commit(self, sync: bool = False):
+        if self._pending:
+            if self._output is None:
+                self._output = open(self.filename, "ab")
+
+            data = b"".join(self._pending)
+            self._pending.clear()
+            self._output.write(data)
+            self._output.flush()
+            size = self._output.tell()
+            self.rows = (size - self.begin_pos) // self.row_size
+
+        if self._output is None or self.fsync == FSYNC_NEVER:
+            return
+
+        curtime = time.time()
+        if sync or self.fsync == FSYNC_BATCH or \
+                curtime - self._last_sync >= float(self.fsync):
+            os.fsync(self._output.fileno())
+            self._last_sync = curtime
+
+    def commit_due(self):
+        """
+        Commit the pending rows once the oldest is `commit_interval` old.
+        `insert` only checks this on the next row, so a writer that inserts
+        rarely calls this from a timer.
+        """
+        with self._lock:
+            if self._pending and time.time() - self._pending_since >= self.commit_interval:
+                self._commit()
+
+    def flush(self):
+        """Commit all pending rows, and fsync unless the policy is FSYNC_NEVER."""
+        with self._lock:
+            self._commit(sync=True)
+
+    def close(self):
+        with self._lock:
+            self._commit(sync=True)
+            if self._output is not None:
+                self._output.close()
+                self._output = None
+
+
+def convert_csv(source: str, target: str) -> int:
+    """
+    Convert a collect-*.csv or predict-*.csv database to the binary format,
+    keeping ids and timestamps. Returns the number of converted rows.
+    """
+    src = CSVDatabase(source, index_every=None, readonly=True)
+    if not src.columns:
+        raise ValueError(f"{source} is empty")
+
+    record = struct.Struct(f"<{len(src.columns)}d")
+    count = 0
+    with open(source, newline="") as inp, open(target, "xb") as out:
+        inp.seek(src.begin_pos)
+        out.write(BinaryDatabase.header(src.columns))
+        for line in inp:
+            if not line.endswith("\n"):
+                break  # afgebroken laatste regel
+            values = [float(v) for v in line.rstrip("\r\n").split(",")]
+            out.write(record.pack(*values))
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Converteer CSV-databases naar het binaire formaat.")
+    parser.add_argument("csv", nargs="+",
+                        help="collect-*.csv of predict-*.csv bestanden")
+    args = parser.parse_args()
+
+    for source in args.csv:
+        target = os.path.splitext(source)[0] + ".bin"
+        count = convert_csv(source, target)
+        print(f"{source} -> {target}: {count} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+from collections import deque
+from dataclasses import dataclass
+import json
+import threading
+from typing import Any
+
+
+@dataclass
+class Event:
+    name: str
+    text: str  # al geformatteerd als server-sent event
+    id: int | None = None
+    key: str | None = None
+
+
+def format_event(name: str, data: Any, id: int | str | None = None) -> str:
+    lines = []
+    if id is not None:
+        lines.append(f"id: {id}")
+    lines.append(f"event: {name}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class Subscription:
+    """
+    Bounded queue of one client. When the client falls behind, the oldest
+    events are dropped.
+    """
+
+    def __init__(self, maxsize: int):
+        self.queue: deque[Event] = deque(maxlen=maxsize)
+        self.dropped = 0
+        self._cond = threading.Condition()
+
+    def put(self, event: Event):
+        with self._cond:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(event)
+            self._cond.notify()
+
+    def get(self, timeout: float) -> list[Event]:
+        """All queued events, waiting up to `timeout` seconds for one."""
+        with self._cond:
+            if not self.queue:
+                self._cond.wait(timeout)
+            events = list(self.queue)
+            self.queue.clear()
+            return events
+
+
+class Broadcaster:
+    """
+    Fans events out to all subscribed clients. Each event is serialized once.
+    An event with a `key` is serialized without its id line: the stream of
+    each client adds its own, from the ids it sent per key.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._subscriptions: list[Subscription] = []
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return len(self._subscriptions) > 0
+
+    def subscribe(self) -> Subscription:
+        sub = Subscription(self.maxsize)
+        with self._lock:
+            self._subscriptions = self._subscriptions + [sub]
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s is not sub]
+
+    def publish(self, name: str, data: Any, id: int | None = None, key: str | None = None):
+        subscriptions = self._subscriptions
+        if not subscriptions:
+            return
+        event = Event(name, format_event(name, data, id if key is None else None), id, key)
+        for sub in subscriptions:
+            sub.put(event)
+
+    def stats(self) -> dict[str, int]:
+        subscriptions = self._subscriptions
+        return dict(clients=len(subscriptions),
+                    dropped=sum(sub.dropped for sub in subscriptions))
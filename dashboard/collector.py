@@ -1,7 +1,8 @@
 from itertools import product
 import time
+from typing import Any
 
-from .csv_database import CSVDatabase
+from .database import Database, open_database
 from .valve import ValveState
 
 
@@ -9,13 +10,14 @@ class Collector:
     interval: int
     todo: list[dict[str, ValveState]]
     next_run: float
-    db: CSVDatabase | None
+    db: Database | None
     path: str
     done: int
     pause_since: float | None
     group: dict[str, int]
+    db_options: dict[str, Any]
 
-    def __init__(self, interval: int, path: str, groups: dict[str, int]):
+    def __init__(self, interval: int, path: str, groups: dict[str, int], **db_options):
         self.interval = interval
         self.done = 0
         self.todo = []
@@ -24,6 +26,7 @@ class Collector:
         self.db = None
         self.pause_since = None
         self.groups = groups
+        self.db_options = db_options
 
     @property
     def active(self) -> bool:
@@ -97,12 +100,19 @@ class Collector:
         ]
         self.next_run = time.time()
         timestr = time.strftime('%Y-%m-%d_%H:%M:%S')
-        self.db = CSVDatabase(self.path.replace("%", timestr))
+        self.close_db()
+        self.db = open_database(self.path.replace("%", timestr),
+                                **self.db_options)
         self.done = 0
         self.pause_since = None
 
+    def close_db(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
     def cancel(self):
-        self.db = None
+        self.close_db()
         self.todo = []
         self.next_run = 0
         self.pause_since = None
@@ -116,7 +126,7 @@ class Collector:
         if self.next_run > 0 and curtime > self.next_run:
             if len(self.todo) == 0:
                 self.next_run = 0
-                self.db = None
+                self.close_db()
                 return {}
 
             self.done += 1
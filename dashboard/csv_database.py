@@ -1,18 +1,19 @@
+from collections import deque
 import io
 import os
+import threading
 import time
 from typing import Any, Iterator
 
+import numpy as np
 
-def unflatten_dict(columns: list[str], values: list[float]) -> dict[str, Any]:
-    s = {}
-    for i, key in enumerate(columns):
-        cur = s
-        *attrs, last = key.split('.')
-        for attr in attrs:
-            cur = cur.setdefault(attr, {})
-        cur[last] = values[i]
-    return s
+from .csv_index import FIELD_INDEX, FIELD_TIMESTAMP, SidecarIndex
+
+FSYNC_NEVER = "never"
+FSYNC_BATCH = "batch"
+READ_BLOCK = 1 << 20  # bytes
+READ_FIRST_BLOCK = 1 << 12  # bytes, een begrensde read groeit per blok tot READ_BLOCK
+TAIL_BLOCK = 1 << 16  # bytes
 
 
 def flatten_dict(d: dict[str, Any], prefix: str = "") -> dict[str, float]:
@@ -26,6 +27,50 @@ def flatten_dict(d: dict[str, Any], prefix: str = "") -> dict[str, float]:
     return flat
 
 
+class Schema:
+    """
+    Column layout of a database, compiled once.
+
+    Converts between positional rows and (nested) dicts using column paths
+    and an index map split once, instead of splitting column names for
+    every row.
+    """
+
+    def __init__(self, columns: list[str]):
+        self.columns = list(columns)
+        self.positions = {name: i for i, name in enumerate(self.columns)}
+
+        # (pad van de ouders, laatste deel, positie) per kolom, één keer gesplitst
+        self._paths = []
+        for i, key in enumerate(self.columns):
+            *attrs, last = key.split('.')
+            self._paths.append((tuple(attrs), last, i))
+
+    def unflatten(self, values: list[float]) -> dict[str, Any]:
+        """Nested dict from a positional row."""
+        row: dict[str, Any] = {}
+        for attrs, last, i in self._paths:
+            cur = row
+            for attr in attrs:
+                sub = cur.get(attr)
+                if sub is None:
+                    sub = cur[attr] = {}
+                cur = sub
+            cur[last] = values[i]
+        return row
+
+    def values(self, flat: dict[str, float], default: float = 0) -> list[float]:
+        """Positional row from a flat dict, missing columns become `default`."""
+        get = flat.get
+        return [get(key, default) for key in self.columns]
+
+    def unknown(self, flat: dict[str, float]) -> list[str]:
+        """Keys of a flat dict that have no column."""
+        if len(flat) <= len(self.positions) and flat.keys() <= self.positions.keys():
+            return []
+        return [key for key in flat if key not in self.positions]
+
+
 class Cursor:
     def __init__(self, db: "CSVDatabase", fp: io.TextIOBase, size: int):
         self.db = db
@@ -33,6 +78,9 @@ class Cursor:
         self.size = size
         self.offset = 0
         self._closed = False
+        self._lines: deque[str] = deque()
+        self._unread = size  # nog niet uit het bestand gelezen
+        self._block = 0  # bytes voor het volgende begrensde blok, 0 voor het eerste
 
     def __enter__(self) -> "Cursor":
         return self
@@ -49,23 +97,80 @@ class Cursor:
     def closed(self) -> bool:
         return self._closed
 
+    def _readlines(self, max_rows: int | None) -> list[str]:
+        # lees in blokken, en houd de rest vast voor de volgende aanroep; een
+        # begrensde read (een rij na cursor_since) leest klein en groeit
+        while (max_rows is None or len(self._lines) < max_rows) and self._unread > 0:
+            if max_rows is None:
+                block = self.file.readlines(min(READ_BLOCK, self._unread))
+            elif max_rows == 1 and self._block == 0:
+                line = self.file.readline(self._unread)
+                block = [line] if line else []
+                self._block = READ_FIRST_BLOCK
+            else:
+                block = self.file.readlines(min(self._block or READ_FIRST_BLOCK, self._unread))
+                self._block = min(max(self._block, READ_FIRST_BLOCK) * 2, READ_BLOCK)
+            if not block:
+                self._unread = 0
+                break
+            for line in block:
+                if len(line) > self._unread or not line.endswith("\n"):
+                    # voorbij het gecommitte einde
+                    self._unread = 0
+                    break
+                self._lines.append(line)
+                self._unread -= len(line)
+
+        if max_rows is None or max_rows >= len(self._lines):
+            lines = list(self._lines)
+            self._lines.clear()
+        else:
+            lines = [self._lines.popleft() for _ in range(max_rows)]
+
+        size = sum(map(len, lines))
+        self.offset += size
+        self.size -= size
+        return lines
+
     def read(self) -> dict[str, Any] | None:
         if self.size <= 0:
             return None
-        line = self.file.readline()
-        if line == "":
+        lines = self._readlines(1)
+        if not lines:
             return None
-        self.offset += len(line)
-        self.size -= len(line)
-        values = [float(v) for v in line.rstrip("\r\n").split(',')]
-        return unflatten_dict(self.db.columns, values)
+        values = [float(v) for v in lines[0].rstrip("\r\n").split(',')]
+        return self.db.schema.unflatten(values)
+
+    def read_array(self, max_rows: int | None = None, columns: list[str] | None = None) -> np.ndarray:
+        """
+        Read up to `max_rows` rows (all by default) as a 2-D float array, with
+        only the given `columns` (all by default) in the given order.
+        """
+        usecols = None
+        if columns is not None:
+            usecols = [self.db.columns.index(c) for c in columns]
+        width = len(self.db.columns) if columns is None else len(columns)
+
+        lines = self._readlines(max_rows) if self.size > 0 else []
+        if not lines:
+            return np.empty((0, width))
+        return np.loadtxt(lines, delimiter=",", usecols=usecols, ndmin=2)
+
+    def read_columns(self, max_rows: int | None = None, columns: list[str] | None = None) -> dict[str, np.ndarray]:
+        """Like `read_array`, but returns one array per column."""
+        if columns is None:
+            columns = self.db.columns
+        data = self.read_array(max_rows, columns)
+        return {name: data[:, i] for i, name in enumerate(columns)}
 
     def read_many(self, count=-1) -> Iterator[dict[str, Any]]:
+        """Up to `count` rows, or all remaining rows when `count` is negative."""
         done = 0
-        while done < count:
+        while count < 0 or done < count:
             row = self.read()
             if row is None:
                 break
+            done += 1
             yield row
 
     def __iter__(self) -> Iterator[dict[str, Any]]:
@@ -77,29 +182,88 @@ class Cursor:
 
 
 class CSVDatabase:
-    def __init__(self, filename: str, *, index_col="id", timestamp_col="timestamp"):
+    """
+    Append-only CSV database.
+
+    Rows are buffered and committed to disk in groups: a commit happens when
+    `commit_rows` rows are pending or the oldest pending row is older than
+    `commit_interval` seconds. `fsync` is FSYNC_NEVER, FSYNC_BATCH (every
+    commit) or a number of seconds between fsyncs. Cursors only see committed
+    rows.
+
+    With `index_every` set, a sidecar index (`<filename>.idx`) is kept that
+    maps every n-th row to its offset, so cursors can start without
+    bisecting the data file.
+
+    With `readonly` the database only reads a file that another process
+    may be writing: nothing is truncated or indexed, a partial last row is
+    ignored, and `refresh` picks up the rows committed since. Readers of a
+    file they do not own (the API role, score.py, replays, the export
+    scripts) pass it explicitly.
+    """
+
+    def __init__(self, filename: str, *, index_col="id", timestamp_col="timestamp",
+                 commit_rows: int = 1, commit_interval: float = 0.0,
+                 fsync: str | float = FSYNC_NEVER, index_every: int | None = 64,
+                 readonly: bool = False):
         self.filename = filename
+        self.readonly = readonly
         self.index_col = index_col
         self.timestamp_col = timestamp_col
+        self.commit_rows = commit_rows
+        self.commit_interval = commit_interval
+        self.fsync = fsync
 
         self.columns: list[str] = []
+        self.schema = Schema([])
         self.begin_pos = 0
+        self.end_pos = 0  # einde van de gecommitte data
         self.next_index = 0
         self.read_cursor = 0
 
+        self._output: io.TextIOBase | None = None
+        self._pending: list[str] = []
+        self._pending_size = 0
+        self._pending_since = 0.0
+        self._last_sync = time.time()
+        self._lock = threading.Lock()
+        self._warned: set[str] = set()  # kolommen waarvoor al gewaarschuwd is
+
+        self.index: SidecarIndex | None = None
+        if index_every is not None:
+            self.index = SidecarIndex(filename + ".idx", index_every)
+
         try:
             self._find_header()
         except FileNotFoundError:
             # that's ok, we'll initalize later
-            pass
+            if self.index is not None and not readonly:
+                # een index zonder databestand hoort bij een verwijderd bestand
+                self.index.reset()
+        else:
+            if self.index is not None and not readonly:
+                self._sync_index()
+
+    def __enter__(self) -> "CSVDatabase":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
 
     def _find_header(self):
-        with open(self.filename) as f:
+        with open(self.filename, "rb") as f:
             header = f.readline()
             if not header:
                 return  # leeg bestand
-
-            self.columns = header.rstrip("\r\n").split(',')
+            if not header.endswith(b"\n"):
+                if self.readonly:
+                    return  # de schrijver is nog bezig
+                # crash tijdens het schrijven van de header
+                print(f"[warn] truncating partial header in {self.filename}")
+                os.truncate(self.filename, 0)
+                return
+
+            self.columns = header.decode().rstrip("\r\n").split(',')
             if self.index_col not in self.columns:
                 raise KeyError(
                     f"database does not contain index column `{self.index_col}`")
@@ -107,36 +271,165 @@ class CSVDatabase:
                 raise KeyError(
                     f"database does not contain timestamp column `{self.timestamp_col}`")
 
+            self.schema = Schema(self.columns)
             self.begin_pos = f.tell()
             self.read_cursor = self.begin_pos
+            self.end_pos = os.fstat(f.fileno()).st_size
 
             idx_index = self.columns.index(self.index_col)
 
             last_id: int | None = None
-            for line in f:
-                parts = line.rstrip("\r\n").split(',')
-                if len(parts) <= idx_index:
+            for start, line in self._reverse_lines(f):
+                if start + len(line) == self.end_pos:
+                    # alles na de laatste newline
+                    if line and not self.readonly:
+                        print(f"[warn] truncating partial row at {start} in {self.filename}")
+                        os.truncate(self.filename, start)
+                    self.end_pos = start
                     continue
-                try:
-                    last_id = int(parts[idx_index])
-                except ValueError:
+                if not line.strip():
                     continue
+                try:
+                    last_id = int(line.split(b',')[idx_index])
+                    break
+                except (ValueError, IndexError):
+                    print(f"[warn] skipping invalid row at {start} in {self.filename}")
 
             if last_id is not None:
                 self.next_index = last_id + 1
             else:
                 self.next_index = 0
 
-    def _make_cursor(self, ts_index: int, target: float) -> Cursor:
-        # begin_pos == 0 -> no header yet, empty file
-        if self.begin_pos == 0:
+    def refresh(self):
+        """Pick up the rows another process committed since opening (readonly)."""
+        with self._lock:
+            try:
+                self._find_header()
+            except FileNotFoundError:
+                pass
+
+    def _reverse_lines(self, f: io.BufferedReader) -> Iterator[tuple[int, bytes]]:
+        """
+        Yield (offset, line) from the end of the file back to `begin_pos`,
+        reading backwards in blocks. The first item is whatever follows the
+        last newline, which is empty unless the last row was cut off.
+        """
+        pos = self.end_pos
+        rest = b""
+        while pos > self.begin_pos:
+            step = min(TAIL_BLOCK, pos - self.begin_pos)
+            pos -= step
+            f.seek(pos)
+            parts = (f.read(step) + rest).split(b"\n")
+            rest = parts[0]
+
+            offset = pos + len(rest) + 1
+            lines = []
+            for part in parts[1:]:
+                lines.append((offset, part))
+                offset += len(part) + 1
+            yield from reversed(lines)
+
+        if rest:
+            yield self.begin_pos, rest
+
+    def _sync_index(self):
+        """
+        Validate the sidecar index against the data file and append the
+        entries it is missing. A missing or stale index is rebuilt.
+        """
+        assert self.index is not None
+        if self.end_pos <= self.begin_pos:
+            self.index.reset()
+            return
+
+        idx_index = self.columns.index(self.index_col)
+        ts_index = self.columns.index(self.timestamp_col)
+
+        start = self.begin_pos
+        last = self.index.last()
+        with open(self.filename, newline="") as f:
+            if last is not None:
+                timestamp, index, offset = last
+                valid = False
+                if self.begin_pos <= offset < self.end_pos:
+                    f.seek(offset)
+                    parts = f.readline().rstrip("\r\n").split(",")
+                    try:
+                        valid = int(parts[idx_index]) == index and \
+                            float(parts[ts_index]) == timestamp
+                    except (ValueError, IndexError):
+                        pass
+                if valid:
+                    start = offset
+                else:
+                    print(f"[warn] rebuilding index {self.index.filename}")
+                    self.index.reset()
+                    last = None
+
+            pos = start
+            f.seek(start)
+            while pos < self.end_pos:
+                line = f.readline()
+                if not line.endswith("\n"):
+                    break
+                parts = line.rstrip("\r\n").split(",")
+                try:
+                    index = int(parts[idx_index])
+                    timestamp = float(parts[ts_index])
+                except (ValueError, IndexError):
+                    index = None
+                if index is not None and self.index.wants(index) and \
+                        (last is None or index > last[1]):
+                    self.index.add(timestamp, index, pos)
+                pos += len(line)
+
+        self.index.flush()
+
+    def _make_cursor(self, col_index: int, target: float) -> Cursor:
+        # no committed rows yet
+        if self.end_pos <= self.begin_pos:
             return Cursor(self, io.StringIO(), 0)
 
-        f = open(self.filename)
+        f = open(self.filename, newline="")
+        file_size = self.end_pos
 
-        f.seek(0, os.SEEK_END)
-        file_size = f.tell()
+        if self.index is not None and col_index == self.columns.index(self.timestamp_col):
+            best_pos = self._scan(f, col_index, target, file_size,
+                                  self.index.lookup(FIELD_TIMESTAMP, target))
+        elif self.index is not None and col_index == self.columns.index(self.index_col):
+            best_pos = self._scan(f, col_index, target, file_size,
+                                  self.index.lookup(FIELD_INDEX, target))
+        else:
+            best_pos = self._bisect(f, col_index, target, file_size)
 
+        f.seek(best_pos)
+        return Cursor(self, f, file_size - best_pos)
+
+    def _scan(self, f: io.TextIOBase, col_index: int, target: float,
+              file_size: int, start: int | None) -> int:
+        if start is not None and start >= file_size:
+            # de index van een andere schrijver loopt voor op end_pos
+            return self._bisect(f, col_index, target, file_size)
+        # vanaf de index-entry hooguit `every` regels vooruit lezen
+        best_pos = start if start is not None else self.begin_pos
+        pos = best_pos
+        f.seek(pos)
+        while pos < file_size:
+            line = f.readline()
+            if not line:
+                break
+            try:
+                value = float(line.split(",", col_index + 1)[col_index])
+            except (ValueError, IndexError):
+                break
+            if value > target:
+                break
+            best_pos = pos
+            pos += len(line)
+        return best_pos
+
+    def _bisect(self, f: io.TextIOBase, col_index: int, target: float, file_size: int) -> int:
         lo = self.begin_pos
         hi = file_size
 
@@ -161,7 +454,7 @@ class CSVDatabase:
             try:
                 text = line.rstrip("\r\n")
                 parts = text.split(",")
-                ts = float(parts[ts_index])
+                ts = float(parts[col_index])
             except Exception:
                 # Rare regel → schuif wat naar links
                 hi = mid
@@ -175,16 +468,14 @@ class CSVDatabase:
                 # ts > target → links zoeken
                 hi = mid
 
-        f.seek(best_pos)
-        return Cursor(self, f, file_size - best_pos)
+        return best_pos
 
     def cursor_begin(self) -> Cursor:
-        if self.begin_pos == 0:
+        if self.end_pos <= self.begin_pos:
             return Cursor(self, io.StringIO(), 0)
 
-        f = open(self.filename)
-        f.seek(0, os. SEEK_END)
-        end = f.tell()
+        end = self.end_pos
+        f = open(self.filename, newline="")
         f.seek(self.begin_pos)
         return Cursor(self, f, end-self.begin_pos)
 
@@ -194,29 +485,106 @@ class CSVDatabase:
     def cursor_index(self, index: float) -> Cursor:
         return self._make_cursor(self.columns.index(self.index_col), index)
 
-    def insert(self, sensor_values: dict[str, Any]):
-        sensor_values = flatten_dict(sensor_values)
-        sensor_values[self.index_col] = self.next_index
-        sensor_values[self.timestamp_col] = time.time()
-        self.next_index += 1
+    def insert(self, sensor_values: dict[str, Any], timestamp: float | None = None) -> list[float]:
+        """
+        Append a row and return it as written, in column order. The timestamp
+        is the current time unless given.
+        """
+        if self.readonly:
+            raise io.UnsupportedOperation(f"{self.filename} is opened read-only")
+        if any(type(v) is dict for v in sensor_values.values()):
+            sensor_values = flatten_dict(sensor_values)
+        with self._lock:
+            index = self.next_index
+            self.next_index += 1
 
-        with open(self.filename, "a") as output:
             # no header?
             if self.begin_pos == 0:
                 self.columns = [self.index_col, self.timestamp_col]
                 for key in sensor_values.keys():
                     if key not in [self.index_col, self.timestamp_col]:
                         self.columns.append(key)
+                self.schema = Schema(self.columns)
 
                 line = ",".join(self.columns) + "\n"
-                output.write(line)
+                self._append(line)
                 self.begin_pos = len(line)
                 self.read_cursor = self.begin_pos
 
-            values = [sensor_values.get(key, 0) for key in self.columns]
-            output.write(",".join(str(v) for v in values) + "\n")
+            values = self.schema.values(sensor_values)
+            values[self.schema.positions[self.index_col]] = index
+            if timestamp is None:
+                timestamp = time.time()
+            values[self.schema.positions[self.timestamp_col]] = timestamp
+
+            if self.index is not None and self.index.wants(index):
+                self.index.add(timestamp, index, self.end_pos + self._pending_size)
+
+            self._append(",".join(map(str, values)) + "\n")
+
+            if len(self._pending) >= self.commit_rows or \
+                    time.time() - self._pending_since >= self.commit_interval:
+                self._commit()
+
+        notwrite = self.schema.unknown(sensor_values)
+        if len(notwrite) and not self._warned.issuperset(notwrite):
+            # het bestand houdt zijn kolommen, dus één keer melden is genoeg
+            self._warned.update(notwrite)
+            print("[warn] not writing values: " + ", ".join(notwrite))
+        return values
+
+    def _append(self, line: str):
+        if not self._pending:
+            self._pending_since = time.time()
+        self._pending.append(line)
+        self._pending_size += len(line)
+
+    def _commit(self, sync: bool = False):
+        if self._pending:
+            if self._output is None:
+                # newline="" zodat offsets gelijk blijven aan len(line)
+                self._output = open(self.filename, "a", newline="")
+
+            data = "".join(self._pending)
+            self._pending.clear()
+            self._pending_size = 0
+            self._output.write(data)
+            self._output.flush()
+            self.end_pos += len(data)
+
+            # index pas na de data, zodat entries nooit voorbij end_pos wijzen
+            if self.index is not None:
+                self.index.flush()
+
+        if self._output is None or self.fsync == FSYNC_NEVER:
+            return
+
+        curtime = time.time()
+        if sync or self.fsync == FSYNC_BATCH or \
+                curtime - self._last_sync >= float(self.fsync):
+            os.fsync(self._output.fileno())
+            self._last_sync = curtime
+
+    def commit_due(self):
+        """
+        Commit the pending rows once the oldest is `commit_interval` old.
+        `insert` only checks this on the next row, so a writer that inserts
+        rarely calls this from a timer.
+        """
+        with self._lock:
+            if self._pending and time.time() - self._pending_since >= self.commit_interval:
+                self._commit()
+
+    def flush(self):
+        """Commit all pending rows, and fsync unless the policy is FSYNC_NEVER."""
+        with self._lock:
+            self._commit(sync=True)
 
-            notwrite = [c for c in sensor_values.keys()
-                        if c not in self.columns]
-            if len(notwrite):
-                print("[warn] not writing values: " + ", ".join(notwrite))
+    def close(self):
+        with self._lock:
+            self._commit(sync=True)
+            if self._output is not None:
+                self._output.close()
+                self._output = None
+            if self.index is not None:
+                self.index.close()
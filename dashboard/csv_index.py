@@ -0,0 +1,118 @@
+import mmap
+import os
+import struct
+import threading
+
+# (timestamp, id, byte offset in het databestand)
+ENTRY = struct.Struct("<dqQ")
+FIELD_TIMESTAMP = 0
+FIELD_INDEX = 1
+
+
+class SidecarIndex:
+    """
+    Fixed-width binary index next to a CSV database.
+
+    One entry is stored for every `every`-th row id, so a lookup only has to
+    scan at most `every` rows of the data file after resolving the offset.
+    """
+
+    def __init__(self, filename: str, every: int = 64):
+        self.filename = filename
+        self.every = every
+
+        self._output = None
+        self._pending: list[bytes] = []
+        self._map: mmap.mmap | None = None
+        self._map_file = None
+        self._map_count = 0
+        self._lock = threading.Lock()
+
+    def wants(self, index: int) -> bool:
+        return index % self.every == 0
+
+    def add(self, timestamp: float, index: int, offset: int):
+        with self._lock:
+            self._pending.append(ENTRY.pack(timestamp, index, offset))
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            if self._output is None:
+                self._output = open(self.filename, "ab")
+            self._output.write(b"".join(self._pending))
+            self._output.flush()
+            self._pending.clear()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._output is not None:
+                self._output.close()
+                self._output = None
+            self._unmap()
+
+    def reset(self):
+        """Drop all entries, e.g. when the index no longer matches the data."""
+        with self._lock:
+            if self._output is not None:
+                self._output.close()
+                self._output = None
+            self._unmap()
+            self._pending.clear()
+            try:
+                os.remove(self.filename)
+            except FileNotFoundError:
+                pass
+
+    def last(self) -> tuple[float, int, int] | None:
+        with self._lock:
+            count = self._remap()
+            if count == 0:
+                return None
+            return ENTRY.unpack_from(self._map, (count - 1) * ENTRY.size)
+
+    def lookup(self, field: int, target: float) -> int | None:
+        """
+        Offset of the last indexed row whose `field` is <= target, or None
+        if every indexed row is past the target.
+        """
+        with self._lock:
+            count = self._remap()
+            lo, hi = 0, count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if ENTRY.unpack_from(self._map, mid * ENTRY.size)[field] <= target:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo == 0:
+                return None
+            return ENTRY.unpack_from(self._map, (lo - 1) * ENTRY.size)[2]
+
+    def _remap(self) -> int:
+        try:
+            size = os.path.getsize(self.filename)
+        except FileNotFoundError:
+            self._unmap()
+            return 0
+
+        count = size // ENTRY.size
+        if count != self._map_count:
+            self._unmap()
+            if count > 0:
+                self._map_file = open(self.filename, "rb")
+                self._map = mmap.mmap(self._map_file.fileno(), count * ENTRY.size,
+                                      access=mmap.ACCESS_READ)
+            self._map_count = count
+        return count
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._map_file is not None:
+            self._map_file.close()
+            self._map_file = None
+        self._map_count = 0
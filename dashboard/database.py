@@ -0,0 +1,37 @@
+import os
+
+from .binary_database import BinaryDatabase, BinaryCursor
+from .csv_database import CSVDatabase, Cursor
+from .segmented_database import ChainCursor, SegmentedDatabase
+
+BINARY_EXTENSION = ".bin"
+
+Database = CSVDatabase | BinaryDatabase | SegmentedDatabase
+AnyCursor = Cursor | BinaryCursor | ChainCursor
+
+
+def open_database(filename: str, backend: str | None = None, *, roll: str | None = None,
+                  max_segment_bytes: int | None = None, retention: float | None = None,
+                  archive_dir: str | None = None, **options) -> Database:
+    """
+    Open a database with the given backend ("csv" or "binary"). Without a
+    backend it is chosen by file extension: `.bin` is binary, anything else
+    is CSV. CSV-only options are dropped for the binary backend.
+
+    With `roll` ("hour" or "day") or `max_segment_bytes` the database is
+    split into segments, see SegmentedDatabase.
+    """
+    if roll is not None or max_segment_bytes is not None:
+        return SegmentedDatabase(filename, roll=roll, max_bytes=max_segment_bytes,
+                                 retention=retention, archive_dir=archive_dir, **options)
+
+    if backend is None:
+        ext = os.path.splitext(filename)[1]
+        backend = "binary" if ext == BINARY_EXTENSION else "csv"
+
+    if backend == "csv":
+        return CSVDatabase(filename, **options)
+    if backend == "binary":
+        options.pop("index_every", None)
+        return BinaryDatabase(filename, **options)
+    raise ValueError(f"unknown database backend `{backend}`")
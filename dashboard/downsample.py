@@ -0,0 +1,184 @@
+from typing import Iterable
+
+import numpy as np
+
+AGGREGATES = ["mean", "min", "max"]
+
+
+class BucketAggregator:
+    """
+    Streaming aggregation of time-sorted rows into fixed-width time buckets,
+    aligned to `origin`.
+
+    Rows are fed block by block; only the bucket that is still open is kept
+    besides the finished buckets, so memory depends on the number of buckets,
+    not on the number of rows.
+    """
+
+    def __init__(self, ts_col: int, width: float, origin: float = 0.0):
+        self.ts_col = ts_col
+        self.width = width
+        self.origin = origin
+
+        self.buckets: list[int] = []
+        self.counts: list[int] = []
+        self.sums: list[np.ndarray] = []
+        self.mins: list[np.ndarray] = []
+        self.maxs: list[np.ndarray] = []
+
+    def add(self, block: np.ndarray):
+        if len(block) == 0:
+            return
+
+        bucket = self._bucket(block[:, self.ts_col])
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        counts = np.diff(np.r_[starts, len(block)])
+        sums = np.add.reduceat(block, starts, axis=0)
+        mins = np.minimum.reduceat(block, starts, axis=0)
+        maxs = np.maximum.reduceat(block, starts, axis=0)
+        self._merge(bucket[starts], counts, sums, mins, maxs)
+
+    def add_partial(self, timestamps: np.ndarray, counts: np.ndarray, sums: np.ndarray,
+                    mins: np.ndarray, maxs: np.ndarray):
+        """
+        Add rows that are already aggregated over smaller buckets (as kept by
+        a rollup), each starting at `timestamps`.
+        """
+        if len(timestamps) == 0:
+            return
+
+        bucket = self._bucket(timestamps)
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        self._merge(bucket[starts],
+                    np.add.reduceat(counts, starts),
+                    np.add.reduceat(sums, starts, axis=0),
+                    np.minimum.reduceat(mins, starts, axis=0),
+                    np.maximum.reduceat(maxs, starts, axis=0))
+
+    def _bucket(self, timestamps: np.ndarray) -> np.ndarray:
+        return np.floor((timestamps - self.origin) / self.width).astype(np.int64)
+
+    def _merge(self, buckets: np.ndarray, counts: np.ndarray, sums: np.ndarray,
+               mins: np.ndarray, maxs: np.ndarray):
+        for i, b in enumerate(buckets.tolist()):
+            if self.buckets and self.buckets[-1] == b:
+                # bucket loopt door vanuit het vorige blok
+                self.counts[-1] += int(counts[i])
+                self.sums[-1] = self.sums[-1] + sums[i]
+                self.mins[-1] = np.minimum(self.mins[-1], mins[i])
+                self.maxs[-1] = np.maximum(self.maxs[-1], maxs[i])
+            else:
+                self.buckets.append(b)
+                self.counts.append(int(counts[i]))
+                self.sums.append(sums[i])
+                self.mins.append(mins[i])
+                self.maxs.append(maxs[i])
+
+    def result(self, agg: str, width: int) -> np.ndarray:
+        """One row per non-empty bucket with the `agg` of every column."""
+        if not self.buckets:
+            return np.empty((0, width))
+        if agg == "mean":
+            return np.array(self.sums) / np.array(self.counts)[:, None]
+        if agg == "min":
+            return np.array(self.mins)
+        if agg == "max":
+            return np.array(self.maxs)
+        raise ValueError(f"unknown aggregate `{agg}`")
+
+
+def aggregate(blocks: Iterable[np.ndarray], ts_col: int, width: float, ncols: int,
+              agg: str = "mean") -> np.ndarray:
+    aggregator = BucketAggregator(ts_col, width)
+    for block in blocks:
+        aggregator.add(block)
+    return aggregator.result(agg, ncols)
+
+
+class LTTB:
+    """
+    Streaming largest-triangle-three-buckets over every column at once.
+
+    Rows are grouped into time buckets of `width` seconds. A bucket is
+    decided once the next one is complete, so only two buckets of raw rows
+    are held in memory. Per column the row that forms the largest triangle
+    with the previously selected point and the average of the next bucket
+    is kept.
+    """
+
+    def __init__(self, ts_col: int, width: float, origin: float = 0.0):
+        self.ts_col = ts_col
+        self.width = width
+        self.origin = origin
+
+        self._bucket: int | None = None
+        self._rows: list[np.ndarray] = []  # open bucket
+        self._pending: np.ndarray | None = None  # bucket waiting for its successor
+        self._prev: tuple[np.ndarray, np.ndarray] | None = None  # per kolom (t, v)
+        self.times: list[np.ndarray] = []
+        self.values: list[np.ndarray] = []
+
+    def add(self, block: np.ndarray):
+        if len(block) == 0:
+            return
+
+        bucket = np.floor((block[:, self.ts_col] - self.origin) / self.width).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        for i, start in enumerate(starts):
+            end = starts[i + 1] if i + 1 < len(starts) else len(block)
+            b = int(bucket[start])
+            if self._bucket is not None and b != self._bucket:
+                self._close()
+            self._bucket = b
+            self._rows.append(block[start:end])
+
+    def _close(self):
+        rows = np.concatenate(self._rows)
+        self._rows = []
+        if self._prev is None:
+            # eerste punt wordt altijd gehouden
+            first = rows[0]
+            self._emit(np.full(len(first), first[self.ts_col]), first)
+            rows = rows[1:]
+        elif self._pending is not None and len(self._pending):
+            self._select(self._pending, rows[:, self.ts_col].mean(), rows.mean(axis=0))
+        self._pending = rows
+
+    def _select(self, rows: np.ndarray, next_t: float, next_v: np.ndarray):
+        assert self._prev is not None
+        prev_t, prev_v = self._prev
+        t = rows[:, self.ts_col][:, None]
+        area = np.abs((prev_t - next_t) * (rows - prev_v) - (prev_t - t) * (next_v - prev_v))
+        pick = np.argmax(area, axis=0)
+        cols = np.arange(rows.shape[1])
+        self._emit(rows[pick, self.ts_col], rows[pick, cols])
+
+    def _emit(self, times: np.ndarray, values: np.ndarray):
+        self.times.append(times)
+        self.values.append(values)
+        self._prev = (times, values)
+
+    def finish(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (times, values), both shaped (points, columns): the selected points
+        per column.
+        """
+        if self._rows:
+            self._close()
+        if self._pending is not None and len(self._pending):
+            # laatste punt wordt altijd gehouden
+            last = self._pending[-1]
+            if len(self._pending) > 1:
+                self._select(self._pending[:-1], last[self.ts_col], last)
+            self._emit(np.full(len(last), last[self.ts_col]), last)
+            self._pending = None
+        if not self.times:
+            return np.empty((0, 0)), np.empty((0, 0))
+        return np.array(self.times), np.array(self.values)
+
+
+def lttb(blocks: Iterable[np.ndarray], ts_col: int, width: float) -> tuple[np.ndarray, np.ndarray]:
+    sampler = LTTB(ts_col, width)
+    for block in blocks:
+        sampler.add(block)
+    return sampler.finish()
@@ -1,2 +1,6 @@
 class NotSupportedError(RuntimeError):
     pass
+
+
+class ModelUnavailableError(RuntimeError):
+    pass
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+from typing import cast
+
+import keras
+import numpy as np
+
+from model.export import export_keras_model  # draait als python -m vanuit de repo
+from .export_common import latency, sample_rows
+from .predictor import KerasPredictor, ModelPredictor, NumpyAutoencoderPredictor
+
+PARITY_TOLERANCE = 1e-4
+
+
+def parity(reference: ModelPredictor, candidate: ModelPredictor, rows: list[dict[str, float]]) -> float:
+    """Largest absolute difference between the raw model outputs."""
+    x = np.array([[row[name] for name in reference.feature_names] for row in rows], "float32")
+    x = (x - reference.mean) / reference.std
+    expected = reference._predict_row(x)
+    got = candidate._predict_row(x)
+    return float(np.abs(np.asarray(expected) - got).max())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Exporteer de Keras-autoencoder naar .npz voor NumpyAutoencoderPredictor.")
+    parser.add_argument("model", nargs="?", default="dashboard/model/ae",
+                        help="pad-prefix van het model (zonder .keras/.json)")
+    parser.add_argument("--data", default=None,
+                        help="CSV-database met rijen voor de controle (standaard: willekeurige rijen)")
+    parser.add_argument("--rows", type=int, default=1000,
+                        help="aantal rijen voor de controle")
+    parser.add_argument("--bench", type=int, default=0,
+                        help="aantal predict-aanroepen per model voor de latency-meting")
+    args = parser.parse_args()
+
+    model = cast(keras.Model, keras.models.load_model(args.model + ".keras"))
+    export_keras_model(model, args.model)
+    print(f"[AE] Saved weights to {args.model}.npz")
+
+    reference = KerasPredictor(args.model, [])
+    candidate = NumpyAutoencoderPredictor(args.model, [])
+    rows = sample_rows(reference, args.data, args.rows)
+
+    error = parity(reference, candidate, rows)
+    print(f"max abs difference over {len(rows)} rows: {error:.3g}")
+
+    if args.bench > 0:
+        for name, predictor in [("keras", reference), ("numpy", candidate)]:
+            latency(predictor, rows, 10)  # opwarmen
+            times = np.array(latency(predictor, rows, args.bench)) * 1e6
+            print(f"{name}: median {np.median(times):.1f} us, "
+                  f"p99 {np.percentile(times, 99):.1f} us per row")
+
+    if error > PARITY_TOLERANCE:
+        print(f"[error] outputs differ by more than {PARITY_TOLERANCE}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
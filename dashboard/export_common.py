@@ -0,0 +1,38 @@
+import time
+
+import numpy as np
+
+from .csv_database import CSVDatabase
+from .predictor import ModelPredictor
+
+
+def sample_rows(predictor: ModelPredictor, source: str | None, count: int) -> list[dict[str, float]]:
+    """
+    Rows from a collect-*.csv/predict-*.csv database, or random rows: around
+    the training mean for normalized models, else in the 0-5 range of
+    RandomizedSensor.
+    """
+    if source is not None:
+        db = CSVDatabase(source, index_every=None, readonly=True)
+        with db.cursor_begin() as cur:
+            data = cur.read_array(count, predictor.feature_names)
+        return [dict(zip(predictor.feature_names, row)) for row in data.tolist()]
+
+    rng = np.random.default_rng(0)
+    shape = (count, len(predictor.feature_names))
+    if predictor.normalized:
+        data = rng.normal(predictor.mean, predictor.std, shape)
+    else:
+        data = rng.uniform(0, 5, shape)
+    return [dict(zip(predictor.feature_names, row)) for row in data.tolist()]
+
+
+def latency(predictor: ModelPredictor, rows: list[dict[str, float]], repeat: int) -> list[float]:
+    """Seconds per single-row `predict` call."""
+    times = []
+    for i in range(repeat):
+        row = rows[i % len(rows)]
+        start = time.perf_counter()
+        predictor.predict(row)
+        times.append(time.perf_counter() - start)
+    return times
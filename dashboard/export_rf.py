@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import argparse
+import multiprocessing
+import os
+import sys
+from typing import cast
+
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+
+from .export_common import latency, sample_rows
+from .predictor import CompiledForestPredictor, RandomForestPredictor, compile_forest
+
+PARITY_TOLERANCE = {"float64": 1e-9, "float32": 1e-4, "float16": 1e-2}
+
+
+def resident_memory() -> int | None:
+    """Resident set size of this process in bytes, where /proc is available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def load_memory(compiled: bool, path: str) -> int | None:
+    """Growth of the resident memory from loading one predictor."""
+    before = resident_memory()
+    predictor = (CompiledForestPredictor if compiled else RandomForestPredictor)(path, [])
+    after = resident_memory()
+    del predictor
+    return None if before is None or after is None else after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compileer het random forest naar .npz voor CompiledForestPredictor.")
+    parser.add_argument("model", nargs="?", default="dashboard/model/rf",
+                        help="pad-prefix van het model (zonder .joblib/.json)")
+    parser.add_argument("--dtype", choices=list(PARITY_TOLERANCE), default="float64",
+                        help="type van de bladwaarden")
+    parser.add_argument("--data", default=None,
+                        help="CSV-database met rijen voor de controle (standaard: willekeurige rijen)")
+    parser.add_argument("--rows", type=int, default=1000,
+                        help="aantal rijen voor de controle")
+    parser.add_argument("--bench", type=int, default=0,
+                        help="aantal predict-aanroepen per model voor de latency-meting")
+    args = parser.parse_args()
+
+    model = cast(RandomForestRegressor, joblib.load(args.model + ".joblib"))
+    compile_forest(model, args.model, args.dtype)
+    del model
+    print(f"[RF] Saved {args.dtype} forest to {args.model}.npz")
+
+    # elk model in een eigen proces, anders hergebruikt het ene het geheugen van het andere
+    with multiprocessing.get_context("spawn").Pool(1, maxtasksperchild=1) as pool:
+        compiled = pool.apply(load_memory, (True, args.model))
+        original = pool.apply(load_memory, (False, args.model))
+    if compiled is not None and original is not None:
+        print(f"resident memory: compiled {compiled / 2**20:.1f} MiB, "
+              f"joblib {original / 2**20:.1f} MiB")
+
+    candidate = CompiledForestPredictor(args.model, [])
+    reference = RandomForestPredictor(args.model, [])
+
+    rows = sample_rows(candidate, args.data, args.rows)
+    x = np.array([[row[name] for name in candidate.feature_names] for row in rows], "float32")
+    error = float(np.abs(reference._predict_row(x) - candidate._predict_row(x)).max())
+    print(f"max abs difference over {len(rows)} rows: {error:.3g}")
+
+    if args.bench > 0:
+        for name, predictor in [("joblib", reference), ("compiled", candidate)]:
+            latency(predictor, rows, 10)  # opwarmen
+            times = np.array(latency(predictor, rows, args.bench)) * 1e6
+            print(f"{name}: median {np.median(times):.1f} us, "
+                  f"p99 {np.percentile(times, 99):.1f} us per row")
+
+    if error > PARITY_TOLERANCE[args.dtype]:
+        print(f"[error] outputs differ by more than {PARITY_TOLERANCE[args.dtype]}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
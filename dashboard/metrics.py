@@ -0,0 +1,198 @@
+from bisect import bisect_left
+from collections import deque
+from contextlib import nullcontext
+import threading
+import time
+from typing import Any, Callable, TypeVar
+
+from .database import Database, open_database
+
+T = TypeVar("T")
+
+# seconden, van een sensor-read tot een trage predictor
+BUCKETS = [1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+           0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5]
+RATE_WINDOW = 50  # loop-iteraties voor de gehaalde sample rate
+
+_disabled = nullcontext()
+
+
+class Histogram:
+    """Cumulative histogram as Prometheus expects it, plus sum and count."""
+
+    def __init__(self, buckets: list[float] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # laatste is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            total += count
+            result.append(("+Inf" if bound == float("inf") else repr(bound), total))
+        return result
+
+
+class _Stage:
+    def __init__(self, metrics: "Metrics", name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class Metrics:
+    """
+    Timings of the stages of the sampling loop and the predictors, as
+    histograms per stage, and counters for the loop itself: overruns,
+    achieved sample rate and jitter.
+
+    Disabled, `stage` returns a shared no-op context manager and `call`
+    only calls the function, so the instrumentation can stay in place.
+
+    With `log_csv` every loop iteration also becomes a row with the stages
+    timed on the loop thread, for offline analysis.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.stages: dict[str, Histogram] = {}
+        self.loop_time = Histogram()
+        self.jitter = Histogram()
+        self.iterations = 0
+        self.overruns = 0
+
+        self._lock = threading.Lock()
+        self._starts: deque[float] = deque(maxlen=RATE_WINDOW)
+        self._last_start: float | None = None
+        self._last_delay = 0.0
+        self._loop_thread: int | None = None
+        self._row: dict[str, float] | None = None
+        self._template: dict[str, float] = {}
+        self._log: Database | None = None
+
+    def log_csv(self, filename: str, stages: list[str], **options):
+        """Log the loop stages in `stages` per iteration to a database."""
+        self._template = dict.fromkeys(["loop", "interval", "jitter"] + stages, 0.0)
+        self._row = dict(self._template)
+        self._log = open_database(filename, **options)
+
+    def observe(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.stages.get(name)
+            if histogram is None:
+                histogram = self.stages[name] = Histogram()
+            histogram.observe(seconds)
+        row = self._row
+        if row is not None and name in row and threading.get_ident() == self._loop_thread:
+            row[name] = seconds
+
+    def stage(self, name: str) -> Any:
+        """Context manager that times its block as stage `name`."""
+        if not self.enabled:
+            return _disabled
+        return _Stage(self, name)
+
+    def call(self, name: str, fn: Callable[[], T]) -> T:
+        """`fn()`, timed as stage `name`."""
+        if not self.enabled:
+            return fn()
+        start = time.perf_counter()
+        result = fn()
+        self.observe(name, time.perf_counter() - start)
+        return result
+
+    def loop(self, start: float, duration: float, delay: float):
+        """
+        End of a loop iteration that started at `start` (time.time), took
+        `duration` seconds and asked for `delay` seconds between starts.
+        """
+        if not self.enabled:
+            return
+        self._loop_thread = threading.get_ident()
+        jitter = 0.0
+        with self._lock:
+            self.iterations += 1
+            self.loop_time.observe(duration)
+            if delay > 0 and duration > delay:
+                self.overruns += 1
+            if self._last_start is not None and self._last_delay > 0:
+                jitter = abs(start - self._last_start - self._last_delay)
+                self.jitter.observe(jitter)
+            interval = start - self._last_start if self._last_start is not None else 0.0
+            self._last_start = start
+            self._last_delay = delay
+            self._starts.append(start)
+
+        row = self._row
+        if row is not None and self._log is not None:
+            row.update(loop=duration, interval=interval, jitter=jitter)
+            self._log.insert(row, start)
+            self._row = dict(self._template)
+
+    @property
+    def sample_rate(self) -> float:
+        """Loop iterations per second over the last RATE_WINDOW iterations."""
+        starts = self._starts
+        if len(starts) < 2 or starts[-1] <= starts[0]:
+            return 0.0
+        return (len(starts) - 1) / (starts[-1] - starts[0])
+
+    def prometheus(self, gauges: dict[str, dict[str, Any]] | None = None) -> str:
+        """
+        Everything in the Prometheus text format. `gauges` maps a metric
+        name to {label value: value} for state owned by others, e.g. the
+        predictor queues, labelled as `predictor`.
+        """
+        lines = []
+
+        def histogram(name: str, doc: str, items: list[tuple[str, Histogram]]):
+            lines.append(f"# HELP {name} {doc}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, h in items:
+                sep = "," if labels else ""
+                for le, count in h.cumulative():
+                    lines.append(f'{name}_bucket{{{labels}{sep}le="{le}"}} {count}')
+                suffix = f"{{{labels}}}" if labels else ""
+                lines.append(f"{name}_sum{suffix} {h.sum!r}")
+                lines.append(f"{name}_count{suffix} {h.count}")
+
+        with self._lock:
+            histogram("dashboard_stage_seconds", "Duration of a stage of the sampling loop or a predictor.",
+                      [(f'stage="{name}"', h) for name, h in sorted(self.stages.items())])
+            histogram("dashboard_loop_seconds", "Duration of one sampling loop iteration.",
+                      [("", self.loop_time)])
+            histogram("dashboard_loop_jitter_seconds",
+                      "Deviation of the time between loop starts from the requested delay.",
+                      [("", self.jitter)])
+            lines.append("# TYPE dashboard_loop_iterations_total counter")
+            lines.append(f"dashboard_loop_iterations_total {self.iterations}")
+            lines.append("# TYPE dashboard_loop_overruns_total counter")
+            lines.append(f"dashboard_loop_overruns_total {self.overruns}")
+        lines.append("# TYPE dashboard_loop_sample_rate gauge")
+        lines.append(f"dashboard_loop_sample_rate {self.sample_rate!r}")
+
+        for name, values in (gauges or {}).items():
+            kind = "counter" if name.endswith("_total") else "gauge"
+            lines.append(f"# TYPE {name} {kind}")
+            for label, value in values.items():
+                lines.append(f'{name}{{predictor="{label}"}} {float(value)!r}')
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
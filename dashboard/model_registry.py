@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import argparse
+import glob
+import os
+import shutil
+import threading
+import time
+from typing import Callable
+
+
+class ModelRegistry:
+    """
+    Versioned model artifacts: `<root>/<name>/<version>/<name>.*`, with
+    integer versions. A version directory is complete once it exists, see
+    `publish`. Version 0 is the unversioned model in `legacy_dir`
+    (`dashboard/model/ae.*`), so rigs without a registry keep working.
+    """
+
+    def __init__(self, root: str, legacy_dir: str):
+        self.root = root
+        self.legacy_dir = legacy_dir
+
+    def versions(self, name: str) -> list[int]:
+        result = []
+        if glob.glob(os.path.join(self.legacy_dir, name + ".*")):
+            result.append(0)
+        try:
+            entries = os.listdir(os.path.join(self.root, name))
+        except FileNotFoundError:
+            entries = []
+        result.extend(int(entry) for entry in entries if entry.isdigit())
+        return sorted(result)
+
+    def latest(self, name: str) -> int:
+        return max(self.versions(name), default=0)
+
+    def path(self, name: str, version: int) -> str:
+        """Path prefix of the artifacts of a version, as predictors expect it."""
+        if version == 0:
+            return os.path.join(self.legacy_dir, name)
+        return os.path.join(self.root, name, str(version), name)
+
+    def publish(self, name: str, prefix: str) -> int:
+        """
+        Copy the artifacts `<prefix>.*` into a new version and return it.
+        The files are copied into a temporary directory that is renamed
+        into place, so a watcher never sees half a model.
+        """
+        files = glob.glob(glob.escape(prefix) + ".*")
+        if not files:
+            raise FileNotFoundError(f"no artifacts found for {prefix}")
+
+        version = self.latest(name) + 1
+        directory = os.path.join(self.root, name)
+        tmp = os.path.join(directory, f".{version}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for path in files:
+            suffix = os.path.basename(path)[len(os.path.basename(prefix)):]
+            shutil.copy2(path, os.path.join(tmp, name + suffix))
+        os.rename(tmp, os.path.join(directory, str(version)))
+        return version
+
+    def watch(self, names: list[str], interval: float,
+              callback: Callable[[str, int], bool]) -> threading.Thread:
+        """
+        Call `callback(name, version)` from a thread whenever a newer version
+        appears. A version the callback does not accept (returns False, e.g.
+        because another reload is still running) is offered again on the
+        next check.
+        """
+        def run():
+            seen = {name: self.latest(name) for name in names}
+            while True:
+                time.sleep(interval)
+                for name in names:
+                    latest = self.latest(name)
+                    if latest > seen[name] and callback(name, latest):
+                        seen[name] = latest
+
+        thread = threading.Thread(target=run, name="model-watch", daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Publiceer een getraind model als nieuwe versie in het register.")
+    parser.add_argument("name", help="naam van het model (ae, rf, ...)")
+    parser.add_argument("prefix", help="pad-prefix van de artifacts, bijv. output/ae")
+    parser.add_argument("--registry", default="dashboard/model/registry",
+                        help="map van het register")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.registry, os.path.dirname(args.registry))
+    version = registry.publish(args.name, args.prefix)
+    print(f"{args.prefix} -> {registry.path(args.name, version)} (version {version})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,24 @@
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 import json
-from typing import cast
+import os
+from operator import itemgetter
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, cast, overload
 
-import joblib
 import numpy as np
-import keras
-from sklearn.ensemble import RandomForestRegressor
+
+from .error import ModelUnavailableError
+
+VERSION_COLUMN = "model.version"
+LOAD_RETRY = 5.0  # seconden na een mislukte load, verdubbelt bij elke volgende
+LOAD_RETRY_MAX = 300.0  # seconden
+
+# keras/tensorflow en sklearn pas importeren als een model ze nodig heeft
+if TYPE_CHECKING:
+    import keras
+    from sklearn.ensemble import RandomForestRegressor
 
 
 class Predictor(ABC):
@@ -13,12 +26,163 @@ class Predictor(ABC):
     def predict(self, input: dict[str, float]) -> dict[str, float]:
         ...
 
+    def predict_batch(self, rows: list[dict[str, float]]) -> list[dict[str, float]]:
+        """Predict several rows at once; models override this to share per-call overhead."""
+        return [self.predict(row) for row in rows]
+
 
 class PassthroughPredictor(Predictor):
     def predict(self, input: dict[str, float]) -> dict[str, float]:
         return input
 
 
+class LazyPredictor(Predictor):
+    """
+    Predictor that is built by `factory(path)` on first use, so models (and
+    the libraries they import) that a rig does not use are never loaded.
+    `load` builds it up front, optionally with a warm-up prediction. After
+    a failed load, loads raise ModelUnavailableError until the retry delay
+    (LOAD_RETRY, doubling up to LOAD_RETRY_MAX) has passed or a `reload`
+    succeeds.
+
+    `reload` builds another version next to the running one and swaps it in
+    once it is ready; the replaced version is kept for `rollback`. Every
+    predicted row gets the version that made it in VERSION_COLUMN.
+    """
+
+    def __init__(self, name: str, factory: Callable[[str], Predictor], path: str, version: int = 0):
+        self.name = name
+        self.factory = factory
+        self.path = path
+        self.version = version
+        self.previous: tuple[Predictor, int] | None = None
+        self.load_time = 0.0
+        self.warmup_time = 0.0
+        # (predictor, versie) wordt in een keer vervangen
+        self._current: tuple[Predictor, int] | None = None
+        self._lock = threading.Lock()
+        self._failure: Exception | None = None
+        self._retry_at = 0.0
+        self._retry_delay = LOAD_RETRY
+
+    @property
+    def predictor(self) -> Predictor | None:
+        current = self._current
+        return current[0] if current is not None else None
+
+    def _build(self, path: str, version: int, warmup: bool) -> Predictor:
+        start = time.perf_counter()
+        predictor = self.factory(path)
+        self.load_time = time.perf_counter() - start
+        print(f"[predict] loaded {self.name} version {version} in {self.load_time:.2f}s")
+
+        if warmup and isinstance(predictor, ModelPredictor):
+            # eerste aanroep bouwt bij sommige backends nog van alles op
+            start = time.perf_counter()
+            predictor.predict_batch(np.zeros((1, len(predictor.feature_names)), "float32"))
+            self.warmup_time = time.perf_counter() - start
+        return predictor
+
+    def load(self, warmup: bool = False) -> tuple[Predictor, int]:
+        with self._lock:
+            if self._current is None:
+                if self._failure is not None and time.time() < self._retry_at:
+                    raise ModelUnavailableError(f"{self.name} did not load: {self._failure}")
+                try:
+                    self._current = (self._build(self.path, self.version, warmup), self.version)
+                except Exception as exc:
+                    self._failure = exc
+                    self._retry_at = time.time() + self._retry_delay
+                    self._retry_delay = min(self._retry_delay * 2, LOAD_RETRY_MAX)
+                    raise
+                self._failure = None
+                self._retry_delay = LOAD_RETRY
+            return self._current
+
+    def reload(self, path: str, version: int, warmup: bool = True):
+        """Build `version` from `path` and swap it in; the running one is kept for rollback."""
+        with self._lock:
+            predictor = self._build(path, version, warmup)
+            if self.previous is not None and self.previous[0] is not predictor:
+                close = getattr(self.previous[0], "close", None)
+                if close is not None:
+                    close()  # bijv. het proces van een ProcessPredictor
+            self.previous = self._current
+            self._current = (predictor, version)
+            self.path = path
+            self.version = version
+            self._failure = None
+            self._retry_delay = LOAD_RETRY
+
+    def rollback(self):
+        """Swap the previous version back in."""
+        with self._lock:
+            if self.previous is None:
+                raise ValueError(f"no previous version of {self.name}")
+            self.previous, self._current = self._current, self.previous
+            self.version = self._current[1]
+
+    def predict(self, input: dict[str, float]) -> dict[str, float]:
+        return self.predict_batch([input])[0]
+
+    def predict_batch(self, rows: list[dict[str, float]]) -> list[dict[str, float]]:
+        predictor, version = self._current or self.load()
+        return [{**row, VERSION_COLUMN: version} for row in predictor.predict_batch(rows)]
+
+    def stats(self) -> dict[str, Any]:
+        predictor = self.predictor
+        cache = predictor.cache if isinstance(predictor, ModelPredictor) else None
+        return dict(loaded=predictor is not None, version=self.version,
+                    previous=self.previous[1] if self.previous is not None else None,
+                    load_time=self.load_time, warmup_time=self.warmup_time,
+                    load_error=str(self._failure) if self._failure is not None else None,
+                    cache=cache.stats() if cache is not None else None)
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of model outputs, keyed on the input vector rounded to
+    a step per feature (0 keeps the exact value). Rows that only differ
+    within a step share one prediction.
+    """
+
+    def __init__(self, size: int, steps: np.ndarray):
+        self.size = size
+        self.steps = np.asarray(steps, dtype="float64")
+        self._exact = self.steps <= 0
+        self._divisor = np.where(self._exact, 1.0, self.steps)
+        self._entries: OrderedDict[bytes, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def keys(self, x: np.ndarray) -> list[bytes]:
+        q = np.where(self._exact, x, np.round(x / self._divisor)) + 0.0  # -0.0 wordt 0.0
+        return [row.tobytes() for row in q]
+
+    def get(self, key: bytes) -> np.ndarray | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: bytes, value: np.ndarray):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, float]:
+        total = self.hits + self.misses
+        return dict(entries=len(self._entries), size=self.size, hits=self.hits,
+                    misses=self.misses, hit_rate=self.hits / total if total else 0.0)
+
+
 class ModelPredictor(Predictor, ABC):
     """
     Basisclass voor alle "vector in → vector uit"-modellen.
@@ -46,6 +210,21 @@ class ModelPredictor(Predictor, ABC):
             self.mean = []
             self.std = []
 
+        # vooraf berekend: welke features het model voorspelt (de rest blijft staan)
+        self._features = itemgetter(*self.feature_names)
+        self._predicted = np.array([i for i, name in enumerate(self.feature_names)
+                                    if name not in skip_names], dtype=np.intp)
+        self._predicted_names = [self.feature_names[i] for i in self._predicted]
+        self.cache: PredictionCache | None = None
+
+    def enable_cache(self, size: int, step: float = 0.0, steps: dict[str, float] | None = None):
+        """
+        Remember up to `size` predictions, keyed on the input rounded to
+        `steps[feature]`, or `step` for features without their own step.
+        """
+        steps = steps or {}
+        self.cache = PredictionCache(size, np.array([steps.get(name, step) for name in self.feature_names]))
+
     @abstractmethod
     def _predict_row(self, x_batch: np.ndarray) -> np.ndarray:
         """
@@ -54,40 +233,70 @@ class ModelPredictor(Predictor, ABC):
         """
         ...
 
-    def predict(self, input: dict[str, float]) -> dict[str, float]:
-        x = np.array(
-            list(input[name] for name in self.feature_names),
-            'float32'
-        )
+    def _vector(self, rows: list[dict[str, float]]) -> np.ndarray:
+        return np.array([self._features(row) for row in rows], 'float32') \
+            .reshape(len(rows), len(self.feature_names))
 
-        # Normaliseren indien nodig
-        if self.normalized:
-            x_in = (x - self.mean) / self.std
-        else:
-            x_in = x
+    @overload
+    def predict_batch(self, rows: np.ndarray) -> np.ndarray: ...
+    @overload
+    def predict_batch(self, rows: list[dict[str, float]]) -> list[dict[str, float]]: ...
+
+    def predict_batch(self, rows):
+        """
+        Predict a (batch, n_features) array in `feature_names` order, or a
+        list of rows. Arrays come back as arrays with the skipped features
+        unchanged; rows come back as updated copies.
+        """
+        if not isinstance(rows, np.ndarray):
+            y = self.predict_batch(self._vector(rows))
+            values = y[:, self._predicted].tolist()
+            result = []
+            for row, predicted in zip(rows, values):
+                row = row.copy()
+                row.update(zip(self._predicted_names, predicted))
+                result.append(row)
+            return result
+
+        x = np.asarray(rows, 'float32')
+        result = x.copy()
+        if self.cache is None:
+            result[:, self._predicted] = self._infer(x)
+            return result
+
+        keys = self.cache.keys(x)
+        values = [self.cache.get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing:
+            for i, value in zip(missing, self._infer(x[missing])):
+                self.cache.put(keys[i], value)
+                values[i] = value
+        result[:, self._predicted] = np.array(values)
+        return result
 
-        x_in = x_in[None, :]  # batch-dim toevoegen
+    def _infer(self, x: np.ndarray) -> np.ndarray:
+        """The predicted features of a (batch, n_features) array."""
+        # Normaliseren indien nodig
+        x_in = (x - self.mean) / self.std if self.normalized else x
 
         # Modelvoorspelling
-        y_pred = self._predict_row(x_in)[0]
+        y_pred = np.asarray(self._predict_row(x_in))
 
         # De-normaliseren indien nodig
         if self.normalized:
             y_pred = y_pred * self.std + self.mean
 
-        # Dict terugbouwen
-        result = input.copy()
-        for i, name in enumerate(self.feature_names):
-            if name in self.skip_names:
-                continue
-            # clamp op >= 0 om negatieve flows/drukken te voorkomen
-            result[name] = max(float(y_pred[i]), 0.0)
+        # clamp op >= 0 om negatieve flows/drukken te voorkomen
+        return np.maximum(y_pred[:, self._predicted], 0.0)
 
-        return result
+    def predict(self, input: dict[str, float]) -> dict[str, float]:
+        return self.predict_batch([input])[0]
 
 
 class KerasPredictor(ModelPredictor):
     def __init__(self, path: str, skip_names: list[str]):
+        import keras
+
         super().__init__(path, skip_names, True)
         self.model = cast(
             keras.Model, keras.models.load_model(path + ".keras")
@@ -97,8 +306,47 @@ class KerasPredictor(ModelPredictor):
         return self.model.predict(input, verbose=cast(str, 0))
 
 
+class NumpyAutoencoderPredictor(ModelPredictor):
+    """
+    Forward pass of the Dense layers of the autoencoder with plain numpy,
+    from the weights exported to `<path>.npz` by model/export.py.
+    Dropout does nothing at inference and is left out.
+    """
+
+    ACTIVATIONS = {
+        "linear": None,
+        "relu": lambda x: np.maximum(x, 0, out=x),
+        "sigmoid": lambda x: 1 / (1 + np.exp(-x)),
+        "tanh": np.tanh,
+    }
+
+    def __init__(self, path: str, skip_names: list[str]):
+        super().__init__(path, skip_names, True)
+        with np.load(path + ".npz") as weights:
+            names = [str(name) for name in weights["activations"]]
+            self.layers = []
+            for i, name in enumerate(names):
+                if name not in self.ACTIVATIONS:
+                    raise ValueError(f"unsupported activation `{name}`")
+                self.layers.append((weights[f"kernel{i}"].astype("float32"),
+                                    weights[f"bias{i}"].astype("float32"),
+                                    self.ACTIVATIONS[name]))
+
+    def _predict_row(self, input: np.ndarray) -> np.ndarray:
+        x = input
+        for kernel, bias, activation in self.layers:
+            x = x @ kernel
+            x += bias
+            if activation is not None:
+                x = activation(x)
+        return x
+
+
 class RandomForestPredictor(ModelPredictor):
     def __init__(self, path: str, skip_names: list[str]):
+        import joblib
+        from sklearn.ensemble import RandomForestRegressor
+
         super().__init__(path, skip_names, False)
         self.model = cast(
             RandomForestRegressor,
@@ -107,3 +355,100 @@ class RandomForestPredictor(ModelPredictor):
 
     def _predict_row(self, input: np.ndarray) -> np.ndarray:
         return self.model.predict(input)
+
+
+class CompiledForestPredictor(ModelPredictor):
+    """
+    Random forest flattened by `compile_forest` into `<path>.npz`: one set
+    of node arrays for all trees, evaluated together. Every step moves all
+    trees one level down; leaves point to themselves, so trees of different
+    depths need no special care.
+    """
+
+    def __init__(self, path: str, skip_names: list[str]):
+        super().__init__(path, skip_names, False)
+        with np.load(path + ".npz") as forest:
+            self.roots = forest["roots"]
+            self.feature = forest["feature"]
+            self.threshold = forest["threshold"]
+            self.left = forest["left"]
+            self.right = forest["right"]
+            self.leaf = forest["leaf"]
+            self.value = forest["value"]
+            self.max_depth = int(forest["max_depth"])
+
+    def _predict_row(self, input: np.ndarray) -> np.ndarray:
+        rows = np.arange(len(input))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(input), len(self.roots)))
+        for depth in range(self.max_depth):
+            go_left = input[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+            # de meeste paden zijn veel korter dan de diepste boom
+            if depth % 8 == 7 and (self.leaf[nodes] >= 0).all():
+                break
+        # gemiddelde over de bomen, zoals RandomForestRegressor
+        return self.value[self.leaf[nodes]].mean(axis=1, dtype="float64")
+
+
+def compile_forest(model: "RandomForestRegressor", path: str, dtype: str = "float64"):
+    """
+    Flatten the trees of `model` into contiguous arrays in `<path>.npz` for
+    CompiledForestPredictor. Leaf values are stored once per leaf as
+    `dtype` (float64, float32 or float16).
+    """
+    features, thresholds, lefts, rights, leaves, values = [], [], [], [], [], []
+    roots = []
+    offset = 0
+    nleaves = 0
+    max_depth = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        count = tree.node_count
+        nodes = np.arange(count)
+        is_leaf = tree.children_left < 0
+
+        roots.append(offset)
+        features.append(np.where(is_leaf, 0, tree.feature))
+        thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+        lefts.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+        rights.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+        leaf = np.full(count, -1)
+        leaf[is_leaf] = np.arange(is_leaf.sum()) + nleaves
+        leaves.append(leaf)
+        values.append(tree.value[is_leaf, :, 0])
+
+        offset += count
+        nleaves += int(is_leaf.sum())
+        max_depth = max(max_depth, int(tree.max_depth))
+
+    np.savez(path + ".npz",
+             roots=np.array(roots, dtype="int32"),
+             feature=np.concatenate(features).astype("int32"),
+             threshold=np.concatenate(thresholds).astype("float64"),
+             left=np.concatenate(lefts).astype("int32"),
+             right=np.concatenate(rights).astype("int32"),
+             leaf=np.concatenate(leaves).astype("int32"),
+             value=np.concatenate(values).astype(dtype),
+             max_depth=np.array(max_depth))
+
+
+def load_autoencoder(path: str, skip_names: list[str]) -> ModelPredictor:
+    """The numpy autoencoder when `<path>.npz` exists, else the Keras model."""
+    # zonder geexporteerde gewichten (python -m dashboard.export_ae) via keras
+    if os.path.exists(path + ".npz"):
+        return NumpyAutoencoderPredictor(path, skip_names)
+    return KerasPredictor(path, skip_names)
+
+
+def load_random_forest(path: str, skip_names: list[str]) -> ModelPredictor:
+    """The compiled forest when `<path>.npz` exists, else the joblib model."""
+    # zonder gecompileerd forest (python -m dashboard.export_rf) via sklearn
+    if os.path.exists(path + ".npz"):
+        return CompiledForestPredictor(path, skip_names)
+    return RandomForestPredictor(path, skip_names)
+
+
+MODEL_LOADERS: dict[str, Callable[[str, list[str]], ModelPredictor]] = {
+    "ae": load_autoencoder,
+    "rf": load_random_forest,
+}
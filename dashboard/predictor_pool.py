@@ -0,0 +1,245 @@
+from collections import deque
+import multiprocessing
+import threading
+import time
+from traceback import print_exc
+from typing import Any, Callable
+
+from .error import ModelUnavailableError
+from .predictor import LazyPredictor, Predictor
+
+
+def _serve(conn, factory: Callable[[], Predictor]):
+    try:
+        predictor = factory()
+    except Exception as exc:
+        conn.send(exc)
+        return
+    conn.send(None)  # model geladen
+
+    while (rows := conn.recv()) is not None:
+        try:
+            conn.send(predictor.predict_batch(rows))
+        except Exception as exc:
+            conn.send(exc)
+
+
+class ProcessPredictor(Predictor):
+    """
+    Predictor that runs in a child process, for models that hold the GIL.
+    `factory` builds the real predictor in the child; `predict` sends the
+    row over a pipe and waits for the result.
+
+    The child is forked where possible, so `factory` may be a lambda. With
+    spawn (Windows) it has to be picklable, e.g. a functools.partial.
+    """
+
+    def __init__(self, factory: Callable[[], Predictor]):
+        self.factory = factory
+        self._conn: Any = None
+        self._process: Any = None
+
+    def start(self):
+        if self._process is not None:
+            return
+        method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        ctx = multiprocessing.get_context(method)
+        self._conn, child = ctx.Pipe()
+        self._process = ctx.Process(target=_serve, args=(child, self.factory), daemon=True)
+        self._process.start()
+        child.close()
+
+        error = self._conn.recv()
+        if error is not None:
+            self.close()
+            raise error
+
+    def predict(self, input: dict[str, float]) -> dict[str, float]:
+        return self.predict_batch([input])[0]
+
+    def predict_batch(self, rows: list[dict[str, float]]) -> list[dict[str, float]]:
+        if self._process is None:
+            self.start()
+        self._conn.send(rows)
+        result = self._conn.recv()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def close(self):
+        if self._process is None:
+            return
+        try:
+            self._conn.send(None)
+        except OSError:
+            pass  # kind is al weg
+        self._process.join(5)
+        self._conn.close()
+        self._process = None
+
+
+class PredictorWorker:
+    """
+    Runs one predictor on its own thread. Rows are queued by the sampling
+    loop together with their sample time; when the predictor falls behind,
+    the oldest rows are dropped. Rows that queued up while the predictor was
+    busy are predicted together with `predict_batch`, up to `batch_size`.
+    Results go to `store` in queue order, so ids in the predictor database
+    stay in sample order. Ids are per predictor though: a row one predictor
+    drops or fails on is not stored by it, so the same id can belong to
+    different samples in two predictor databases. The timestamp is the
+    sample time, the same for every predictor, and is what to match rows
+    on. `processed` counts the stored rows, `errors` the rows of failed
+    batches and `dropped` the rows pushed out of the queue.
+
+    With `warmup` a LazyPredictor is loaded and warmed up as soon as the
+    thread starts, instead of on the first row. `observe(stage, seconds)`
+    is given the time of every predict_batch. Every batch runs through
+    `profile(fn)` when it is given, e.g. ThreadProfiler.call.
+    """
+
+    def __init__(self, name: str, predictor: Predictor,
+                 store: Callable[[str, dict[str, float], float], None], maxsize: int,
+                 batch_size: int = 16, warmup: bool = False,
+                 observe: Callable[[str, float], None] | None = None,
+                 profile: Callable[[Callable[[], None]], None] | None = None):
+        self.name = name
+        self.predictor = predictor
+        self.store = store
+        self.batch_size = batch_size
+        self.warmup = warmup
+        self.observe = observe
+        self.profile = profile
+        self.stage = f"predict.{name}"
+        self.queue: deque[tuple[float, dict[str, float]]] = deque(maxlen=maxsize)
+
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.batches = 0
+        self.lag = 0.0  # seconden tussen sample en opslag, laatste rij
+        self.max_lag = 0.0
+        self.busy = 0.0
+
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if isinstance(self.predictor, ProcessPredictor):
+            self.predictor.start()
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name=f"predict-{self.name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, row: dict[str, float], timestamp: float, block: bool = False):
+        """
+        Queue a row. With `block` wait for room instead of dropping the
+        oldest row, for replays that run faster than the predictor.
+        """
+        with self._cond:
+            if block:
+                while len(self.queue) == self.queue.maxlen and not self._stop:
+                    self._cond.wait()
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append((timestamp, row))
+            self._cond.notify_all()
+
+    def _run(self):
+        if self.warmup and isinstance(self.predictor, LazyPredictor):
+            try:
+                self.predictor.load(warmup=True)
+            except Exception:
+                print(f"[predict] unable to load {self.name}")
+                print_exc()
+
+        while True:
+            with self._cond:
+                while not self.queue and not self._stop:
+                    self._cond.wait()
+                if not self.queue:
+                    return  # gestopt en leeg
+                batch = [self.queue.popleft()
+                         for _ in range(min(len(self.queue), self.batch_size))]
+                self._cond.notify_all()  # ruimte voor submit(block=True)
+
+            if self.profile is not None:
+                self.profile(lambda: self._handle(batch))
+            else:
+                self._handle(batch)
+
+    def _handle(self, batch: list[tuple[float, dict[str, float]]]):
+        start = time.perf_counter()
+        processed = self.processed
+        try:
+            results = self.predictor.predict_batch([row for _, row in batch])
+            if self.observe is not None:
+                self.observe(self.stage, time.perf_counter() - start)
+            for (timestamp, _), result in zip(batch, results):
+                self.store(self.name, result, timestamp)
+                self.processed += 1
+        except ModelUnavailableError:
+            # de mislukte load is al gemeld, pas na de wachttijd opnieuw
+            self.errors += len(batch)
+        except Exception:
+            self.errors += len(batch) - (self.processed - processed)
+            print(f"[predict] {self.name} failed")
+            print_exc()
+        self.busy += time.perf_counter() - start
+        self.batches += 1
+        self.lag = time.time() - batch[-1][0]
+        self.max_lag = max(self.max_lag, time.time() - batch[0][0])
+
+    def stop(self, timeout: float = 5.0):
+        """Handle the queued rows, then stop the thread."""
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        predictor = self.predictor
+        if isinstance(predictor, LazyPredictor):
+            predictor = predictor.predictor
+        if isinstance(predictor, ProcessPredictor):
+            predictor.close()
+
+    def stats(self) -> dict[str, float]:
+        handled = self.processed + self.errors
+        return dict(queue=len(self.queue), dropped=self.dropped, processed=self.processed,
+                    errors=self.errors, lag=self.lag, max_lag=self.max_lag,
+                    batch=handled / self.batches if self.batches else 0.0,
+                    predict_time=self.busy / handled if handled else 0.0)
+
+
+class PredictorPool:
+    """
+    One PredictorWorker per predictor, all fed the same rows. Their ids
+    differ once one of them dropped or failed on a row, see PredictorWorker.
+    """
+
+    def __init__(self, predictors: dict[str, Predictor],
+                 store: Callable[[str, dict[str, float], float], None], maxsize: int,
+                 batch_size: int = 16, warmup: bool = False,
+                 observe: Callable[[str, float], None] | None = None,
+                 profile: Callable[[Callable[[], None]], None] | None = None):
+        self.workers = {
+            name: PredictorWorker(name, predictor, store, maxsize, batch_size, warmup, observe, profile)
+            for name, predictor in predictors.items()
+        }
+
+    def start(self):
+        for worker in self.workers.values():
+            worker.start()
+
+    def submit(self, row: dict[str, float], timestamp: float, block: bool = False):
+        for worker in self.workers.values():
+            worker.submit(row, timestamp, block)
+
+    def stop(self, timeout: float = 5.0):
+        for worker in self.workers.values():
+            worker.stop(timeout)
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        return {name: worker.stats() for name, worker in self.workers.items()}
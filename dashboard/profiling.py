@@ -0,0 +1,178 @@
+from collections import Counter
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all other threads every `interval` seconds via
+    sys._current_frames. Cheap enough to run on the Pi while it is busy,
+    and it sees every thread, also the ones without hooks.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+
+    def run(self, seconds: float) -> Counter[str]:
+        """Sample for `seconds` in the calling thread; stacks as `thread;outer;...;inner`."""
+        stacks: Counter[str] = Counter()
+        me = threading.get_ident()
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                frames = []
+                f: Any = frame
+                while f is not None:
+                    code = f.f_code
+                    frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    f = f.f_back
+                frames.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(frames))] += 1
+            time.sleep(self.interval)
+        return stacks
+
+
+def collapsed(stacks: Counter[str]) -> str:
+    """The collapsed-stack format of flamegraph.pl and speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class ThreadProfiler:
+    """
+    Deterministic profiling with cProfile of the threads that pass through
+    `enter`/`exit` (or `call`) while it is active: the sampling loop, the
+    predictor threads and the Flask request threads. Inactive, the hooks
+    only check a flag.
+
+    Since Python 3.12 cProfile profiles all threads at once and only one
+    profiler can be enabled; other threads then simply skip theirs.
+    """
+
+    def __init__(self):
+        self.active = False
+        self._profiles: dict[int, cProfile.Profile] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def start(self):
+        with self._lock:
+            self._profiles.clear()
+            self.active = True
+
+    def stop(self) -> pstats.Stats | None:
+        """Stop and merge the profiles of all threads, None if nothing ran."""
+        with self._lock:
+            self.active = False
+            profiles = list(self._profiles.values())
+            self._profiles.clear()
+        stats = None
+        for profile in profiles:
+            profile.create_stats()
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        return stats
+
+    def enter(self):
+        if not self.active:
+            return
+        ident = threading.get_ident()
+        with self._lock:
+            profile = self._profiles.get(ident)
+            if profile is None:
+                profile = self._profiles[ident] = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return  # er draait al een profiler voor alle threads
+        self._local.profile = profile
+
+    def exit(self):
+        profile = getattr(self._local, "profile", None)
+        if profile is not None:
+            profile.disable()
+            self._local.profile = None
+
+    def call(self, fn: Callable[[], T]) -> T:
+        if not self.active:
+            return fn()
+        self.enter()
+        try:
+            return fn()
+        finally:
+            self.exit()
+
+
+def stats_text(stats: pstats.Stats, sort: str = "cumulative", limit: int = 50) -> str:
+    out = io.StringIO()
+    stats.stream = out  # type: ignore[attr-defined]
+    stats.sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+class MemoryTracker:
+    """
+    tracemalloc snapshots, each diffed against the previous one (or the
+    first), to find what keeps growing without restarting the service.
+    """
+
+    def __init__(self):
+        self.first: tracemalloc.Snapshot | None = None
+        self.last: tracemalloc.Snapshot | None = None
+        self.last_time = 0.0
+
+    @property
+    def active(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.first = self.last = self._snapshot()
+        self.last_time = time.time()
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+
+    def diff(self, top: int = 20, since: str = "last", key: str = "lineno") -> dict[str, Any]:
+        """The `top` allocation sites by growth since the last or first snapshot."""
+        if self.first is None or self.last is None or not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not started")
+        snapshot = self._snapshot()
+        base = self.last if since == "last" else self.first
+        now = time.time()
+        stats = snapshot.compare_to(base, key)
+
+        current, peak = tracemalloc.get_traced_memory()
+        result = dict(
+            seconds=now - self.last_time if since == "last" else None,
+            traced=current, peak=peak,
+            top=[dict(
+                site=" <- ".join(f"{os.path.relpath(f.filename)}:{f.lineno}" for f in stat.traceback),
+                size=stat.size, size_diff=stat.size_diff,
+                count=stat.count, count_diff=stat.count_diff,
+            ) for stat in stats[:top]],
+        )
+        self.last = snapshot
+        self.last_time = now
+        return result
+
+    def stop(self):
+        tracemalloc.stop()
+        self.first = self.last = None
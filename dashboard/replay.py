@@ -0,0 +1,183 @@
+from collections import deque
+import math
+import queue
+import threading
+import time
+from typing import Any
+
+from .database import Database
+
+
+class Replay:
+    """
+    Plays the rows of a database back at `speed` times the recorded pace
+    (0 plays as fast as the consumer takes them). Gaps in the recording are
+    shortened to `max_delay` seconds.
+
+    With `own_db` the database is closed together with the replay.
+
+    A background thread reads blocks of `block_rows` ahead into a bounded
+    queue, so the playing loop never waits on the disk. `seek` restarts the
+    reader at another timestamp; `pause` stops the clock.
+    """
+
+    def __init__(self, db: Database, since: float = 0.0, speed: float = 1.0,
+                 max_delay: float = 3.0, block_rows: int = 256, prefetch: int = 4,
+                 name: str | None = None, own_db: bool = False):
+        self.db = db
+        self.own_db = own_db
+        self.name = name or db.filename
+        self.columns = list(db.columns)
+        self.speed = speed
+        self.max_delay = max_delay
+        self.block_rows = block_rows
+        self.paused = False
+        self.timestamp = 0.0
+
+        self._ts_index = self.columns.index(db.timestamp_col) if self.columns else 0
+        self._prefetch = prefetch
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._queue: queue.Queue | None = None
+        self._block: list[list[float]] = []
+        self._pos = 0
+        self._begin = 0.0  # voortgang aan begin en eind van het huidige blok
+        self._end = 0.0
+        self._last_due: float | None = None
+        self._last_ts = 0.0
+        self._history: deque[tuple[float, float]] = deque(maxlen=64)  # (wandklok, opnametijd)
+        self._done = False
+        self._closed = False
+
+        self._start(since)
+
+    def _start(self, since: float):
+        with self._lock:
+            self._generation += 1
+            self._queue = queue.Queue(self._prefetch)
+            self._block = []
+            self._pos = 0
+            self._begin = self._end = 0.0
+            self._last_due = None
+            self._history.clear()
+            self._done = False
+            generation = self._generation
+            q = self._queue
+        threading.Thread(target=self._read, args=(since, generation, q),
+                         name="replay-reader", daemon=True).start()
+
+    def _read(self, since: float, generation: int, q: queue.Queue):
+        if not self.columns:
+            q.put(None)
+            return
+        with self.db.cursor_since(since) as cur:
+            while generation == self._generation:
+                total = cur.offset + cur.size
+                before = cur.offset
+                block = cur.read_array(self.block_rows)
+                if len(block) == 0:
+                    break
+                item = (block.tolist(), before / total, cur.offset / total)
+                while generation == self._generation:
+                    try:
+                        q.put(item, timeout=0.5)
+                        break
+                    except queue.Full:
+                        pass
+        if generation == self._generation:
+            q.put(None)
+
+    def next(self) -> tuple[dict[str, float], float] | None:
+        """
+        The next row and the wall-clock time at which it is due, or None
+        when the replay is finished.
+        """
+        while True:
+            with self._lock:
+                if self._pos < len(self._block):
+                    return self._take()
+                if self._done:
+                    return None
+                q, generation = self._queue, self._generation
+            assert q is not None
+            try:
+                item = q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._lock:
+                if generation != self._generation:
+                    continue  # intussen gezocht of gestopt
+                if item is None:
+                    self._done = True
+                    return None
+                self._block, self._begin, self._end = item
+                self._pos = 0
+
+    def _take(self) -> tuple[dict[str, float], float]:
+        values = self._block[self._pos]
+        self._pos += 1
+        ts = values[self._ts_index]
+
+        now = time.time()
+        if self._last_due is None:
+            due = now
+        else:
+            gap = (ts - self._last_ts) / self.speed if self.speed > 0 else 0.0
+            due = self._last_due + min(max(gap, 0.0), self.max_delay)
+        self._last_due = due
+        self._last_ts = ts
+        self.timestamp = ts
+        self._history.append((max(due, now), ts))
+        return dict(zip(self.columns, values)), due
+
+    def seek(self, timestamp: float):
+        self._start(timestamp)
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        with self._lock:
+            self.paused = False
+            # de klok loopt verder vanaf nu, niet vanaf voor de pauze
+            self._last_due = None
+            self._history.clear()
+
+    def set_speed(self, speed: float):
+        with self._lock:
+            self.speed = speed
+            self._last_due = None
+            self._history.clear()
+
+    @property
+    def progress(self) -> float:
+        if not self._block:
+            return self._begin
+        # lineair binnen het blok
+        return self._begin + (self._end - self._begin) * self._pos / len(self._block)
+
+    @property
+    def achieved_speed(self) -> float:
+        """Recorded seconds played per wall-clock second, over the last rows."""
+        history = self._history
+        if len(history) < 2:
+            return 0.0
+        (w0, t0), (w1, t1) = history[0], history[-1]
+        return (t1 - t0) / (w1 - w0) if w1 > w0 else float("inf")
+
+    def state(self) -> dict[str, Any]:
+        achieved = self.achieved_speed
+        return dict(timestamp=self.timestamp, progress=self.progress, file=self.name,
+                    speed=self.speed, paused=self.paused,
+                    achieved_speed=None if math.isinf(achieved) else round(achieved, 2))
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._generation += 1
+            self._block = []
+            self._done = True
+        if self.own_db:
+            self.db.close()
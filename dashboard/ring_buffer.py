@@ -0,0 +1,84 @@
+import threading
+
+
+class RingBuffer:
+    """
+    Bounded in-memory window of the most recent rows of a database.
+
+    Rows are kept positionally (as returned by `insert`) together with their
+    timestamp. `since` answers a query from memory when the window covers it,
+    and returns None otherwise so the caller can fall back to disk.
+    """
+
+    def __init__(self, capacity: int, timestamp_col: str = "timestamp"):
+        self.capacity = capacity
+        self.timestamp_col = timestamp_col
+        self.columns: list[str] = []
+        self.hits = 0
+        self.misses = 0
+
+        self._timestamps = [0.0] * capacity
+        self._rows: list[list[float] | None] = [None] * capacity
+        self._ts_index = 0
+        self._start = 0
+        self._count = 0
+        # rijen van voor de buffer bestaan op disk
+        self._complete = True
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def reset(self, columns: list[str], complete: bool):
+        """
+        Empty the buffer for rows with `columns`. `complete` tells whether
+        the database has no older rows than the ones that will be appended.
+        """
+        with self._lock:
+            self.columns = list(columns)
+            self._ts_index = self.columns.index(self.timestamp_col)
+            self._start = 0
+            self._count = 0
+            self._complete = complete
+
+    def append(self, values: list[float]):
+        with self._lock:
+            if self._count == self.capacity:
+                self._start = (self._start + 1) % self.capacity
+                self._count -= 1
+                self._complete = False
+            pos = (self._start + self._count) % self.capacity
+            self._timestamps[pos] = values[self._ts_index]
+            self._rows[pos] = values
+            self._count += 1
+
+    def _timestamp(self, i: int) -> float:
+        return self._timestamps[(self._start + i) % self.capacity]
+
+    def since(self, timestamp: float) -> list[list[float]] | None:
+        """
+        Rows from the last row with a timestamp <= `timestamp` onward, like
+        `cursor_since`, or None when that row may not be in memory.
+        """
+        with self._lock:
+            if self._count == 0 or \
+                    (self._timestamp(0) > timestamp and not self._complete):
+                self.misses += 1
+                return None
+
+            lo, hi = 0, self._count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._timestamp(mid) <= timestamp:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            first = max(lo - 1, 0)
+
+            self.hits += 1
+            return [self._rows[(self._start + i) % self.capacity]
+                    for i in range(first, self._count)]  # type: ignore[misc]
+
+    def stats(self) -> dict[str, float]:
+        return dict(hits=self.hits, misses=self.misses, rows=self._count,
+                    capacity=self.capacity)
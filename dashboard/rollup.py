@@ -0,0 +1,285 @@
+import math
+import os
+import threading
+import time
+from traceback import print_exc
+from typing import Any
+
+import numpy as np
+
+from .database import Database, open_database
+from .downsample import BucketAggregator
+from .segmented_database import SegmentedDatabase
+
+ROLLUP_WIDTHS = {"1s": 1.0, "1min": 60.0, "1h": 3600.0}
+READ_BLOCK_ROWS = 4096
+STATS = ["sum", "min", "max"]
+
+
+class Rollup:
+    """
+    Count, sum, min and max of every column of a source database per time
+    bucket of `width` seconds, kept in a database of its own.
+
+    A rollup row has `timestamp` (start of the bucket), `count` and a
+    `sum.<column>`, `min.<column>` and `max.<column>` for every source
+    column, ids and timestamps included. The open bucket is kept in memory
+    and written when the first row of a later bucket arrives. A rollup file
+    that is not segmented keeps its columns, so when the source columns
+    change (e.g. a new VERSION_COLUMN) it is started over.
+    """
+
+    def __init__(self, filename: str, width: float, timestamp_col: str = "timestamp", **options):
+        self.filename = filename
+        self.width = width
+        self.timestamp_col = timestamp_col
+        self.options = options
+        self.db = open_database(filename, **options)
+
+        self.columns: list[str] = []
+        self._keys: list[str] = []
+        self._ts_index = 0
+        self._bucket: int | None = None
+        self._count = 0
+        self._sum = self._min = self._max = np.empty(0)
+
+        self.end = -math.inf
+        self._find_end()
+
+    def _find_end(self):
+        if self.db.columns:
+            with self.db.cursor_index(self.db.next_index - 1) as cur:
+                last = cur.read_array(1, [self.db.timestamp_col])
+            if len(last):
+                self.end = last[0, 0] + self.width
+
+    def refresh(self):
+        """Pick up the buckets another process wrote (readonly)."""
+        self.db.refresh()
+        self._find_end()
+
+    def _set_columns(self, columns: list[str]):
+        if self._bucket is not None:
+            self._write()
+        self.columns = list(columns)
+        self._keys = [f"{stat}.{c}" for stat in STATS for c in columns]
+        self._ts_index = self.columns.index(self.timestamp_col)
+        self.check_columns(columns)
+
+    def check_columns(self, columns: list[str]):
+        """
+        Start the rollup file over when it holds buckets of other source
+        `columns`: its rows would otherwise miss the new ones.
+        """
+        db = self.db
+        if db.readonly or isinstance(db, SegmentedDatabase) or not db.columns:
+            return
+        keys = [f"{stat}.{c}" for stat in STATS for c in columns]
+        if db.columns == [db.index_col, db.timestamp_col, "count"] + keys:
+            return
+        print(f"[rollup] {self.filename} has other columns, rebuilding it")
+        db.close()
+        for path in [self.filename, self.filename + ".idx"]:
+            if os.path.exists(path):
+                os.remove(path)
+        self.db = open_database(self.filename, **self.options)
+        self.end = -math.inf
+
+    def add(self, columns: list[str], values: list[float]):
+        """Add one source row, as returned by `insert`."""
+        if columns != self.columns:
+            self._set_columns(columns)
+        row = np.array(values, dtype=float)
+        self._merge(math.floor(row[self._ts_index] / self.width), 1, row, row, row)
+
+    def add_block(self, columns: list[str], block: np.ndarray):
+        """Add time-sorted source rows as a 2-D array."""
+        if len(block) == 0:
+            return
+        if columns != self.columns:
+            self._set_columns(columns)
+
+        bucket = np.floor(block[:, self._ts_index] / self.width).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        counts = np.diff(np.r_[starts, len(block)])
+        sums = np.add.reduceat(block, starts, axis=0)
+        mins = np.minimum.reduceat(block, starts, axis=0)
+        maxs = np.maximum.reduceat(block, starts, axis=0)
+        for i, b in enumerate(bucket[starts].tolist()):
+            self._merge(b, int(counts[i]), sums[i], mins[i], maxs[i])
+
+    def _merge(self, bucket: int, count: int, sums: np.ndarray, mins: np.ndarray, maxs: np.ndarray):
+        if self._bucket is not None and bucket > self._bucket:
+            self._write()
+        if self._bucket is None:
+            self._bucket = bucket
+            self._count = count
+            self._sum, self._min, self._max = sums.copy(), mins.copy(), maxs.copy()
+            return
+        # zelfde bucket, of de klok liep terug
+        self._count += count
+        self._sum += sums
+        np.minimum(self._min, mins, out=self._min)
+        np.maximum(self._max, maxs, out=self._max)
+
+    def _write(self):
+        assert self._bucket is not None
+        row: dict[str, Any] = dict(count=self._count)
+        row.update(zip(self._keys, np.concatenate([self._sum, self._min, self._max]).tolist()))
+        start = self._bucket * self.width
+        self.db.insert(row, timestamp=start)
+        self.end = start + self.width
+        self._bucket = None
+
+    def feed(self, aggregator: BucketAggregator, since: float, columns: list[str]) -> float:
+        """
+        Add the committed buckets from the one holding `since` on to
+        `aggregator`, for the source `columns` in that order. Returns the
+        timestamp from which on the caller has to add raw rows: the end of
+        the last bucket read, as buckets still waiting for a commit are
+        not.
+        """
+        positions = self.db.schema.positions
+        keys = [f"{stat}.{c}" for stat in STATS for c in columns]
+        if since >= self.end or any(key not in positions for key in keys):
+            return since
+
+        start = math.floor(since / self.width) * self.width
+        read = [self.db.timestamp_col, "count"] + keys
+        n = len(columns)
+        end = since
+        with self.db.cursor_since(start) as cur:
+            while len(block := cur.read_array(READ_BLOCK_ROWS, read)):
+                block = block[block[:, 0] >= start]
+                if not len(block):
+                    continue
+                aggregator.add_partial(block[:, 0], block[:, 1],
+                                       block[:, 2:2 + n], block[:, 2 + n:2 + 2 * n], block[:, 2 + 2 * n:])
+                end = block[-1, 0] + self.width
+        return end
+
+    def flush(self):
+        self.db.flush()
+
+    def close(self):
+        # de open bucket wordt bij het openen weer uit de brondata opgebouwd
+        self.db.close()
+
+
+class RollupSet:
+    """
+    Rollups of one source database at several bucket widths, stored next to
+    it (`predict-ae.csv` -> `predict-ae.1min.csv`, ...).
+
+    On opening, every rollup is brought up to date from the source rows
+    after its last written bucket, so a crash, a restart or a deleted rollup
+    file is repaired from the raw data. Not with `readonly`: then another
+    process writes the rollups.
+
+    The repair runs on a thread of its own, as a deleted rollup file means
+    reading the whole history. Rows added meanwhile wait until it is done,
+    and `pick` returns None until then, so queries use the raw rows.
+    """
+
+    def __init__(self, source: Database, filename: str,
+                 widths: dict[str, float] = ROLLUP_WIDTHS, **options):
+        self.source = source
+        self.filename = filename
+        base, ext = os.path.splitext(filename)
+        self.rollups = [
+            Rollup(f"{base}.{label}{ext}", width, source.timestamp_col, **options)
+            for label, width in sorted(widths.items(), key=lambda item: item[1])
+        ]
+        self.ready = True  # alle rollups bijgewerkt
+        self.recovering = False  # add zet rijen in de wachtrij
+        self._queued: list[tuple[list[str], list[float]]] = []
+        self._lock = threading.Lock()
+        if not options.get("readonly"):
+            self.ready = False
+            self.recovering = True
+            # alleen de rijen die er nu al zijn, latere komen via add
+            threading.Thread(target=self._recover, args=(source, source.next_index),
+                             name=f"rollup-{os.path.basename(base)}", daemon=True).start()
+
+    def _recover(self, source: Database, stop: int):
+        start = time.perf_counter()
+        recovered = False
+        try:
+            self.recover(source, stop)
+            recovered = True
+            print(f"[rollup] {self.filename} recovered in {time.perf_counter() - start:.2f}s")
+        except Exception:
+            # zonder volledige rollups blijven de queries de ruwe rijen lezen
+            print(f"[rollup] unable to recover {self.filename}")
+            print_exc()
+        finally:
+            with self._lock:
+                for columns, values in self._queued:
+                    self._add(columns, values)
+                self._queued.clear()
+                self.recovering = False
+                self.ready = recovered
+
+    def recover(self, source: Database, stop: int):
+        """Add the rows of `source` with an id below `stop` that are not in the rollups yet."""
+        columns = source.columns
+        if not columns or not self.rollups:
+            return
+        for rollup in self.rollups:
+            rollup.check_columns(columns)
+        ts_col = columns.index(source.timestamp_col)
+        id_col = columns.index(source.index_col)
+        ends = [rollup.end for rollup in self.rollups]
+        start = min(ends)
+
+        cursor = source.cursor_begin() if start == -math.inf else source.cursor_since(start)
+        with cursor as cur:
+            while len(block := cur.read_array(READ_BLOCK_ROWS)):
+                done = block[-1, id_col] >= stop
+                if done:
+                    block = block[block[:, id_col] < stop]
+                for rollup, end in zip(self.rollups, ends):
+                    rollup.add_block(columns, block[block[:, ts_col] >= end])
+                if done:
+                    break
+
+    def add(self, values: list[float]):
+        """Add a row just inserted into the source database."""
+        columns = self.source.columns
+        if self.recovering:
+            with self._lock:
+                if self.recovering:
+                    self._queued.append((columns, values))
+                    return
+        self._add(columns, values)
+
+    def _add(self, columns: list[str], values: list[float]):
+        for rollup in self.rollups:
+            rollup.add(columns, values)
+
+    def pick(self, width: float) -> Rollup | None:
+        """
+        The coarsest rollup whose buckets fit a whole number of times in
+        `width`, so none of them straddles two buckets of `width`. None
+        while the rollups are still being recovered.
+        """
+        if not self.ready:
+            return None
+        best = None
+        for rollup in self.rollups:
+            ratio = width / rollup.width
+            if ratio >= 1 and abs(ratio - round(ratio)) < 1e-9:
+                best = rollup
+        return best
+
+    def refresh(self):
+        for rollup in self.rollups:
+            rollup.refresh()
+
+    def flush(self):
+        for rollup in self.rollups:
+            rollup.flush()
+
+    def close(self):
+        for rollup in self.rollups:
+            rollup.close()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+import argparse
+from collections import deque
+import json
+import multiprocessing
+import os
+import sys
+import time
+from typing import Any
+
+import numpy as np
+
+from .database import Database, open_database
+from .model_registry import ModelRegistry
+from .predictor import MODEL_LOADERS, ModelPredictor
+
+CHUNK_ROWS = 8192
+READ_AHEAD = 2  # chunks per werkproces die gelezen zijn maar nog niet gescoord
+
+# per werkproces, gevuld door _init
+_predictors: dict[str, ModelPredictor] = {}
+
+
+def _init(models: dict[str, str]):
+    for name, path in models.items():
+        _predictors[name] = MODEL_LOADERS[name.split(":")[0]](path, ["timestamp"])
+
+
+def _masked_fill(predictor: ModelPredictor, feature: int) -> float:
+    # Dropout zet genormaliseerde inputs op 0, dus ruw op het gemiddelde
+    return float(predictor.mean[feature]) if predictor.normalized else 0.0
+
+
+def _score(chunk: np.ndarray, columns: list[str], masks: list[str]) -> dict[str, dict[str, Any]]:
+    """
+    Predict one chunk with every model. Per model: the predicted rows (in
+    `columns` order) and the sums for the error metrics.
+    """
+    result = {}
+    for name, predictor in _predictors.items():
+        positions = [columns.index(f) for f in predictor.feature_names]
+        x = chunk[:, positions].astype("float32")
+        y = predictor.predict_batch(x)
+
+        out = chunk.copy()
+        out[:, positions] = y
+        error = (y - x).astype("float64")
+
+        masked = {}
+        for feature in masks:
+            i = predictor.feature_names.index(feature)
+            xm = x.copy()
+            xm[:, i] = _masked_fill(predictor, i)
+            e = predictor.predict_batch(xm)[:, i].astype("float64") - x[:, i]
+            masked[feature] = (float(np.abs(e).sum()), float((e * e).sum()))
+
+        result[name] = dict(rows=out, abs=np.abs(error).sum(axis=0), sq=(error * error).sum(axis=0),
+                            masked=masked)
+    return result
+
+
+class Metrics:
+    """Running MAE/RMSE per feature, and per masked feature."""
+
+    def __init__(self, features: list[str], masks: list[str]):
+        self.features = features
+        self.count = 0
+        self.abs = np.zeros(len(features))
+        self.sq = np.zeros(len(features))
+        self.masked = {feature: [0.0, 0.0] for feature in masks}
+
+    def add(self, count: int, part: dict[str, Any]):
+        self.count += count
+        self.abs += part["abs"]
+        self.sq += part["sq"]
+        for feature, (a, s) in part["masked"].items():
+            self.masked[feature][0] += a
+            self.masked[feature][1] += s
+
+    def result(self) -> dict[str, Any]:
+        n = max(self.count, 1)
+        return dict(
+            rows=self.count,
+            features={f: dict(mae=self.abs[i] / n, rmse=np.sqrt(self.sq[i] / n))
+                      for i, f in enumerate(self.features)},
+            masked={f: dict(mae=a / n, rmse=np.sqrt(s / n)) for f, (a, s) in self.masked.items()},
+        )
+
+
+def _chunks(db: Database, chunk_rows: int):
+    with db.cursor_begin() as cur:
+        while len(chunk := cur.read_array(chunk_rows)):
+            yield chunk
+
+
+def _bounded_imap(pool: Any, tasks, window: int):
+    """Like `pool.imap(_work, tasks)`, but with at most `window` tasks submitted ahead."""
+    pending: deque = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(_work, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def score(source: str, models: dict[str, str], output_dir: str, masks: list[str],
+          workers: int, chunk_rows: int) -> dict[str, Any]:
+    # alleen lezen: de bron kan nog geschreven worden
+    db = open_database(source, readonly=True)
+    columns = db.columns
+    if not columns:
+        raise ValueError(f"{source} is empty")
+
+    features: dict[str, list[str]] = {}
+    for name, path in models.items():
+        with open(path + ".json") as metaf:
+            features[name] = list(json.load(metaf)["feature_names"])
+        missing = [f for f in features[name] + masks if f not in columns]
+        if missing:
+            raise KeyError(f"{source} has no column(s) {', '.join(missing)} for {name}")
+        unknown = [f for f in masks if f not in features[name]]
+        if unknown:
+            raise KeyError(f"{name} does not use {', '.join(unknown)}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(source))[0]
+    outputs = {}
+    for name in models:
+        path = os.path.join(output_dir, f"{stem}.predict-{name.replace(':', '-')}.csv")
+        outputs[name] = open(path, "w", newline="")
+        outputs[name].write(",".join(columns) + "\n")
+    metrics = {name: Metrics(features[name], masks) for name in models}
+
+    start = time.perf_counter()
+    rows = 0
+    tasks = ((chunk, columns, masks) for chunk in _chunks(db, chunk_rows))
+    if workers > 1:
+        pool = multiprocessing.get_context("spawn").Pool(workers, _init, (models,))
+        # imap leest alle chunks vooruit in, ongeacht hoe snel de workers zijn
+        results = _bounded_imap(pool, tasks, workers * READ_AHEAD)
+    else:
+        pool = None
+        _init(models)
+        results = map(_work, tasks)
+
+    try:
+        for parts in results:
+            for name, part in parts.items():
+                out = part["rows"]
+                outputs[name].write("".join(",".join(map(str, row)) + "\n" for row in out.tolist()))
+                metrics[name].add(len(out), part)
+            rows += len(out)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        for f in outputs.values():
+            f.close()
+
+    elapsed = time.perf_counter() - start
+    report = dict(source=source, rows=rows, seconds=elapsed,
+                  rows_per_second=rows / elapsed if elapsed > 0 else 0.0,
+                  models={name: m.result() for name, m in metrics.items()})
+    with open(os.path.join(output_dir, f"{stem}.metrics.json"), "w") as f:
+        json.dump(report, f, indent=4)
+    return report
+
+
+def _work(task: tuple[np.ndarray, list[str], list[str]]) -> dict[str, dict[str, Any]]:
+    return _score(*task)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Scoor opgenomen databases offline met een of meer modellen.")
+    parser.add_argument("databases", nargs="+",
+                        help="collect-*.csv, replay- of predict-databases (.csv of .bin)")
+    parser.add_argument("--model", action="append", required=True,
+                        help="model als naam of naam:versie, bijv. ae of rf:3 (herhaalbaar)")
+    parser.add_argument("--output", default="scored",
+                        help="map voor de voorspellingen en metrics")
+    parser.add_argument("--mask", action="append", default=[],
+                        help="feature die per rij gemaskeerd wordt om de reconstructie te meten (herhaalbaar)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="aantal processen (standaard: alle cores)")
+    parser.add_argument("--chunk", type=int, default=CHUNK_ROWS,
+                        help="rijen per chunk")
+    parser.add_argument("--registry", default="dashboard/model/registry",
+                        help="map van het modelregister")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.registry, os.path.dirname(args.registry))
+    models = {}
+    for spec in args.model:
+        name, _, version = spec.partition(":")
+        if name not in MODEL_LOADERS:
+            parser.error(f"unknown model `{name}`")
+        models[spec] = registry.path(name, int(version) if version else registry.latest(name))
+
+    for source in args.databases:
+        try:
+            report = score(source, models, args.output, args.mask, args.workers, args.chunk)
+        except (KeyError, ValueError) as exc:
+            print(f"[error] {exc}")
+            sys.exit(1)
+
+        print(f"{source}: {report['rows']} rows in {report['seconds']:.1f}s "
+              f"({report['rows_per_second']:.0f} rows/s)")
+        for name, result in report["models"].items():
+            maes = [m["mae"] for m in result["features"].values()]
+            print(f"  {name}: mean MAE {np.mean(maes):.4f}")
+            for feature, m in result["masked"].items():
+                print(f"    masked {feature}: MAE {m['mae']:.4f}, RMSE {m['rmse']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
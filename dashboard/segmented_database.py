@@ -0,0 +1,422 @@
+import bisect
+import io
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Any, Iterator
+
+import numpy as np
+
+from .binary_database import BinaryDatabase
+from .csv_database import CSVDatabase, Schema, flatten_dict
+
+ROLL_FORMATS = {
+    "hour": "%Y%m%d%H",
+    "day": "%Y%m%d",
+}
+MANIFEST = "manifest.json"
+
+
+class ChainCursor:
+    """
+    Cursor that reads a list of segment cursors one after another.
+    """
+
+    def __init__(self, db: "SegmentedDatabase", cursors: list):
+        self.db = db
+        self.cursors = cursors
+        self.offset = 0
+        self._closed = False
+
+    def __enter__(self) -> "ChainCursor":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if not self._closed:
+            for cur in self.cursors:
+                cur.close()
+            self._closed = True
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def size(self) -> int:
+        return sum(cur.size for cur in self.cursors)
+
+    def _current(self):
+        while self.cursors and self.cursors[0].size <= 0:
+            self.cursors.pop(0).close()
+        return self.cursors[0] if self.cursors else None
+
+    def read(self) -> dict[str, Any] | None:
+        while (cur := self._current()) is not None:
+            before = cur.offset
+            row = cur.read()
+            self.offset += cur.offset - before
+            if row is not None:
+                return row
+            self.cursors.pop(0).close()
+        return None
+
+    def read_array(self, max_rows: int | None = None, columns: list[str] | None = None) -> np.ndarray:
+        """
+        Like `Cursor.read_array`, across segments. Columns default to those of
+        the database; columns a segment does not have are filled with 0.
+        """
+        if columns is None:
+            columns = self.db.columns
+        blocks = []
+        count = 0
+        while (max_rows is None or count < max_rows) and (cur := self._current()) is not None:
+            positions = cur.db.schema.positions
+            have = [c for c in columns if c in positions]
+            before = cur.offset
+            data = cur.read_array(None if max_rows is None else max_rows - count, have)
+            self.offset += cur.offset - before
+            if len(data) == 0:
+                self.cursors.pop(0).close()
+                continue
+            if len(have) != len(columns):
+                full = np.zeros((len(data), len(columns)))
+                full[:, [columns.index(c) for c in have]] = data
+                data = full
+            blocks.append(data)
+            count += len(data)
+
+        if not blocks:
+            return np.empty((0, len(columns)))
+        return np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+
+    def read_columns(self, max_rows: int | None = None, columns: list[str] | None = None) -> dict[str, np.ndarray]:
+        """Like `read_array`, but returns one array per column."""
+        if columns is None:
+            columns = self.db.columns
+        data = self.read_array(max_rows, columns)
+        return {name: data[:, i] for i, name in enumerate(columns)}
+
+    def read_many(self, count=-1) -> Iterator[dict[str, Any]]:
+        """Up to `count` rows, or all remaining rows when `count` is negative."""
+        done = 0
+        while count < 0 or done < count:
+            row = self.read()
+            if row is None:
+                break
+            done += 1
+            yield row
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        while True:
+            row = self.read()
+            if row is None:
+                break
+            yield row
+
+
+class SegmentedDatabase:
+    """
+    Database split into segment files in a directory named after `filename`
+    (`predict-ae.csv` -> `predict-ae/`), described by `manifest.json`.
+
+    A new segment is started every hour or day (`roll`) and/or when the active
+    segment reaches `max_bytes`, or when a row has columns the active segment
+    does not have. Ids continue across segments. Segments whose
+    last row is older than `retention` seconds are deleted, or moved to
+    `archive_dir` when it is set. Each segment is a normal database opened
+    with the backend that matches the extension of `filename`. An existing
+    single database at `filename` is copied in as the first segment and left
+    in place.
+
+    With `readonly` (passed on to the active segment) nothing is moved,
+    deleted or written, and `refresh` rereads the manifest another process
+    keeps. Closed segments are always opened readonly.
+    """
+
+    def __init__(self, filename: str, *, roll: str | None = "day", max_bytes: int | None = None,
+                 retention: float | None = None, archive_dir: str | None = None, **options):
+        if roll is not None and roll not in ROLL_FORMATS:
+            raise ValueError(f"unknown segment roll `{roll}`")
+
+        self.filename = filename
+        self.directory, self.extension = os.path.splitext(filename)
+        self.roll = roll
+        self.max_bytes = max_bytes
+        self.retention = retention
+        self.archive_dir = archive_dir
+        self.readonly = options.get("readonly", False)
+        self.options = options
+        self.index_col = options.get("index_col", "id")
+        self.timestamp_col = options.get("timestamp_col", "timestamp")
+
+        # per segment: file, roll-key, first/last timestamp en id
+        self.segments: list[dict[str, Any]] = []
+        self.active: CSVDatabase | BinaryDatabase | None = None
+        # gesloten segmenten die een query al heeft geopend, per bestand
+        self._closed: dict[str, CSVDatabase | BinaryDatabase] = {}
+        self._lock = threading.Lock()
+
+        if not self.readonly:
+            os.makedirs(self.directory, exist_ok=True)
+        self._load_manifest()
+        self.apply_retention()
+
+    def __enter__(self) -> "SegmentedDatabase":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def columns(self) -> list[str]:
+        return self.active.columns if self.active is not None else []
+
+    @property
+    def schema(self) -> Schema:
+        return self.active.schema if self.active is not None else Schema([])
+
+    @property
+    def next_index(self) -> int:
+        return self.active.next_index if self.active is not None else 0
+
+    def _open(self, name: str, readonly: bool | None = None) -> CSVDatabase | BinaryDatabase:
+        path = os.path.join(self.directory, name)
+        options = dict(self.options)
+        if readonly is not None:
+            options["readonly"] = readonly
+        if self.extension == ".bin":
+            options.pop("index_every", None)
+            return BinaryDatabase(path, **options)
+        return CSVDatabase(path, **options)
+
+    def _load_manifest(self, reuse: CSVDatabase | BinaryDatabase | None = None):
+        path = os.path.join(self.directory, MANIFEST)
+        try:
+            with open(path) as f:
+                self.segments = json.load(f)["segments"]
+        except FileNotFoundError:
+            self.segments = []
+            if os.path.isfile(self.filename) and not self.readonly:
+                self._adopt_legacy()
+
+        if self.segments:
+            path = os.path.join(self.directory, self.segments[-1]["file"])
+            if reuse is not None and reuse.filename == path:
+                reuse.refresh()
+                self.active = reuse
+            else:
+                self.active = self._open(self.segments[-1]["file"])
+            # het manifest loopt achter op het actieve segment
+            last = None
+            if self.active.columns:
+                last = next(iter(self.active.cursor_index(self.active.next_index - 1)), None)
+            if last is not None:
+                self.segments[-1]["last_ts"] = last[self.timestamp_col]
+                self.segments[-1]["last_id"] = last[self.index_col]
+
+    def _adopt_legacy(self):
+        # bestaande enkele database wordt het eerste segment; het origineel
+        # blijft staan, het manifest voorkomt dat het nog eens wordt overgenomen
+        name = "legacy" + self.extension
+        print(f"[segments] copying {self.filename} into {self.directory} as the first segment, "
+              f"the original is left in place")
+        shutil.copy2(self.filename, os.path.join(self.directory, name))
+        if os.path.exists(self.filename + ".idx"):
+            shutil.copy2(self.filename + ".idx",
+                         os.path.join(self.directory, name + ".idx"))
+
+        db = self._open(name)
+        first = next(iter(db.cursor_begin()), None)
+        last = next(iter(db.cursor_index(db.next_index - 1)), None)
+        db.close()
+        self.segments.append(dict(
+            file=name, key=None,
+            first_ts=first[self.timestamp_col] if first else None,
+            last_ts=last[self.timestamp_col] if last else None,
+            first_id=first[self.index_col] if first else None,
+            last_id=last[self.index_col] if last else None,
+        ))
+        self._save_manifest()
+
+    def refresh(self):
+        """Pick up new rows and segments of the writing process (readonly)."""
+        with self._lock:
+            active = self.active
+            self.active = None
+            self._load_manifest(reuse=active)
+            if active is not None and self.active is not active:
+                active.close()
+            # door de schrijver verwijderde segmenten
+            files = {segment["file"] for segment in self.segments}
+            for name in [name for name in self._closed if name not in files]:
+                self._closed.pop(name).close()
+
+    def _save_manifest(self):
+        if self.readonly:
+            return
+        path = os.path.join(self.directory, MANIFEST)
+        with open(path + ".tmp", "w") as f:
+            json.dump(dict(segments=self.segments), f, indent=4)
+        os.replace(path + ".tmp", path)
+
+    def _roll_key(self, curtime: float) -> str | None:
+        if self.roll is None:
+            return None
+        return time.strftime(ROLL_FORMATS[self.roll], time.localtime(curtime))
+
+    def _needs_roll(self, curtime: float) -> bool:
+        if self.active is None:
+            return True
+        segment = self.segments[-1]
+        if self.roll is not None and segment["key"] != self._roll_key(curtime):
+            return True
+        if self.max_bytes is not None and os.path.exists(self.active.filename) and \
+                os.path.getsize(self.active.filename) >= self.max_bytes:
+            return True
+        return False
+
+    def _start_segment(self, curtime: float):
+        next_index = 0
+        if self.active is not None:
+            next_index = self.active.next_index
+            self.active.close()
+
+        key = self._roll_key(curtime)
+        name = f"{key or 'segment'}-{next_index}{self.extension}"
+        db = self._open(name)
+        db.next_index = max(db.next_index, next_index)
+
+        self.segments.append(dict(file=name, key=key, first_ts=None, last_ts=None,
+                                  first_id=None, last_id=None))
+        self.active = db
+        self._save_manifest()
+        self.apply_retention()
+
+    def insert(self, sensor_values: dict[str, Any], timestamp: float | None = None) -> list[float]:
+        """Append a row to the active segment, starting a new one if needed."""
+        if self.readonly:
+            raise io.UnsupportedOperation(f"{self.filename} is opened read-only")
+        if any(type(v) is dict for v in sensor_values.values()):
+            sensor_values = flatten_dict(sensor_values)
+        with self._lock:
+            curtime = time.time() if timestamp is None else timestamp
+            if self._needs_roll(curtime) or \
+                    (self.active.columns and self.active.schema.unknown(sensor_values)):
+                self._start_segment(curtime)
+            assert self.active is not None
+
+            values = self.active.insert(sensor_values, timestamp)
+            positions = self.active.schema.positions
+            timestamp = values[positions[self.timestamp_col]]
+            index = values[positions[self.index_col]]
+
+            segment = self.segments[-1]
+            if segment["first_ts"] is None:
+                segment["first_ts"] = timestamp
+                segment["first_id"] = index
+                self._save_manifest()
+            segment["last_ts"] = timestamp
+            segment["last_id"] = index
+        return values
+
+    def _snapshot(self) -> list[tuple[dict[str, Any], CSVDatabase | BinaryDatabase]]:
+        with self._lock:
+            result = []
+            for segment in self.segments:
+                if segment is self.segments[-1] and self.active is not None:
+                    result.append((segment, self.active))
+                elif segment["first_ts"] is not None:
+                    result.append((segment, None))
+            return result
+
+    def _closed_segment(self, name: str) -> CSVDatabase | BinaryDatabase:
+        with self._lock:
+            db = self._closed.get(name)
+            if db is None:
+                # een gesloten segment wordt niet meer geschreven
+                db = self._closed[name] = self._open(name, readonly=True)
+            return db
+
+    def _chain(self, key: str, target: float, method: str) -> ChainCursor:
+        segments = self._snapshot()
+        starts = [seg[key] if seg[key] is not None else float("inf")
+                  for seg, _ in segments]
+        # laatste segment dat op of voor target begint
+        first = max(bisect.bisect_right(starts, target) - 1, 0)
+
+        cursors = []
+        for i, (segment, db) in enumerate(segments[first:]):
+            if db is None:
+                db = self._closed_segment(segment["file"])
+            cursors.append(getattr(db, method)(target) if i == 0 else db.cursor_begin())
+        return ChainCursor(self, cursors)
+
+    def cursor_begin(self) -> ChainCursor:
+        return self._chain("first_ts", float("-inf"), "cursor_since")
+
+    def cursor_since(self, timestamp: float) -> ChainCursor:
+        return self._chain("first_ts", timestamp, "cursor_since")
+
+    def cursor_index(self, index: float) -> ChainCursor:
+        return self._chain("first_id", index, "cursor_index")
+
+    def apply_retention(self):
+        """Delete or archive closed segments that are older than `retention`."""
+        if self.retention is None or self.readonly:
+            return
+        limit = time.time() - self.retention
+
+        keep = []
+        for segment in self.segments[:-1]:
+            last_ts = segment["last_ts"]
+            if last_ts is not None and last_ts >= limit:
+                keep.append(segment)
+                continue
+            try:
+                self._drop(segment["file"])
+            except OSError as exc:
+                print(f"[segments] unable to remove {segment['file']}: {exc}")
+                keep.append(segment)
+        if len(keep) != len(self.segments) - 1:
+            self.segments[:-1] = keep
+            self._save_manifest()
+
+    def _drop(self, name: str):
+        db = self._closed.pop(name, None)
+        if db is not None:
+            db.close()
+        for path in [name, name + ".idx"]:
+            src = os.path.join(self.directory, path)
+            if not os.path.exists(src):
+                continue
+            if self.archive_dir is not None:
+                os.makedirs(self.archive_dir, exist_ok=True)
+                shutil.move(src, os.path.join(self.archive_dir, path))
+            else:
+                os.remove(src)
+        print(f"[segments] {'archived' if self.archive_dir else 'removed'} {name}")
+
+    def commit_due(self):
+        with self._lock:
+            if self.active is not None:
+                self.active.commit_due()
+
+    def flush(self):
+        with self._lock:
+            if self.active is not None:
+                self.active.flush()
+            self._save_manifest()
+
+    def close(self):
+        with self._lock:
+            if self.active is not None:
+                self.active.close()
+            for db in self._closed.values():
+                db.close()
+            self._closed.clear()
+            self._save_manifest()
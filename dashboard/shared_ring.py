@@ -0,0 +1,341 @@
+import json
+from multiprocessing import shared_memory
+import struct
+import time
+from typing import Any
+import zlib
+
+import numpy as np
+
+MAGIC = 0x56574452494E4732  # "VWDRING2"
+MAX_ENTRIES = 32
+# naam, offset, grootte, twee parameters (bij een ring: capaciteit en kolommen)
+ENTRY = struct.Struct("<48sQQQQ")
+DIRECTORY_SIZE = 64 + MAX_ENTRIES * ENTRY.size
+ALIGN = 64
+NAMES_SIZE = 4096  # bytes voor de kolomnamen van een ring, als JSON
+
+# posities in de header van een ring
+HEAD = 0  # aantal rijen ooit geschreven, de sequence counter
+START = 1  # eerste rij na de laatste reset
+COMPLETE = 2  # 1 als de database geen rijen van voor START heeft
+NCOLS = 3  # 0 als de kolommen niet passen
+VERSION = 4  # telt op bij elke reset
+NAMES_LEN = 5
+NAMES_CRC = 6
+RING_HEADER = 8 * 8
+# na de kolommen van een slot: volgnummer van de rij en checksum
+SLOT_EXTRA = 2
+SEQ_WEIGHT = np.uint64(0x9E3779B97F4A7C15)  # weegt het volgnummer in de checksum
+
+# seqlock-header van een blob: volgnummer (oneven tijdens schrijven), lengte, crc32
+BLOB_HEADER = 3 * 8
+
+
+def _weights(n: int) -> np.ndarray:
+    # vast zaad: schrijver en lezers rekenen met dezelfde gewichten; oneven
+    # zodat elk woord meetelt
+    rng = np.random.default_rng(0x56574452)
+    return rng.integers(0, 2**63, n, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+
+def _checksums(words: np.ndarray, seqs: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Checksum per row of `words` (uint64, rows x columns) and its sequence number."""
+    # uint64 loopt stil over, dat is hier de bedoeling
+    return (words * weights[:words.shape[1]]).sum(axis=1, dtype=np.uint64) + seqs * SEQ_WEIGHT
+
+
+class SharedRing:
+    """
+    RingBuffer in shared memory, written by one process and read by others
+    without locks.
+
+    The writer stores a row in its slot and only then advances the head, a
+    sequence counter of all rows ever written. Writing row `head` overwrites
+    row `head - capacity`, so a reader only trusts the rows from
+    `head - capacity + 1` on: it copies those between the start and the
+    head and afterwards drops the rows the writer may have overwritten
+    meanwhile. A reset (new columns) makes VERSION odd while it runs and
+    even again after; a read that sees it odd or changed gives up.
+
+    Python has no memory fence, and weakly ordered CPUs (ARM, e.g. a
+    Raspberry Pi) may show a reader the new head before the row it covers.
+    So every slot also holds the sequence number of its row and a checksum
+    over the row and that number, and a reader drops every row from the
+    first one whose stamp or checksum does not match: it is read again the
+    next time. The column names carry a crc32 for the same reason.
+    """
+
+    def __init__(self, buf: memoryview, capacity: int, max_columns: int,
+                 timestamp_col: str = "timestamp"):
+        self.capacity = capacity
+        self.max_columns = max_columns
+        self.timestamp_col = timestamp_col
+        self.hits = 0
+        self.misses = 0
+
+        self._header = np.ndarray((8,), np.int64, buf, 0)
+        self._names = np.ndarray((NAMES_SIZE,), np.uint8, buf, RING_HEADER)
+        self._data = np.ndarray((capacity, max_columns + SLOT_EXTRA), np.float64, buf,
+                                RING_HEADER + NAMES_SIZE)
+        self._words = self._data.view(np.uint64)  # dezelfde slots, voor volgnummer en checksum
+        self._weights = _weights(max_columns)
+        self._version = -1
+        self._columns: list[str] = []
+        self._ts_index = 0
+
+    @staticmethod
+    def size(capacity: int, max_columns: int) -> int:
+        return RING_HEADER + NAMES_SIZE + capacity * (max_columns + SLOT_EXTRA) * 8
+
+    def __len__(self) -> int:
+        header = self._header
+        return int(min(header[HEAD] - header[START], self.capacity))
+
+    @property
+    def head(self) -> int:
+        return int(self._header[HEAD])
+
+    @property
+    def columns(self) -> list[str]:
+        version = int(self._header[VERSION])
+        if version != self._version and version % 2 == 0:
+            length = int(self._header[NAMES_LEN])
+            crc = int(self._header[NAMES_CRC])
+            names = self._names[:length].tobytes()
+            if int(self._header[VERSION]) != version or zlib.crc32(names) != crc:
+                return self._columns  # reset tijdens het lezen, of nog niet zichtbaar
+            columns = json.loads(names) if length else []
+            self._columns = columns
+            self._ts_index = columns.index(self.timestamp_col) if self.timestamp_col in columns else 0
+            self._version = version
+        return self._columns
+
+    def reset(self, columns: list[str], complete: bool):
+        header = self._header
+        names = json.dumps(list(columns)).encode()
+        fits = len(columns) <= self.max_columns and len(names) <= NAMES_SIZE
+        header[NCOLS] = 0
+        # oneven: lezers geven het op, ook als een vorige reset halverwege crashte
+        header[VERSION] |= 1
+        header[START] = header[HEAD]
+        header[COMPLETE] = int(complete)
+        if fits:
+            self._names[:len(names)] = np.frombuffer(names, np.uint8)
+            header[NAMES_LEN] = len(names)
+            header[NAMES_CRC] = zlib.crc32(names)
+            header[NCOLS] = len(columns)
+        else:
+            print(f"[shared] {len(columns)} columns do not fit, readers use the database")
+            header[NAMES_LEN] = 0
+            header[NAMES_CRC] = zlib.crc32(b"")
+        header[VERSION] += 1  # weer even
+
+        # de schrijver onthoudt de kolommen ook als ze niet pasten, anders
+        # zou elke rij een nieuwe reset geven
+        self._columns = list(columns)
+        self._ts_index = columns.index(self.timestamp_col) if self.timestamp_col in columns else 0
+        self._version = int(header[VERSION])
+
+    def append(self, values: list[float]):
+        header = self._header
+        n = int(header[NCOLS])
+        if n == 0:
+            return
+        head = int(header[HEAD])
+        slot = head % self.capacity
+        row = np.asarray(values, np.float64).reshape(1, n)
+        seq = np.array([head], np.uint64)
+        self._data[slot, :n] = row[0]
+        self._words[slot, self.max_columns] = seq[0]
+        self._words[slot, self.max_columns + 1] = _checksums(row.view(np.uint64), seq, self._weights)[0]
+        header[HEAD] = head + 1
+
+    def _read(self, after: int) -> tuple[np.ndarray, int, int, bool] | None:
+        """
+        Rows after sequence number `after` as (rows, first seq, head,
+        complete), or None when the ring was reset meanwhile.
+        """
+        header = self._header
+        version = int(header[VERSION])
+        if version % 2:
+            return None
+        columns = self.columns
+        n = int(header[NCOLS])
+        head = int(header[HEAD])
+        start = int(header[START])
+        # rij head kan al geschreven worden, en die overschrijft head - capacity
+        complete = bool(header[COMPLETE]) and head - start < self.capacity
+
+        first = max(after, start, head - self.capacity + 1)
+        slots = self._words[np.arange(first, head) % self.capacity]
+
+        # wat de schrijver intussen heeft overschreven valt af
+        oldest = int(header[HEAD]) - self.capacity + 1
+        if oldest > first:
+            slots = slots[oldest - first:]
+            first = oldest
+            complete = False
+        if int(header[VERSION]) != version or n != len(columns):
+            return None
+
+        # een rij die nog niet (helemaal) zichtbaar is, en alles erna, de volgende keer
+        seqs = np.arange(first, first + len(slots), dtype=np.uint64)
+        words = slots[:, :n]
+        valid = (slots[:, self.max_columns] == seqs) & \
+            (slots[:, self.max_columns + 1] == _checksums(words, seqs, self._weights))
+        if not valid.all():
+            head = first + int(np.argmin(valid))
+            words = words[:head - first]
+        return words.view(np.float64), first, head, complete
+
+    def since(self, timestamp: float) -> np.ndarray | None:
+        """
+        As RingBuffer.since: rows from the last row with a timestamp <=
+        `timestamp` onward, or None when that row may not be in memory.
+        """
+        result = self._read(0)
+        if result is None or len(result[0]) == 0:
+            self.misses += 1
+            return None
+        rows, _, _, complete = result
+        timestamps = rows[:, self._ts_index]
+        if timestamps[0] > timestamp and not complete:
+            self.misses += 1
+            return None
+        self.hits += 1
+        first = max(int(np.searchsorted(timestamps, timestamp, "right")) - 1, 0)
+        return rows[first:]
+
+    def rows_after(self, seq: int) -> tuple[np.ndarray, int]:
+        """Rows written after sequence number `seq`, and the new sequence number."""
+        result = self._read(seq)
+        if result is None:
+            return np.empty((0, 0)), seq
+        rows, _, head, _ = result
+        return rows, head
+
+    def stats(self) -> dict[str, float]:
+        return dict(hits=self.hits, misses=self.misses, rows=len(self),
+                    capacity=self.capacity, head=self.head)
+
+
+class SharedState:
+    """
+    A small blob (JSON) in shared memory behind a seqlock: the writer makes
+    the sequence number odd, writes, and makes it even again; a reader
+    retries until it copied the blob between two equal, even numbers. As
+    in SharedRing, a weakly ordered CPU can show the blob later than the
+    header, so the header also holds a crc32 of the blob and a blob that
+    does not match it is read again.
+    """
+
+    def __init__(self, buf: memoryview, size: int):
+        self._header = np.ndarray((3,), np.int64, buf, 0)
+        self._data = np.ndarray((size - BLOB_HEADER,), np.uint8, buf, BLOB_HEADER)
+        self._seq = -1
+        self._value: Any = None
+
+    def write(self, value: Any):
+        data = json.dumps(value).encode()
+        if len(data) > len(self._data):
+            print(f"[shared] state of {len(data)} bytes does not fit")
+            return
+        header = self._header
+        header[0] |= 1  # ook als een vorige schrijver halverwege crashte
+        self._data[:len(data)] = np.frombuffer(data, np.uint8)
+        header[1] = len(data)
+        header[2] = zlib.crc32(data)
+        header[0] += 1
+
+    def read(self, retries: int = 100) -> Any:
+        """The last written value, or None if nothing was written yet."""
+        header = self._header
+        for _ in range(retries):
+            seq = int(header[0])
+            if seq == self._seq:
+                return self._value
+            if seq % 2 == 0:
+                crc = int(header[2])
+                data = self._data[:int(header[1])].tobytes()
+                if int(header[0]) == seq and zlib.crc32(data) == crc:
+                    value = json.loads(data) if data else None
+                    self._seq = seq
+                    self._value = value
+                    return self._value
+            time.sleep(0)
+        return self._value
+
+
+class SharedArea:
+    """
+    One shared memory segment divided into named regions (rings and
+    blobs) by a directory at its start. The supervisor creates the segment;
+    the acquisition process allocates the regions and finds them back
+    after a restart, the API process looks them up.
+    """
+
+    def __init__(self, name: str | None = None, size: int = 0, create: bool = False):
+        self.shm = shared_memory.SharedMemory(name, create=create, size=size)
+        self._directory = np.ndarray((8,), np.int64, self.shm.buf, 0)
+        if create:
+            self._directory[:] = 0
+            self._directory[0] = MAGIC
+            self._directory[2] = DIRECTORY_SIZE
+        elif self._directory[0] != MAGIC:
+            raise ValueError(f"{name} is not a dashboard shared memory segment")
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def _find(self, name: str) -> tuple[int, int, int, int] | None:
+        key = name.encode()
+        for i in range(int(self._directory[1])):
+            entry = ENTRY.unpack_from(self.shm.buf, 64 + i * ENTRY.size)
+            if entry[0].rstrip(b"\0") == key:
+                return entry[1:]
+        return None
+
+    def _region(self, name: str, size: int, a: int, b: int, create: bool) -> tuple[int, int, int, int] | None:
+        entry = self._find(name)
+        if entry is not None:
+            if entry[1] != size or entry[2] != a or entry[3] != b:
+                raise ValueError(f"shared region `{name}` has another layout")
+            return entry
+        if not create:
+            return None
+
+        count = int(self._directory[1])
+        offset = int(self._directory[2])
+        offset += -offset % ALIGN
+        if count == MAX_ENTRIES or offset + size > self.shm.size:
+            raise MemoryError(f"no room for shared region `{name}` ({size} bytes)")
+        self.shm.buf[offset:offset + size] = bytes(size)
+        ENTRY.pack_into(self.shm.buf, 64 + count * ENTRY.size, name.encode(), offset, size, a, b)
+        self._directory[2] = offset + size
+        self._directory[1] = count + 1  # als laatste: pas nu zichtbaar
+        return offset, size, a, b
+
+    def ring(self, name: str, capacity: int, max_columns: int, create: bool = False,
+             timestamp_col: str = "timestamp") -> SharedRing | None:
+        """The ring `name`, allocated if needed with `create`, else None if it does not exist."""
+        size = SharedRing.size(capacity, max_columns)
+        entry = self._region("ring:" + name, size, capacity, max_columns, create)
+        if entry is None:
+            return None
+        offset = entry[0]
+        return SharedRing(self.shm.buf[offset:offset + size], capacity, max_columns, timestamp_col)
+
+    def state(self, name: str, size: int, create: bool = False) -> SharedState | None:
+        entry = self._region("state:" + name, size, 0, 0, create)
+        if entry is None:
+            return None
+        offset = entry[0]
+        return SharedState(self.shm.buf[offset:offset + size], size)
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
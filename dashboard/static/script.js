@@ -3,9 +3,10 @@
 // -----------------------------
 
 const sinceseconds = 60; // = 2 minute; Max number of data points retained per chart
+const streamRenderDelay = 250; // ms; bundel stream-events per chart update
 
 let charts = [];
-let lastTimestamp = null; // Track newest timestamp to fetch/update correctly
+let lastTimestamps = null; // Nieuwste timestamp per predictor; die lopen niet gelijk op
 let collectorActive = false;
 let replayActive = false;
 
@@ -58,8 +59,8 @@ function fetchCollector() {
     return apiCall(`/api/get_collector`);
 }
 
-function doReplay(time) {
-    return apiCall(`/api/replay?since=${time}`, "POST");
+function doReplay(time, speed) {
+    return apiCall(`/api/replay?since=${time}&speed=${speed}`, "POST");
 }
 
 function cancelReplay() {
@@ -175,7 +176,8 @@ async function initializeCharts() {
 
     clearCharts();
 
-    lastTimestamp = allData.none[allData.none.length - 1].timestamp;
+    lastTimestamps = {};
+    updateLastTimestamps(allData);
 
     sensors.sensors.forEach((sensorKey, i) =>
         createChartForSensor(sensorKey, i, allData, sensors.predictors)
@@ -183,21 +185,38 @@ async function initializeCharts() {
 }
 
 /**
- * Haal nieuwe data op en schuif de bestaande charts door
+ * Onthoud per predictor de laatst getoonde timestamp
  */
-async function update() {
-    // Als charts nog niet zijn opgebouwd (of geen data), doe niks
-    if (!lastTimestamp) return;
+function updateLastTimestamps(newData) {
+    for (let predname in newData) {
+        const rows = newData[predname];
+        if (!rows?.length) continue;
+        const last = rows[rows.length - 1].timestamp;
+        if (!(last <= lastTimestamps[predname])) {
+            lastTimestamps[predname] = last;
+        }
+    }
+}
 
-    const sensorData = await fetchSensorData(lastTimestamp);
-    const newData = sensorData.values;
-    if (!newData || newData.length === 0) return;
+/**
+ * Vroegste van de laatste timestamps: vanaf daar mist er bij een predictor nog data
+ */
+function pollSince() {
+    const values = Object.values(lastTimestamps);
+    return values.length ? Math.min(...values) : Date.now() / 1000 - sinceseconds;
+}
 
+/**
+ * Voeg nieuwe rijen (per predictor) toe en schuif de bestaande charts door
+ */
+function appendRows(newData) {
     charts.forEach(({ chart, sensorKey, latestDataEl, predictors }) => {
         for (let predname in newData) {
             let index = predictors.indexOf(predname);
+            if (index < 0) continue;
+            const last = lastTimestamps[predname] ?? -Infinity;
             for (let row of newData[predname]) {
-                if (row.timestamp <= lastTimestamp) continue;
+                if (row.timestamp <= last) continue;
 
                 const sensor = row.sensors[sensorKey];
                 const value =
@@ -212,7 +231,7 @@ async function update() {
             }
 
             let since = Date.now() / 1000 - sinceseconds;
-            while (chart.data.datasets[index].data[0].x < since) {
+            while (chart.data.datasets[index].data[0]?.x < since) {
                 chart.data.datasets[index].data.shift();
             }
         }
@@ -226,14 +245,16 @@ async function update() {
         chart.update();
     });
 
-    lastTimestamp = newData.none[newData.none.length - 1].timestamp;
+    updateLastTimestamps(newData);
+}
 
-    const valves = await fetchValves();
+function updateValves(valves) {
     for (let name in valves) {
         updateValveText(name, valves[name].state, valves[name].wants);
     }
+}
 
-    const collector = await fetchCollector();
+function updateCollector(collector) {
     if (collector.active) {
         if (!collectorActive) {
             activateCollector();
@@ -254,28 +275,37 @@ async function update() {
             deactivateCollector();
         }
     }
+}
 
-    if (sensorData.replay) {
+function updateReplay(replay) {
+    if (replay) {
         if (!replayActive) {
             activateReplay();
         }
 
         const progress = document.getElementById("replay-progress");
-        const timestr = new Date(
-            sensorData.replay.timestamp * 1000
-        ).toLocaleTimeString([], {
-            day: "2-digit",
-            month: "2-digit",
-            year: "2-digit",
-            hour: "2-digit",
-            minute: "2-digit",
-            second: "2-digit",
-            hour12: false,
-        });
-        const percent = (sensorData.replay.progress * 100).toFixed(1);
+        const timestr = new Date(replay.timestamp * 1000).toLocaleTimeString(
+            [],
+            {
+                day: "2-digit",
+                month: "2-digit",
+                year: "2-digit",
+                hour: "2-digit",
+                minute: "2-digit",
+                second: "2-digit",
+                hour12: false,
+            }
+        );
+        const percent = (replay.progress * 100).toFixed(1);
+        let speed = "";
+        if (replay.paused) {
+            speed = " (paused)";
+        } else if (replay.achieved_speed) {
+            speed = ` (${replay.achieved_speed.toFixed(1)}x)`;
+        }
 
         progress.classList.remove("hidden");
-        progress.innerHTML = `${percent}% &mdash; replaying at ${timestr}`;
+        progress.innerHTML = `${percent}% &mdash; replaying at ${timestr}${speed}`;
     } else {
         if (replayActive) {
             deactivateReplay();
@@ -283,6 +313,58 @@ async function update() {
     }
 }
 
+/**
+ * Haal nieuwe data op via polling (als server-sent events niet beschikbaar zijn)
+ */
+async function update() {
+    // Als charts nog niet zijn opgebouwd (of geen data), doe niks
+    if (!lastTimestamps) return;
+
+    const sensorData = await fetchSensorData(pollSince());
+    const newData = sensorData.values;
+    if (!newData || newData.length === 0) return;
+
+    appendRows(newData);
+    updateValves(await fetchValves());
+    updateCollector(await fetchCollector());
+    updateReplay(sensorData.replay);
+}
+
+/**
+ * Ontvang nieuwe rijen en statuswijzigingen via /api/stream.
+ * Rijen worden gebundeld zodat de charts niet bij elk event hertekenen.
+ */
+function startStream() {
+    const source = new EventSource("/api/stream");
+    let pending = {};
+    let scheduled = false;
+
+    source.addEventListener("sensor_data", (event) => {
+        const { predictor, row } = JSON.parse(event.data);
+        (pending[predictor] ??= []).push(row);
+        if (!scheduled) {
+            scheduled = true;
+            setTimeout(() => {
+                scheduled = false;
+                if (!lastTimestamps) return;
+                const rows = pending;
+                pending = {};
+                appendRows(rows);
+            }, streamRenderDelay);
+        }
+    });
+    source.addEventListener("valves", (event) =>
+        updateValves(JSON.parse(event.data))
+    );
+    source.addEventListener("collector", (event) =>
+        updateCollector(JSON.parse(event.data))
+    );
+    source.addEventListener("replay", (event) =>
+        updateReplay(JSON.parse(event.data))
+    );
+    return source;
+}
+
 // -----------------------------
 // Valves UI
 // -----------------------------
@@ -525,8 +607,9 @@ async function handleReplay(event) {
 
     if (!replayActive) {
         const timeForm = document.getElementById("replay-time");
-        const timestamp = Date.parse(timeForm.value);
-        doReplay(timestamp).then(activateReplay).catch(console.error);
+        const speedForm = document.getElementById("replay-speed");
+        const timestamp = Date.parse(timeForm.value) / 1000;
+        doReplay(timestamp, speedForm.value).then(activateReplay).catch(console.error);
     } else {
         cancelReplay().then(deactivateReplay).catch(console.error);
     }
@@ -546,5 +629,9 @@ document.addEventListener("DOMContentLoaded", () => {
     initializeCharts();
     createValves();
 
-    setInterval(update, 1500);
+    if (window.EventSource) {
+        startStream();
+    } else {
+        setInterval(update, 1500);
+    }
 });
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import argparse
+import multiprocessing
+from multiprocessing.connection import AuthenticationError, Client, Listener
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+from typing import Any
+
+from .shared_ring import SharedArea
+
+ROLES = ["acquisition", "api"]
+STABLE_TIME = 60  # seconds a process must run before its restart delay resets
+
+
+class CommandClient:
+    """
+    API side of the command channel: one connection to the acquisition
+    process per request. A crashed or restarting acquisition process just
+    refuses the connection, nothing is left half-read.
+    """
+
+    def __init__(self, address: str, authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+
+    def call(self, path: str, method: str, query: str, data: bytes,
+             headers: list[tuple[str, str]], timeout: float) -> tuple[int, list[tuple[str, str]], bytes] | None:
+        """(status, headers, body) of the request, or None when the acquisition does not answer."""
+        try:
+            with Client(self.address, "AF_UNIX", authkey=self.authkey) as conn:
+                conn.send((path, method, query, data, headers))
+                if not conn.poll(timeout):
+                    return None
+                return conn.recv()
+        except (OSError, EOFError, AuthenticationError):
+            return None
+
+
+def serve_commands(app: Any, address: str, authkey: bytes):
+    """
+    Acquisition side of the command channel: run every request through the
+    Flask app in its own thread, so a slow one (a profile) does not hold
+    up the others.
+    """
+
+    def handle(conn: Any):
+        with conn:
+            try:
+                path, method, query, data, headers = conn.recv()
+                with app.test_client() as client:
+                    response = client.open(path, method=method, query_string=query,
+                                           data=data, headers=headers)
+                    conn.send((response.status_code,
+                               [(k, v) for k, v in response.headers.items() if k != "Content-Length"],
+                               response.get_data()))
+                    response.close()
+            except (OSError, EOFError):
+                pass  # de API heeft het opgegeven
+
+    if os.path.exists(address):
+        os.remove(address)  # van een vorige, gecrashte acquisitie
+    with Listener(address, "AF_UNIX", authkey=authkey) as listener:
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, AuthenticationError):
+                continue
+            threading.Thread(target=handle, args=(conn,), name="command", daemon=True).start()
+
+
+def _terminate(signum, frame):
+    sys.exit(0)
+
+
+def run(role: str, shm_name: str, address: str, authkey: bytes):
+    """Entry point of a child: the api_server in `role`."""
+    os.environ["DASHBOARD_ROLE"] = role
+    os.environ["DASHBOARD_SHM"] = shm_name
+    signal.signal(signal.SIGTERM, _terminate)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # de supervisor stopt ons
+
+    from . import api_server
+    api_server.main((address, authkey))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Start de acquisitie en de API in aparte processen en herstart ze bij een crash.")
+    parser.add_argument("--shm-size", type=int, default=16,
+                        help="grootte van het gedeelde geheugen in MiB")
+    parser.add_argument("--restart-delay", type=float, default=1.0,
+                        help="seconden voor de eerste herstart, verdubbelt bij elke volgende")
+    parser.add_argument("--max-restart-delay", type=float, default=30.0,
+                        help="maximum aantal seconden tussen herstarts")
+    args = parser.parse_args()
+
+    # spawn: de kinderen beginnen schoon, zonder geërfde threads of hardware
+    ctx = multiprocessing.get_context("spawn")
+    area = SharedArea(size=args.shm_size * 2**20, create=True)
+    address = os.path.join(tempfile.gettempdir(), f"{area.name}.sock")
+    authkey = os.urandom(32)
+    print(f"[supervisor] shared memory {area.name}, {args.shm_size} MiB, commands on {address}")
+
+    signal.signal(signal.SIGTERM, _terminate)
+    processes: dict[str, Any] = dict.fromkeys(ROLES)
+    started = dict.fromkeys(ROLES, 0.0)
+    next_start = dict.fromkeys(ROLES, 0.0)
+    delays = dict.fromkeys(ROLES, args.restart_delay)
+    try:
+        while True:
+            now = time.time()
+            for role in ROLES:
+                process = processes[role]
+                if process is not None and process.is_alive():
+                    if now - started[role] > STABLE_TIME:
+                        delays[role] = args.restart_delay
+                    continue
+                if process is not None:
+                    print(f"[supervisor] {role} exited with {process.exitcode}, "
+                          f"restarting in {delays[role]:g}s")
+                    processes[role] = None
+                    next_start[role] = now + delays[role]
+                    delays[role] = min(delays[role] * 2, args.max_restart_delay)
+                if now >= next_start[role]:
+                    process = ctx.Process(target=run, args=(role, area.name, address, authkey),
+                                          name=f"dashboard-{role}")
+                    process.start()
+                    processes[role] = process
+                    started[role] = now
+                    print(f"[supervisor] started {role} as {process.pid}")
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes.values():
+            if process is not None:
+                process.terminate()
+        for process in processes.values():
+            if process is not None:
+                process.join(10)
+                if process.is_alive():
+                    process.kill()
+        area.close()
+        area.unlink()
+        if os.path.exists(address):
+            os.remove(address)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+# =========================
+# Export voor het dashboard
+# =========================
+
+import keras
+import numpy as np
+
+
+def export_keras_model(model: keras.Model, path: str):
+    """
+    Write the Dense layers of a Sequential Keras model to `<path>.npz` for
+    NumpyAutoencoderPredictor (dashboard/predictor.py).
+    """
+    weights: dict[str, np.ndarray] = {}
+    activations = []
+    for layer in model.layers:
+        if isinstance(layer, (keras.layers.InputLayer, keras.layers.Dropout)):
+            continue
+        if not isinstance(layer, keras.layers.Dense):
+            raise ValueError(f"unsupported layer `{type(layer).__name__}`")
+        kernel, bias = layer.get_weights()
+        weights[f"kernel{len(activations)}"] = kernel
+        weights[f"bias{len(activations)}"] = bias
+        activations.append(layer.get_config()["activation"])
+    np.savez(path + ".npz", activations=np.array(activations), **weights)
@@ -16,6 +16,8 @@ from keras import layers
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor
 
+from export import export_keras_model
+
 
 @dataclass
 class DataSet:
@@ -139,6 +141,11 @@ class AutoencoderTrainer(ModelTrainer):
         return model
 
     def save(self, model: keras.Model, data: DataSet, output_prefix: str) -> None:
+        # Dense-gewichten voor NumpyAutoencoderPredictor (zie dashboard/predictor.py),
+        # eerst: een laag die hij niet kan uitvoeren geeft een fout voordat er
+        # iets is opgeslagen
+        export_keras_model(model, output_prefix)
+
         # Save model
         model.save(output_prefix + ".keras")
 
@@ -152,6 +159,7 @@ class AutoencoderTrainer(ModelTrainer):
             json.dump(meta, jsonf, indent=4)
 
         print(f"[AE] Saved model to {output_prefix}.keras")
+        print(f"[AE] Saved weights to {output_prefix}.npz")
         print(f"[AE] Saved metadata to {output_prefix}.json")
 
 
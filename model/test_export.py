@@ -0,0 +1,58 @@
+import json
+
+import numpy as np
+import pytest
+
+keras = pytest.importorskip("keras")
+
+from dashboard.predictor import KerasPredictor, NumpyAutoencoderPredictor
+from model.export import export_keras_model
+
+TOLERANCE = 1e-4  # zoals PARITY_TOLERANCE van dashboard/export_ae.py
+FEATURES = [f"sensors.flow{i}.value" for i in range(5)] + ["valves.change_time"]
+
+
+def autoencoder(prefix: str, layers: list) -> np.random.Generator:
+    """Save an untrained model with its metadata under `prefix`."""
+    rng = np.random.default_rng(0)
+    model = keras.Sequential([keras.layers.Input(shape=(len(FEATURES),))] + layers)
+    model.save(prefix + ".keras")
+    export_keras_model(model, prefix)
+    with open(prefix + ".json", "w") as f:
+        json.dump(dict(feature_names=FEATURES,
+                       mean=rng.uniform(0, 5, len(FEATURES)).tolist(),
+                       std=rng.uniform(0.5, 2, len(FEATURES)).tolist()), f)
+    return rng
+
+
+def test_numpy_matches_keras(tmp_path):
+    prefix = str(tmp_path / "ae")
+    rng = autoencoder(prefix, [
+        keras.layers.Dropout(0.1),
+        keras.layers.Dense(32, activation="relu"),
+        keras.layers.Dense(16, activation="tanh"),
+        keras.layers.Dense(32, activation="sigmoid"),
+        keras.layers.Dense(len(FEATURES), activation="linear"),
+    ])
+    reference = KerasPredictor(prefix, ["valves.change_time"])
+    candidate = NumpyAutoencoderPredictor(prefix, ["valves.change_time"])
+
+    x = rng.normal(reference.mean, reference.std, (256, len(FEATURES))).astype("float32")
+    x_norm = (x - reference.mean) / reference.std
+    np.testing.assert_allclose(candidate._predict_row(x_norm.copy()),
+                               reference._predict_row(x_norm), atol=TOLERANCE)
+    np.testing.assert_allclose(candidate.predict_batch(x), reference.predict_batch(x),
+                               atol=TOLERANCE * float(reference.std.max()))
+
+    row = dict(zip(FEATURES, x[0].tolist()))
+    expected = reference.predict(row)
+    for name, value in candidate.predict(row).items():
+        assert value == pytest.approx(expected[name], abs=TOLERANCE * float(reference.std.max()))
+
+
+def test_unsupported_layer(tmp_path):
+    model = keras.Sequential([keras.layers.Input(shape=(len(FEATURES),)),
+                              keras.layers.BatchNormalization(),
+                              keras.layers.Dense(len(FEATURES))])
+    with pytest.raises(ValueError, match="BatchNormalization"):
+        export_keras_model(model, str(tmp_path / "ae"))